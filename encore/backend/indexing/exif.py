@@ -0,0 +1,313 @@
+#
+# encore/backend/indexing/exif.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+"""
+Reads the EXIF metadata of JPEG photos. Only the segments at the start of
+the file are read, up to where the compressed image data begins, so the
+image itself is never decoded.
+
+The metadata is returned in a dict, which holds those of 'taken' (a
+datetime.datetime), 'make', 'model', 'orientation', 'width', 'height',
+'latitude' and 'longitude' that the photo has.
+"""
+
+import struct
+import logging
+import datetime
+
+log = logging.getLogger(__name__)
+
+# Markers of the start of frame segments, which hold the dimensions of
+# the image. The others in the range C0-CF are DHT, JPG and DAC.
+SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+# Markers that have no segment following them
+STANDALONE_MARKERS = set([0x01] + range(0xD0, 0xD8))
+
+SOS = 0xDA
+EOI = 0xD9
+APP1 = 0xE1
+
+# The size in bytes of a value of each TIFF field type
+TYPE_SIZES = {
+    1: 1,   # BYTE
+    2: 1,   # ASCII
+    3: 2,   # SHORT
+    4: 4,   # LONG
+    5: 8,   # RATIONAL
+    7: 1,   # UNDEFINED
+    9: 4,   # SLONG
+    10: 8   # SRATIONAL
+}
+
+# The tags read from the first IFD
+MAKE = 0x010F
+MODEL = 0x0110
+ORIENTATION = 0x0112
+DATE_TIME = 0x0132
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+
+# The tags read from the Exif IFD
+DATE_TIME_ORIGINAL = 0x9003
+DATE_TIME_DIGITIZED = 0x9004
+PIXEL_X_DIMENSION = 0xA002
+PIXEL_Y_DIMENSION = 0xA003
+
+# The tags read from the GPS IFD
+GPS_LATITUDE_REF = 1
+GPS_LATITUDE = 2
+GPS_LONGITUDE_REF = 3
+GPS_LONGITUDE = 4
+
+# The most entries read from an IFD
+MAX_ENTRIES = 512
+
+class ExifError(Exception):
+    pass
+
+def read_exif(path):
+    """
+    Read the EXIF metadata of a JPEG.
+
+    :param path: The path to the file
+    :type path: str
+    :returns: The metadata
+    :rtype: dict
+    :raises IOError: If the file can't be read
+    """
+    fp = open(path, 'rb')
+    try:
+        exif = {}
+        try:
+            read_jpeg(fp, exif)
+        except (ExifError, struct.error, ValueError) as e:
+            log.debug('Unable to read all of the EXIF of %s: %s', path, e)
+        return exif
+    finally:
+        fp.close()
+
+def read_file_exif(path):
+    """
+    Read the EXIF metadata of a JPEG, returning None if it can't be read.
+    """
+    try:
+        return read_exif(path)
+    except (IOError, OSError):
+        return None
+
+def read_jpeg(fp, exif):
+    """
+    Walk the segments of a JPEG up to the start of the image data,
+    reading the EXIF segment and the dimensions of the image.
+    """
+    if fp.read(2) != '\xff\xd8':
+        return
+
+    # There may be other APP1 segments, e.g. holding XMP
+    read_app1 = False
+    while True:
+        byte = fp.read(1)
+        if not byte:
+            return
+        if byte != '\xff':
+            raise ExifError('Expected a marker')
+
+        # Markers may be padded with any number of 0xFF bytes
+        marker = ord(_read(fp, 1))
+        while marker == 0xFF:
+            marker = ord(_read(fp, 1))
+        if marker in (SOS, EOI):
+            return
+        if marker in STANDALONE_MARKERS:
+            continue
+
+        size = struct.unpack('>H', _read(fp, 2))[0] - 2
+        if size < 0:
+            raise ExifError('Invalid segment size')
+
+        if marker == APP1 and not read_app1:
+            data = _read(fp, size)
+            if data.startswith('Exif\x00\x00'):
+                read_app1 = True
+                try:
+                    read_tiff(data[6:], exif)
+                except (ExifError, struct.error, ValueError) as e:
+                    # Carry on to the frame header for the dimensions
+                    log.debug('Invalid EXIF segment: %s', e)
+        elif marker in SOF_MARKERS:
+            data = _read(fp, size)
+            height, width = struct.unpack('>HH', data[1:5])
+            if width and height:
+                exif['width'], exif['height'] = width, height
+        else:
+            fp.seek(size, 1)
+
+def _read(fp, size):
+    data = fp.read(size)
+    if len(data) < size:
+        raise ExifError('Unexpected end of file')
+    return data
+
+# TIFF
+
+def read_tiff(data, exif):
+    """
+    Read the metadata from the TIFF structure held in an EXIF segment.
+    """
+    if data[:2] == 'II':
+        order = '<'
+    elif data[:2] == 'MM':
+        order = '>'
+    else:
+        raise ExifError('Invalid byte order')
+    if struct.unpack(order + 'H', data[2:4])[0] != 42:
+        raise ExifError('Invalid TIFF header')
+
+    offset = struct.unpack(order + 'I', data[4:8])[0]
+    ifd0 = _read_ifd(data, order, offset)
+    exif_ifd = {}
+    gps_ifd = {}
+    if _number(ifd0.get(EXIF_IFD)) is not None:
+        exif_ifd = _read_ifd(data, order, _number(ifd0[EXIF_IFD]))
+    if _number(ifd0.get(GPS_IFD)) is not None:
+        gps_ifd = _read_ifd(data, order, _number(ifd0[GPS_IFD]))
+
+    for name, tag in (('make', MAKE), ('model', MODEL)):
+        value = _text(ifd0.get(tag))
+        if value:
+            exif[name] = value
+
+    orientation = _number(ifd0.get(ORIENTATION))
+    if orientation and 1 <= orientation <= 8:
+        exif['orientation'] = orientation
+
+    for ifd, tag in ((exif_ifd, DATE_TIME_ORIGINAL),
+            (exif_ifd, DATE_TIME_DIGITIZED), (ifd0, DATE_TIME)):
+        taken = _datetime(ifd.get(tag))
+        if taken:
+            exif['taken'] = taken
+            break
+
+    # Only used if the frame header doesn't come after the EXIF segment
+    width = _number(exif_ifd.get(PIXEL_X_DIMENSION))
+    height = _number(exif_ifd.get(PIXEL_Y_DIMENSION))
+    if width and height:
+        exif['width'], exif['height'] = width, height
+
+    latitude = _coordinate(gps_ifd.get(GPS_LATITUDE),
+        gps_ifd.get(GPS_LATITUDE_REF), 'S', 90)
+    longitude = _coordinate(gps_ifd.get(GPS_LONGITUDE),
+        gps_ifd.get(GPS_LONGITUDE_REF), 'W', 180)
+    if latitude is not None and longitude is not None:
+        exif['latitude'], exif['longitude'] = latitude, longitude
+
+def _read_ifd(data, order, offset):
+    """
+    Read the entries of an IFD, returning a dict of tag to values. ASCII
+    and UNDEFINED values are returned as strings, the rest as tuples,
+    with rationals as floats.
+    """
+    if offset + 2 > len(data):
+        raise ExifError('IFD out of range')
+    count = struct.unpack(order + 'H', data[offset:offset + 2])[0]
+    if count > MAX_ENTRIES:
+        raise ExifError('Too many IFD entries')
+
+    entries = {}
+    for i in xrange(count):
+        entry = offset + 2 + i * 12
+        if entry + 12 > len(data):
+            raise ExifError('IFD entry out of range')
+        tag, field_type, n = struct.unpack(order + 'HHI',
+            data[entry:entry + 8])
+        if field_type not in TYPE_SIZES:
+            continue
+
+        size = TYPE_SIZES[field_type] * n
+        if size <= 4:
+            start = entry + 8
+        else:
+            start = struct.unpack(order + 'I', data[entry + 8:entry + 12])[0]
+        value = data[start:start + size]
+        if len(value) < size:
+            continue
+
+        if field_type in (2, 7):
+            entries[tag] = value
+        elif field_type in (5, 10):
+            fmt = field_type == 5 and 'I' or 'i'
+            parts = struct.unpack(order + fmt * (2 * n), value)
+            entries[tag] = tuple(
+                parts[j + 1] and float(parts[j]) / parts[j + 1] or 0.0
+                for j in xrange(0, len(parts), 2))
+        else:
+            fmt = {1: 'B', 3: 'H', 4: 'I', 9: 'i'}[field_type]
+            entries[tag] = struct.unpack(order + fmt * n, value)
+    return entries
+
+def _number(value):
+    """
+    Return the first value of an integer tag, or None if the tag is of
+    another type.
+    """
+    if isinstance(value, tuple) and value and \
+            isinstance(value[0], (int, long)):
+        return value[0]
+    return None
+
+def _text(value):
+    """
+    Return the value of an ASCII tag, or None if the tag is of another
+    type.
+    """
+    if not value or not isinstance(value, str):
+        return None
+    value = value.split('\x00', 1)[0].strip()
+    return value.decode('utf-8', 'replace') or None
+
+def _datetime(value):
+    """
+    Parse an EXIF date, e.g. '2010:06:21 14:05:33'. Cameras that don't
+    know the date often fill it with zeros or spaces.
+    """
+    value = _text(value)
+    if not value:
+        return None
+    try:
+        return datetime.datetime.strptime(value[:19], '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+
+def _coordinate(value, ref, negative, limit):
+    """
+    Convert a GPS coordinate in degrees, minutes and seconds to decimal
+    degrees.
+    """
+    if not isinstance(value, tuple) or len(value) != 3:
+        return None
+    degrees = float(value[0]) + value[1] / 60.0 + value[2] / 3600.0
+    if degrees > limit:
+        return None
+    if _text(ref) == negative:
+        degrees = -degrees
+    return degrees
@@ -20,110 +20,317 @@
 #   Boston, MA    02110-1301, USA.
 #
 
+import os
 import logging
 
-from twisted.internet import reactor, defer
+from twisted.internet import defer, reactor, threads
 
 from encore.config import config
 from encore.backend.model import *
+from encore.backend.indexing.exif import read_file_exif
+from encore.backend.indexing.hashing import fingerprint_file
+from encore.backend.indexing.similar import SimilarPhotos
+from encore.backend.indexing.tags import TagReader
+from encore.backend.indexing.thumbnails import Thumbnailer
 from encore.backend.indexing.utilities import TagGetter
 from encore.backend.indexing.video_metadata import *
+from encore.utils.lru import LRUCache
+from encore.utils.text import normalize_title, title_key
 
 log = logging.getLogger(__name__)
 
-class FileHandler(object):
+def _tag_number(tags, name):
+    """
+    Return a numeric tag as an int, or None if it isn't set or valid.
+    """
+    try:
+        return int(tags[name])
+    except (KeyError, ValueError):
+        return None
+
+class WriteBatch(object):
     """
-    Abstract class for all indexing file handlers.
+    Collects the items handled in the same turn of the reactor, so that
+    they can be stored with a single write rather than a write each.
+
+    :param func: Called as func(session, items) in the writer thread,
+        returning a list with the result for each item
+    :type func: callable
     """
 
-    def __init__(self):
-        self.deferreds = {}
+    def __init__(self, func):
+        self.func = func
+        self.clock = reactor
+        self._pending = []
+        self._write_call = None
+
+    def add(self, item):
+        """
+        Add an item to the next write.
+
+        :returns: A Deferred that fires with the result for the item once
+            it has been written
+        :rtype: twisted.internet.defer.Deferred
+        """
+        d = defer.Deferred()
+        self._pending.append((item, d))
+        if not self._write_call:
+            self._write_call = self.clock.callLater(0, self._write)
+        return d
+
+    def _write(self):
+        self._write_call = None
+        pending, self._pending = self._pending, []
+
+        def on_written(results):
+            for (item, d), result in zip(pending, results):
+                d.callback(result)
+
+        def on_failed(failure):
+            for (item, d) in pending:
+                d.errback(failure)
 
-    def _deferred(self, filename):
-        self.deferreds[filename] = defer.Deferred()
-        return self.deferreds[filename]
+        db.write(self.func, [item for (item, d) in pending]).addCallbacks(
+            on_written, on_failed)
 
-    def _callback(self, filename, result):
-        self.deferreds.pop(filename).callback(result)
+class FileHandler(object):
+    """
+    Abstract class for all indexing file handlers. Calling a handler with
+    a filename returns a Deferred that fires once the file has been
+    indexed.
+
+    Files are fingerprinted before they are indexed. If the fingerprint
+    matches that of an indexed file which no longer exists, the file has
+    been moved and its row is updated with the new path rather than the
+    file being indexed again.
+    """
+
+    # The maximum number of files of this type the indexer will have
+    # handled at once.
+    concurrency = 4
+
+    # The model classes the handler stores files as
+    models = ()
 
     def __call__(self, filename):
+        if not self.models:
+            return self.index(filename, None)
+        return threads.deferToThread(fingerprint_file, filename).addCallback(
+            self._got_fingerprint, filename)
+
+    def _got_fingerprint(self, fingerprint, filename):
+        if not fingerprint:
+            return self.index(filename, None)
+        return db.write(self._adopt_moved, filename, fingerprint).addCallback(
+            self._adopted, filename, fingerprint)
+
+    def _adopt_moved(self, session, filename, fingerprint):
+        """
+        Find an indexed file with the same fingerprint that has vanished
+        and move it to filename. Files that have been indexed already, e.g.
+        a copy of the vanished file, are indexed again instead.
+        """
+        for model in self.models:
+            if session.query(model.id).filter_by(path=filename).first():
+                return None
+
+        for model in self.models:
+            for row in session.query(model).filter_by(
+                    fingerprint=fingerprint):
+                if row.path != filename and not os.path.exists(row.path):
+                    log.info('Recognised %s as %s', filename, row.path)
+                    row.path = unicode(filename)
+                    return row
+
+    def _adopted(self, row, filename, fingerprint):
+        if row:
+            return row
+        return self.index(filename, fingerprint)
+
+    def index(self, filename, fingerprint):
+        """
+        Index a file that hasn't been recognised as a moved one.
+
+        :param filename: The path to the file
+        :type filename: str
+        :param fingerprint: The fingerprint of the file, if it has one
+        :type fingerprint: str
+        """
         raise NotImplementedError
 
+    def moved(self, old_filename, filename):
+        """
+        Called when a previously indexed file has been moved or renamed.
+        By default the file is handled as if it were new.
+        """
+        return self(filename)
+
+    def removed(self, filename):
+        """
+        Called when a previously indexed file no longer exists.
+        """
+        return defer.succeed(None)
+
 class VideoHandler(FileHandler):
     """
     Base-class for indexing video files.
     """
 
-    def __call__(self, filename):
+    # Indexing videos means talking to thetvdb.org and themoviedb.org, so
+    # keep the number of requests in flight down.
+    concurrency = 2
+
+    models = (Episode, Movie)
+
+    def index(self, filename, fingerprint):
         file_info = parse_path(filename)
         if file_info.season:
-            reactor.calllLater(0, self._handle_series, filename, file_info)
+            return self._handle_series(filename, file_info, fingerprint)
         else:
-            reactor.callLater(0, self._handle_movie, filename, file_info)
-        return self._deferred(filename)
+            return self._handle_movie(filename, file_info)
 
-    def _handle_series(self, filename, file_info):
+    def _handle_series(self, filename, file_info, fingerprint):
         """
         Add or update an episode to the store.
         """
-        show = db.query(Show).filter(Show.title.like(file_info.title)).first()
-        if not show:
-            get_series_metadata(file_info.title).addCallback(
-                self._got_series_metadata, filename, file_info)
-        else:
-            pass
+        # Looked up with the writer's session, so that a show stored by
+        # the episodes before this one is found even if its batch hasn't
+        # been committed yet.
+        return db.write(self._find_series, file_info.title).addCallback(
+            self._got_series, filename, file_info, fingerprint)
 
-    def _got_series_metadata(self, data, filename, file_info):
+    def _find_series(self, session, title):
+        """
+        Look the series a title belongs to up in the store.
+
+        :returns: A tuple of (series_id, stored), where stored is whether
+            the show has been added to the store
+        :rtype: tuple
+        """
+        alias = session.query(ShowAlias).get(title_key(title))
+        if alias:
+            stored = session.query(Show.id).filter_by(
+                series_id=alias.series_id).first()
+            return (alias.series_id, bool(stored))
+
+        show = session.query(Show).filter_by(
+            normalized_title=normalize_title(title)).first()
+        if show:
+            return (show.series_id, True)
+        return (None, False)
+
+    def _got_series(self, result, filename, file_info, fingerprint):
+        series_id, stored = result
+        if stored:
+            return self._fetch_season(series_id, filename, file_info,
+                fingerprint)
+
+        # Only search for the series if the title hasn't been seen before
+        return get_series_metadata(series_id or file_info.title).addCallback(
+            self._got_series_metadata, filename, file_info, fingerprint)
+
+    def _got_series_metadata(self, data, filename, file_info, fingerprint):
         """
         Handles adding or updating the series metadata in the database.
         """
+        return db.write(self._store_series, data, file_info.title
+            ).addCallback(self._fetch_season, filename, file_info,
+                fingerprint)
+
+    def _store_series(self, session, data, title=None):
+        show = session.query(Show).filter_by(series_id=int(data.id)).first()
 
         # If the show doesn't exist it needs to be created
         if not show:
             show = Show()
-            db.add(show)
+            session.add(show)
 
         # Add or update the show metadata
         show.series_id = int(data.id)
         show.title = data.seriesname
+        show.normalized_title = normalize_title(data.seriesname)
         show.description = data.overview
         show.genre = data.genre
         show.rating = data.rating
         show.cover = data.poster
         show.backdrop = data.fanart
-        db.commit()
-
-        return get_season_metadata(show.series_id,
-            file_info.season).addCallback(self._got_season_metadata,
-                show, filename, file_info)
 
-    def _got_season_metadata(self, data, show, filename, file_info):
+        # Remember the titles the show is known by
+        for alias in (title, data.seriesname):
+            if alias:
+                self._store_alias(session, alias, show.series_id)
+        return show.series_id
+
+    def _store_alias(self, session, title, series_id, override=False):
+        key = title_key(title)
+        if not key:
+            return
+        alias = session.query(ShowAlias).get(key)
+        if not alias:
+            alias = ShowAlias()
+            alias.title = key
+            session.add(alias)
+
+            # Flushed so that get() finds it should another title of the
+            # show have the same key
+            session.flush()
+        elif alias.override and not override:
+            return
+        alias.series_id = series_id
+        alias.override = override
+
+    def set_alias(self, title, series_id):
         """
-        Handles adding or updating the season metadata to the database.
+        Set the series a title belongs to, overriding the one found by
+        searching thetvdb.org.
+
+        :param title: The title as it is parsed from filenames
+        :type title: str
+        :param series_id: The thetvdb.org id of the series
+        :type series_id: int
+        :returns: A Deferred that fires once the alias has been stored
+        :rtype: twisted.internet.defer.Deferred
         """
-        season = db.query(Season).filter_by(show_id=show.id).first()
+        return db.write(self._store_alias, title, series_id, True)
 
-        # If the season doesn't exist, needs to be created
-        if not season:
-            season = Season()
-            show.seasons.append(season)
+    def _fetch_season(self, series_id, filename, file_info, fingerprint):
+        return get_season_metadata(series_id, file_info.season).addCallback(
+            self._got_season_metadata, series_id, filename, file_info,
+            fingerprint)
 
-        season.number = data.season
-        db.commit()
-        
+    def _got_season_metadata(self, data, series_id, filename, file_info,
+            fingerprint):
         log.info('Fetching metadata for %s S%dE%d', file_info.title,
             file_info.season, file_info.episode)
-        return get_episode_metadata(show.series_id, season.number,
+        return get_episode_metadata(series_id, data.season,
             file_info.episode).addCallback(self._got_episode_metadata,
-                season, filename, file_info)
+                series_id, data.season, filename, file_info, fingerprint)
 
-    def _got_episode_metadata(self, data, season, filename, file_info):
+    def _got_episode_metadata(self, data, series_id, season_number,
+            filename, file_info, fingerprint):
         """
-        Handles adding or updating the episode metadata in the database.
+        Handles adding or updating the season and episode metadata in the
+        database.
         """
-        episode = db.query(Episode).filter_by(
-            season  = season,
-            episode = file_info.episode).first()
+        return db.write(self._store_episode, data, series_id, season_number,
+            filename, file_info, fingerprint)
+
+    def _store_episode(self, session, data, series_id, season_number,
+            filename, file_info, fingerprint):
+        show = session.query(Show).filter_by(series_id=series_id).one()
+        season = session.query(Season).filter_by(show_id=show.id,
+            number=season_number).first()
+
+        # If the season doesn't exist, needs to be created
+        if not season:
+            season = Season()
+            season.number = season_number
+            show.seasons.append(season)
+
+        episode = session.query(Episode).filter_by(
+            show_id       = show.id,
+            season_number = season_number,
+            episode       = file_info.episode).first()
 
         # Create the Episode is need be
         if not episode:
@@ -135,6 +342,7 @@ class VideoHandler(FileHandler):
 
         # Set the path just in case the file has been moved
         episode.path = filename
+        episode.fingerprint = fingerprint
 
         # Update any metadata that we need to
         if episode.lastupdated < int(data.lastupdated):
@@ -146,55 +354,333 @@ class VideoHandler(FileHandler):
             episode.guest_stars = data.gueststars
             episode.lastupdated = data.lastupdated
 
-        db.commit()
-        #self._callback(filename, episode)
         return episode
 
-    def _update_series_file(self, filename, file_info):
+    def _handle_movie(self, filename, file_info):
         """
-        Update an episode in the store.
+        Handle movies
         """
+        return defer.succeed(None)
 
-    def _handle_movie(self, filename, file_info):
+    def moved(self, old_filename, filename):
         """
-        Handle movies
+        Update the path of a moved video without fetching its metadata
+        again.
         """
+        return db.write(self._move_video, old_filename, filename
+            ).addCallback(self._moved_video, filename)
+
+    def _move_video(self, session, old_filename, filename):
+        video = (session.query(Episode).filter_by(path=old_filename).first()
+            or session.query(Movie).filter_by(path=old_filename).first())
+        if video:
+            video.path = filename
+        return video
+
+    def _moved_video(self, video, filename):
+        if not video:
+            return self(filename)
+        return video
+
+    def removed(self, filename):
+        """
+        Remove a video that no longer exists from the store.
+        """
+        return db.write(self._remove_video, filename)
+
+    def _remove_video(self, session, filename):
+        session.query(Episode).filter_by(path=filename).delete()
+        session.query(Movie).filter_by(path=filename).delete()
 
 class ImageHandler(FileHandler):
     """
     Handler for jpg/jpeg files.
+
+    The EXIF metadata of each photo is read and its thumbnails generated
+    before it is stored, by a Thumbnailer shared by all the ImageHandlers
+    unless one is given. Photos are written in batches.
+
+    The perceptual hashes of the photos stored are added to an index of
+    SimilarPhotos, which is also shared unless one is given.
     """
 
-    def __call__(self, filename):
-        if db.query(Photo).filter_by(path=filename).first():
-            self._update_file(filename)
-        else:
-            self._add_file(filename)
-        return self._deferred(filename)
+    concurrency = 8
+
+    models = (Photo,)
+
+    thumbnailer = Thumbnailer()
+
+    similar = SimilarPhotos()
+
+    def __init__(self, thumbnailer=None, similar=None):
+        if thumbnailer:
+            self.thumbnailer = thumbnailer
+        if similar:
+            self.similar = similar
+        self._batch = WriteBatch(self._store_files)
+
+    def index(self, filename, fingerprint):
+        return defer.gatherResults([
+            threads.deferToThread(read_file_exif, filename).addErrback(
+                self._exif_failed, filename),
+            self.thumbnailer.generate(filename, fingerprint)
+        ], consumeErrors=True).addCallback(self._got_metadata, filename,
+            fingerprint)
+
+    def _exif_failed(self, failure, filename):
+        # The photo is still stored without its EXIF metadata
+        log.warning('Unable to read the EXIF of %s: %s', filename,
+            failure.getErrorMessage())
+        return None
+
+    def _got_metadata(self, results, filename, fingerprint):
+        exif, thumbnail = results
+        metadata = exif or {}
+        if thumbnail:
+            width, height, metadata['phash'] = thumbnail
+            if 'width' not in metadata:
+                metadata['width'], metadata['height'] = width, height
+        return self._batch.add((filename, fingerprint, metadata)
+            ).addCallback(self._stored)
+
+    def _stored(self, photo):
+        self.similar.update(photo.id, photo.phash)
+        return photo
+
+    def _store_files(self, session, items):
+        """
+        Add or update a batch of photos in the store.
 
-    def _add_file(self, filename):
+        :param items: The (filename, fingerprint, metadata) of each photo
+        :type items: list
+        :returns: The photos, in the same order as items
+        :rtype: list
+        """
+        paths = [unicode(filename) for (filename, fingerprint, metadata)
+            in items]
+        existing = dict((photo.path, photo) for photo in
+            session.query(Photo).filter(Photo.path.in_(paths)))
+
+        photos = []
+        for path, (filename, fingerprint, metadata) in zip(paths, items):
+            photo = existing.get(path)
+            if not photo:
+                photo = existing[path] = Photo()
+                photo.path = path
+                session.add(photo)
+            if fingerprint:
+                photo.fingerprint = fingerprint
+            if metadata:
+                self._update_photo(photo, metadata)
+            photos.append(photo)
+
+        # The ids of new photos are needed for the similar photos index
+        session.flush()
+        return photos
+
+    def _update_photo(self, photo, metadata):
+        photo.width = metadata.get('width')
+        photo.height = metadata.get('height')
+        photo.taken = metadata.get('taken')
+        photo.camera_make = metadata.get('make')
+        photo.camera_model = metadata.get('model')
+        photo.orientation = metadata.get('orientation')
+        photo.latitude = metadata.get('latitude')
+        photo.longitude = metadata.get('longitude')
+        photo.phash = metadata.get('phash')
+
+    def moved(self, old_filename, filename):
         """
-        Add a photo to the store.
+        Update the path of a moved photo.
         """
-        photo = Photo()
-        photo.path = unicode(filename)
+        return db.write(self._move_file, old_filename, filename
+            ).addCallback(self._moved_file, filename)
 
-        db.add(photo)
-        db.commit()
+    def _move_file(self, session, old_filename, filename):
+        photo = session.query(Photo).filter_by(path=old_filename).first()
+        if photo:
+            photo.path = unicode(filename)
         return photo
 
-    def _update_file(self, filename):
+    def _moved_file(self, photo, filename):
+        if not photo:
+            return self(filename)
+        return photo
+
+    def removed(self, filename):
         """
-        Update an existing image in the store.
+        Remove a photo that no longer exists from the store.
         """
-        # TODO: There's no metadata currently, so just return the existing
-        # object.
-        return db.query(Photo).filter_by(path=filename).one()
+        return db.write(self._remove_file, filename).addCallback(
+            self._removed_file)
+
+    def _remove_file(self, session, filename):
+        query = session.query(Photo).filter_by(path=filename)
+        photo_ids = [photo_id for (photo_id,) in query.values(Photo.id)]
+        query.delete()
+        return photo_ids
+
+    def _removed_file(self, photo_ids):
+        for photo_id in photo_ids:
+            self.similar.remove(photo_id)
 
 class MusicHandler(FileHandler):
     """
     Handler for music files.
+
+    The tracks whose tags have been read are written in batches, so a
+    large import doesn't cost a write per track. The ids of the artists and
+    albums written are cached by name, so they only have to be looked up
+    in the store the first time they are seen.
     """
 
-    def __call__(self, filename):
-        return self._deferred(filename)
+    # Reading tags is quick, and the more tracks that are in flight the
+    # more there are to write together.
+    concurrency = 16
+
+    models = (Track,)
+
+    # The number of artists and albums to remember the ids of
+    cache_size = 4096
+
+    def __init__(self, reader=None):
+        self.reader = reader or TagReader()
+        self._batch = WriteBatch(self._store_tracks)
+        self._artists = LRUCache(self.cache_size)
+        self._albums = LRUCache(self.cache_size)
+
+    def index(self, filename, fingerprint):
+        return self.reader.read(filename).addCallback(self._got_tags,
+            filename, fingerprint)
+
+    def _got_tags(self, tags, filename, fingerprint):
+        return self._batch.add((filename, fingerprint, tags or {}))
+
+    def _store_tracks(self, session, items):
+        """
+        Add or update a batch of tracks in the store.
+
+        :param items: The (filename, fingerprint, tags) of each track
+        :type items: list
+        :returns: The tracks, in the same order as items
+        :rtype: list
+        """
+        paths = [unicode(filename) for (filename, fingerprint, tags) in items]
+        existing = dict((track.path, track) for track in
+            session.query(Track).filter(Track.path.in_(paths)))
+
+        # Only cache the ids once they are known to have been written, if
+        # the write fails the new rows are rolled back.
+        ids = {}
+        tracks = []
+        for path, (filename, fingerprint, tags) in zip(paths, items):
+            track = existing.get(path)
+            if not track:
+                track = existing[path] = Track()
+                track.path = path
+                session.add(track)
+            self._update_track(session, track, tags, ids)
+            if fingerprint:
+                track.fingerprint = fingerprint
+            tracks.append(track)
+        session.flush()
+
+        for key, value in ids.iteritems():
+            if key[0] == 'artist':
+                self._artists.set(key[1:], value)
+            else:
+                self._albums.set(key[1:], value)
+        return tracks
+
+    def _update_track(self, session, track, tags, ids):
+        track.title = tags.get('title') or os.path.splitext(
+            os.path.basename(track.path))[0]
+        track.track_number = _tag_number(tags, 'track-number')
+        track.disc_number = _tag_number(tags, 'album-disc-number')
+        track.genre = tags.get('genre')
+        track.artist_id = self._get_artist(session, tags.get('artist'), ids)
+
+        if tags.get('album-artist'):
+            album_artist_id = self._get_artist(session,
+                tags['album-artist'], ids)
+        else:
+            album_artist_id = track.artist_id
+        date = tags.get('date')
+        track.album_id = self._get_album(session, tags.get('album'),
+            album_artist_id, date and date.year, ids)
+
+    def _get_artist(self, session, name, ids):
+        """
+        Find or create the artist with a name and return its id.
+        """
+        key = normalize_title(name)
+        if not key:
+            return None
+
+        artist_id = ids.get(('artist', key)) or self._artists.get((key,))
+        if artist_id:
+            return artist_id
+
+        artist = session.query(Artist).filter_by(normalized_name=key).first()
+        if not artist:
+            artist = Artist()
+            artist.name = name
+            artist.normalized_name = key
+            session.add(artist)
+            session.flush()
+        ids[('artist', key)] = artist.id
+        return artist.id
+
+    def _get_album(self, session, title, artist_id, year, ids):
+        """
+        Find or create the album with a title by an artist and return its
+        id.
+        """
+        key = normalize_title(title)
+        if not key:
+            return None
+
+        album_id = (ids.get(('album', artist_id, key)) or
+            self._albums.get((artist_id, key)))
+        if album_id:
+            return album_id
+
+        album = session.query(Album).filter_by(artist_id=artist_id,
+            normalized_title=key).first()
+        if not album:
+            album = Album()
+            album.artist_id = artist_id
+            album.title = title
+            album.normalized_title = key
+            album.year = year
+            session.add(album)
+            session.flush()
+        ids[('album', artist_id, key)] = album.id
+        return album.id
+
+    def moved(self, old_filename, filename):
+        """
+        Update the path of a moved track.
+        """
+        return db.write(self._move_file, old_filename, filename
+            ).addCallback(self._moved_file, filename)
+
+    def _move_file(self, session, old_filename, filename):
+        track = session.query(Track).filter_by(path=old_filename).first()
+        if track:
+            track.path = unicode(filename)
+        return track
+
+    def _moved_file(self, track, filename):
+        if not track:
+            return self(filename)
+        return track
+
+    def removed(self, filename):
+        """
+        Remove a track that no longer exists from the store.
+        """
+        return db.write(self._remove_file, filename)
+
+    def _remove_file(self, session, filename):
+        session.query(Track).filter_by(path=filename).delete()
@@ -0,0 +1,256 @@
+#
+# encore/backend/indexing/hashing.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+"""
+Computes the OpenSubtitles hashes of video files, which identify a movie
+on themoviedb.org without relying on its filename.
+"""
+
+import os
+import hashlib
+import logging
+import cPickle as pickle
+
+from twisted.internet import defer, reactor, threads
+
+from encore.backend.indexing.workers import WorkerPool, serve
+from encore.lib.tmdb import opensubtitleHashFile, HASH_CHUNK_SIZE
+
+log = logging.getLogger(__name__)
+
+def fingerprint_file(path):
+    """
+    Compute a cheap fingerprint of a file's contents from its size and
+    the first and last 64k of it, which is enough to recognise the file
+    once it has been moved.
+
+    :param path: The path to the file
+    :type path: str
+    :returns: The fingerprint, or None if the file can't be read
+    :rtype: str
+    """
+    try:
+        fp = open(path, 'rb')
+        try:
+            size = os.fstat(fp.fileno()).st_size
+            digest = hashlib.md5(fp.read(HASH_CHUNK_SIZE))
+            if size > HASH_CHUNK_SIZE:
+                fp.seek(max(HASH_CHUNK_SIZE, size - HASH_CHUNK_SIZE))
+                digest.update(fp.read(HASH_CHUNK_SIZE))
+        finally:
+            fp.close()
+    except (IOError, OSError):
+        return None
+    return '%016x%s' % (size, digest.hexdigest()[:16])
+
+class HashCache(object):
+    """
+    A persistent record of the hashes of files, keyed by path and only
+    valid while the size and mtime of the file are unchanged.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.hashes = {}
+
+    def load(self):
+        """
+        Load the cache from disk, a missing or unreadable cache results in
+        an empty one.
+        """
+        if not self.filename or not os.path.isfile(self.filename):
+            return
+
+        try:
+            self.hashes = pickle.load(open(self.filename, 'rb'))
+        except Exception as e:
+            log.warning('Unable to read hash cache %s: %s', self.filename, e)
+
+    def save(self):
+        """
+        Write the cache to disk.
+        """
+        if not self.filename:
+            return
+
+        tmp_filename = self.filename + '.tmp'
+        fp = open(tmp_filename, 'wb')
+        try:
+            pickle.dump(self.hashes, fp, pickle.HIGHEST_PROTOCOL)
+        finally:
+            fp.close()
+        os.rename(tmp_filename, self.filename)
+
+    def get(self, path, st):
+        """
+        Return the cached hash of a file, or None if the file has changed
+        since it was hashed.
+
+        :param path: The path to the file
+        :type path: str
+        :param st: The current stat result of the file
+        :type st: posix.stat_result
+        """
+        entry = self.hashes.get(path)
+        if entry and entry[:2] == (st.st_size, st.st_mtime):
+            return entry[2]
+
+    def set(self, path, st, fhash):
+        self.hashes[path] = (st.st_size, st.st_mtime, fhash)
+
+    def discard(self, path):
+        self.hashes.pop(path, None)
+
+def hash_file(path):
+    """
+    Hash a file, returning None if it is too small to be hashed or can't
+    be read.
+    """
+    try:
+        return opensubtitleHashFile(path)
+    except (IOError, OSError, ValueError):
+        return None
+
+class Hasher(object):
+    """
+    Hashes files in the background. By default a thread is used per file,
+    given processes the files are hashed by a pool of that many worker
+    processes instead, which suits hashing thousands of files at once.
+
+    :param cache: The cache of previously computed hashes
+    :type cache: HashCache
+    :param processes: The number of processes to hash files with
+    :type processes: int
+    :param save_delay: The number of seconds after a hash is added to
+        wait before saving the cache, so a burst of hashes is saved once
+    :type save_delay: int
+    """
+
+    def __init__(self, cache=None, processes=None, save_delay=30):
+        self.cache = cache or HashCache()
+        self.processes = processes
+        self.pool = processes and WorkerPool(__name__, processes)
+        self.save_delay = save_delay
+        self.clock = reactor
+        self._save_call = None
+        self._shutdown_trigger = None
+
+    def hash(self, path):
+        """
+        Get the hash of a file, from the cache if it hasn't changed since
+        it was last hashed.
+
+        :param path: The path to the file
+        :type path: str
+        :returns: A Deferred that fires with the hash, or None if the file
+            can't be hashed
+        :rtype: twisted.internet.defer.Deferred
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            if path in self.cache.hashes:
+                self.cache.discard(path)
+                self._changed()
+            return defer.succeed(None)
+
+        fhash = self.cache.get(path, st)
+        if fhash:
+            return defer.succeed(fhash)
+
+        return self._hash(path).addCallback(self._on_hashed, path, st)
+
+    def hash_files(self, paths):
+        """
+        Hash a number of files and save the cache once they are done.
+
+        :param paths: The paths to the files
+        :type paths: list
+        :returns: A Deferred that fires with a dict of path to hash
+        :rtype: twisted.internet.defer.Deferred
+        """
+        paths = list(paths)
+
+        def on_hashed(results):
+            self.save()
+            return dict(zip(paths, [fhash for (success, fhash) in results]))
+
+        return defer.DeferredList([self.hash(path) for path in paths]
+            ).addCallback(on_hashed)
+
+    def save(self):
+        """
+        Save the cache now rather than once the delay has passed.
+        """
+        if self._save_call and self._save_call.active():
+            self._save_call.cancel()
+        self._save_call = None
+        if self._shutdown_trigger:
+            reactor.removeSystemEventTrigger(self._shutdown_trigger)
+            self._shutdown_trigger = None
+        self.cache.save()
+
+    def _changed(self):
+        """
+        Schedule the cache to be saved, and make sure it is saved on
+        shutdown should that come first.
+        """
+        if not self._save_call:
+            self._save_call = self.clock.callLater(self.save_delay,
+                self.save)
+        if not self._shutdown_trigger:
+            self._shutdown_trigger = reactor.addSystemEventTrigger('before',
+                'shutdown', self.save)
+
+    def stop(self):
+        """
+        Save any unsaved hashes and stop the worker processes, if any have
+        been started.
+
+        :returns: A Deferred that fires once the workers have exited
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if self._save_call:
+            self.save()
+        if not self.pool:
+            return defer.succeed(None)
+        return self.pool.stop()
+
+    def _hash(self, path):
+        if not self.pool:
+            return threads.deferToThread(hash_file, path)
+        return self.pool.call(path)
+
+    def _on_hashed(self, fhash, path, st):
+        if fhash:
+            self.cache.set(path, st, fhash)
+            self._changed()
+        return fhash
+
+def main():
+    """
+    Run as a worker process for a Hasher.
+    """
+    serve(hash_file)
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,7 @@
 #
 
 import os
+import stat
 import logging
 
 from twisted.internet import defer, reactor
@@ -28,6 +29,13 @@ from twisted.internet import defer, reactor
 from encore.component import Component
 from encore.config import config
 from encore.backend.indexing import handlers
+from encore.backend.indexing.manifest import Manifest, file_stat
+from encore.backend.indexing.scheduler import DispatchQueue, JobGroup
+from encore.backend.indexing.scheduler import PRIORITY_NEW, PRIORITY_RECHECK
+from encore.backend.indexing.sync import MetadataSync
+from encore.backend.indexing.video_metadata import tvdb
+from encore.backend.indexing.walker import SimpleWalker
+from encore.backend.indexing.watcher import Watcher
 
 log = logging.getLogger(__name__)
 
@@ -37,8 +45,13 @@ class Indexer(Component):
     Encore.
     """
 
-    def __init__(self):
+    def __init__(self, walker=None, queue=None):
         super(Indexer, self).__init__('Indexer')
+        self.manifest = Manifest()
+        self.walker = walker or SimpleWalker()
+        self.queue = queue or DispatchQueue()
+        self.watcher = None
+        self.sync = None
 
     handlers = {
         'avi': handlers.VideoHandler(),
@@ -61,12 +74,47 @@ class Indexer(Component):
         """
         Do any initialization required to start the Indexer Component.
         """
+        self.manifest = Manifest(config.MANIFEST_FILE)
+        self.manifest.load()
 
     def run(self):
         """
-        Start the indexer running.
+        Start the indexer running. Each media directory is rescanned to
+        pick up anything that changed while Encore wasn't running and, where
+        supported, then watched for changes from then on. The metadata of
+        indexed episodes is kept up to date with thetvdb.org.
+
+        :returns: A Deferred that fires once the initial rescans complete
+        :rtype: twisted.internet.defer.Deferred
         """
-        # TODO: add logic for retrieving media directories here
+        directories = config.get_media_directories()
+
+        # Start watching before rescanning so nothing is missed in between.
+        if Watcher.is_supported():
+            self.watcher = Watcher(self._on_changes)
+            for directory in directories:
+                self.watcher.watch(directory)
+        else:
+            log.info('Watching directories is not supported, media will '
+                'only be indexed when rescanned')
+
+        self.sync = MetadataSync(self, tvdb, config.TVDB_SYNC_FILE)
+        self.sync.start()
+
+        return defer.DeferredList([self.rescan_directory(directory)
+            for directory in directories])
+
+    def stop(self):
+        """
+        Stop watching the media directories and checking for updated
+        metadata.
+        """
+        if self.watcher:
+            self.watcher.stop()
+            self.watcher = None
+        if self.sync:
+            self.sync.stop()
+            self.sync = None
 
     def scan_directory(self, directory):
         """
@@ -74,17 +122,138 @@ class Indexer(Component):
 
         :param directory: The directory to scan
         :type directory: str
+        :returns: A Deferred that fires with the JobGroup of handled files
+            once they have all been indexed
+        :rtype: twisted.internet.defer.Deferred
+        """
+        directory = os.path.abspath(directory)
+        files, dirs = {}, {}
+        group = JobGroup()
+
+        def on_directory(path, mtime, entries, subdirs):
+            dirs[path] = self._manifest_entry(mtime, entries, subdirs)
+            files.update(entries)
+            for fpath, st in entries:
+                if fpath in self.manifest.files:
+                    priority = PRIORITY_RECHECK
+                else:
+                    priority = PRIORITY_NEW
+                group.add(self.queue.submit(self._get_handler(fpath),
+                    (fpath,), priority=priority))
+            return self.queue.wait()
+
+        def on_walked(result):
+            self.manifest.update(directory, files, dirs)
+            self.manifest.save()
+            return group.close()
+
+        return self.walker.walk(directory, self.is_supported_filetype,
+            on_directory).addCallback(on_walked)
+
+    def rescan_directory(self, directory, trust_dir_mtime=True):
+        """
+        Rescans a directory for media, only dispatching the files that have
+        been added, changed, moved or removed since the last scan.
+
+        :param directory: The directory to scan
+        :type directory: str
+        :param trust_dir_mtime: Reuse the recorded listing of directories
+            whose mtime hasn't changed rather than reading them again
+        :type trust_dir_mtime: bool
+        :returns: A Deferred that fires with the ScanDiff once all the
+            changes have been handled
+        :rtype: twisted.internet.defer.Deferred
+        """
+        directory = os.path.abspath(directory)
+        manifest = self.manifest if trust_dir_mtime else None
+        files, dirs = {}, {}
+
+        def on_directory(path, mtime, entries, subdirs):
+            dirs[path] = self._manifest_entry(mtime, entries, subdirs)
+            files.update(entries)
+
+        def on_walked(result):
+            diff = self.manifest.update(directory, files, dirs)
+            self.manifest.save()
+            log.info('Rescanned %s: %s', directory, diff)
+            return self._dispatch(diff)
+
+        return self.walker.walk(directory, self.is_supported_filetype,
+            on_directory, manifest).addCallback(on_walked)
+
+    def _on_changes(self, files, directories):
+        """
+        Handle the changes reported by the watcher. Directories that have
+        appeared or disappeared as a whole are rescanned, individual files
+        are compared against the manifest.
+        """
+        for directory in directories:
+            self.rescan_directory(directory)
+
+        changes = {}
+        for path in files:
+            if not self.is_supported_filetype(path):
+                continue
+            if [d for d in directories if path.startswith(d + os.sep)]:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                changes[path] = None
+            else:
+                if stat.S_ISREG(st.st_mode):
+                    changes[path] = file_stat(st)
+
+        if not changes:
+            return
+
+        diff = self.manifest.update_files(changes)
+        self.manifest.save()
+        log.info('Detected changes: %s', diff)
+        self._dispatch(diff)
+
+    def _dispatch(self, diff):
         """
+        Pass the changes found in a ScanDiff to the relevant handlers.
 
-        deferreds = []
-        for path, dirs, files in os.walk(directory):
-            for fn in files:
-                fn_ext = os.path.splitext(fn)[1][1:]
-                if fn_ext not in self.handlers:
-                    continue
-                deferreds.append(self.handlers[fn_ext](os.path.join(path,
-                    fn)))
-        return defer.DeferredList(deferreds)
+        :returns: A Deferred that fires with the diff once all the changes
+            have been handled
+        :rtype: twisted.internet.defer.Deferred
+        """
+        group = JobGroup()
+        for old_path, path in diff.moved:
+            group.add(self.queue.submit(self._get_handler(path),
+                (old_path, path), 'moved'))
+        for path in diff.added:
+            group.add(self.queue.submit(self._get_handler(path), (path,)))
+        for path in diff.changed:
+            group.add(self.queue.submit(self._get_handler(path), (path,),
+                priority=PRIORITY_RECHECK))
+
+        # Removed files are only dropped once the new files have been
+        # handled, so that any of them that have just been moved elsewhere
+        # can be recognised by their fingerprint.
+        return group.close().addCallback(self._dispatch_removed, diff)
+
+    def _dispatch_removed(self, result, diff):
+        group = JobGroup()
+        for path in diff.removed:
+            group.add(self.queue.submit(self._get_handler(path), (path,),
+                'removed'))
+        return group.close().addCallback(lambda _: diff)
+
+    def _manifest_entry(self, mtime, entries, subdirs):
+        """
+        Build the manifest record for a directory listing.
+        """
+        return (mtime, [os.path.basename(fpath) for (fpath, st) in entries],
+            subdirs)
+
+    def _get_handler(self, filename):
+        """
+        Return the handler for a filename based on its extension.
+        """
+        return self.handlers.get(os.path.splitext(filename)[1][1:])
 
     @property
     def supported_filetypes(self):
@@ -103,5 +272,4 @@ class Indexer(Component):
         """
         Check whether or not a file is supported by the indexer.
         """
-        extension = filename.split('.')[-1]
-        return extension in self.supported_filetypes
+        return os.path.splitext(filename)[1][1:] in self.handlers
@@ -0,0 +1,230 @@
+#
+# encore/backend/indexing/manifest.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+import logging
+import cPickle as pickle
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+# Bump this whenever the on-disk layout of the manifest changes, older
+# manifests are then discarded and the next scan is a full one.
+MANIFEST_VERSION = 1
+
+FileStat = namedtuple('FileStat', 'size mtime ino dev')
+
+def file_stat(st):
+    """
+    Convert the result of os.stat into the subset stored in the manifest.
+
+    :param st: The stat result
+    :type st: posix.stat_result
+    :rtype: FileStat
+    """
+    return FileStat(st.st_size, st.st_mtime, st.st_ino, st.st_dev)
+
+class ScanDiff(object):
+    """
+    The changes found in a directory tree between two scans.
+    """
+
+    def __init__(self):
+        self.added = []
+        self.changed = []
+        self.moved = []
+        self.removed = []
+
+    def __len__(self):
+        return (len(self.added) + len(self.changed) + len(self.moved) +
+            len(self.removed))
+
+    def __str__(self):
+        return '%d added, %d changed, %d moved, %d removed' % (
+            len(self.added), len(self.changed), len(self.moved),
+            len(self.removed))
+
+class Manifest(object):
+    """
+    A persistent record of every media file the indexer has seen, along
+    with the listings of the directories they were found in. This allows a
+    rescan to only look at what has changed on disk since the last one.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.files = {}
+        self.dirs = {}
+
+    def load(self):
+        """
+        Load the manifest from disk, a missing or unreadable manifest
+        results in an empty one.
+        """
+        if not self.filename or not os.path.isfile(self.filename):
+            return
+
+        try:
+            data = pickle.load(open(self.filename, 'rb'))
+        except Exception as e:
+            log.warning('Unable to read manifest %s: %s', self.filename, e)
+            return
+
+        if data.get('version') != MANIFEST_VERSION:
+            log.info('Discarding outdated manifest %s', self.filename)
+            return
+
+        self.files = dict((path, FileStat._make(st))
+            for (path, st) in data['files'].iteritems())
+        self.dirs = data['dirs']
+
+    def save(self):
+        """
+        Write the manifest to disk. The file is written alongside and then
+        renamed into place so that a crash never leaves a truncated
+        manifest behind.
+        """
+        if not self.filename:
+            return
+
+        data = {
+            'version': MANIFEST_VERSION,
+            'files': dict((path, tuple(st))
+                for (path, st) in self.files.iteritems()),
+            'dirs': self.dirs
+        }
+
+        tmp_filename = self.filename + '.tmp'
+        fp = open(tmp_filename, 'wb')
+        try:
+            pickle.dump(data, fp, pickle.HIGHEST_PROTOCOL)
+        finally:
+            fp.close()
+        os.rename(tmp_filename, self.filename)
+
+    def listing(self, path, st):
+        """
+        Return the recorded listing of a directory if its mtime hasn't
+        changed since it was recorded. Adding, removing or renaming an
+        entry updates the mtime of a directory on POSIX filesystems, so the
+        recorded listing can be trusted instead of reading the directory
+        again. Files modified in place are not picked up this way.
+
+        :param path: The directory path
+        :type path: str
+        :param st: The current stat result of the directory
+        :type st: posix.stat_result
+        :returns: A tuple of ([(path, FileStat)], [subdir names]) or None
+        :rtype: tuple
+        """
+        entry = self.dirs.get(path)
+        if entry is None or entry[0] != st.st_mtime:
+            return None
+
+        files = []
+        for name in entry[1]:
+            fpath = os.path.join(path, name)
+            fstat = self.files.get(fpath)
+            if fstat is None:
+                return None
+            files.append((fpath, fstat))
+        return files, entry[2]
+
+    def update(self, root, files, dirs):
+        """
+        Replace everything recorded below root with the results of a new
+        scan and return the differences between the two.
+
+        :param root: The directory that was scanned
+        :type root: str
+        :param files: The files found, mapping path to FileStat
+        :type files: dict
+        :param dirs: The directories found, mapping path to a tuple of
+            (mtime, [file names], [subdir names])
+        :type dirs: dict
+        :rtype: ScanDiff
+        """
+        prefix = root.rstrip(os.sep) + os.sep
+        within = lambda path: path == root or path.startswith(prefix)
+
+        old_files = dict((path, st) for (path, st) in self.files.iteritems()
+            if within(path))
+        diff = self._diff(old_files, files)
+
+        for path in [p for p in self.files if within(p)]:
+            del self.files[path]
+        for path in [p for p in self.dirs if within(p)]:
+            del self.dirs[path]
+        self.files.update(files)
+        self.dirs.update(dirs)
+        return diff
+
+    def update_files(self, files):
+        """
+        Update individual files rather than a whole directory tree and
+        return the differences.
+
+        :param files: Mapping of path to its new FileStat, or None if the
+            file no longer exists
+        :type files: dict
+        :rtype: ScanDiff
+        """
+        old_files = dict((path, self.files[path]) for path in files
+            if path in self.files)
+        new_files = dict((path, st) for (path, st) in files.iteritems()
+            if st is not None)
+        diff = self._diff(old_files, new_files)
+
+        for path, st in files.iteritems():
+            if st is None:
+                self.files.pop(path, None)
+            else:
+                self.files[path] = st
+        return diff
+
+    def _diff(self, old_files, files):
+        """
+        Compare the recorded state of some files with their current state.
+        """
+        diff = ScanDiff()
+        added = []
+        for path, st in files.iteritems():
+            old = old_files.pop(path, None)
+            if old is None:
+                added.append(path)
+            elif old.size != st.size or old.mtime != st.mtime:
+                diff.changed.append(path)
+
+        # Anything left over has vanished, unless the same inode has
+        # reappeared under another name in which case it has been moved. A
+        # rename preserves the size and mtime, checking those too stops a
+        # freed inode being reused by a new file looking like a move.
+        vanished = dict((st, path) for (path, st) in old_files.iteritems())
+        for path in added:
+            old_path = vanished.pop(files[path], None)
+            if old_path is None:
+                diff.added.append(path)
+            else:
+                diff.moved.append((old_path, path))
+                del old_files[old_path]
+        diff.removed.extend(old_files)
+        return diff
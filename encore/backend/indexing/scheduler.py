@@ -0,0 +1,185 @@
+#
+# encore/backend/indexing/scheduler.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import heapq
+import logging
+import itertools
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+log = logging.getLogger(__name__)
+
+# Priority lanes, lower numbers are handled first
+PRIORITY_NEW = 0
+PRIORITY_RECHECK = 1
+
+class DispatchQueue(object):
+    """
+    Sits between the directory walkers and the file handlers, limiting how
+    many files of each handler type are being handled at once. Work that
+    is queued is started in priority order, so new files are indexed
+    before existing ones are rechecked.
+    """
+
+    def __init__(self, limits=None, max_pending=1000, progress=None):
+        """
+        :param limits: Overrides the concurrency of handler types, mapping
+            the handler class to the number of files it may handle at once
+        :type limits: dict
+        :param max_pending: The number of queued files beyond which wait()
+            asks the producer to stop
+        :type max_pending: int
+        :param progress: Called with (completed, total) whenever a file has
+            been handled
+        :type progress: callable
+        """
+        self.limits = limits or {}
+        self.max_pending = max_pending
+        self.progress = progress
+        self.pending = 0
+        self.completed = 0
+        self.total = 0
+        self._lanes = {}
+        self._active = {}
+        self._running = set()
+        self._waiters = []
+        self._counter = itertools.count()
+
+    def submit(self, handler, args, method='__call__',
+            priority=PRIORITY_NEW):
+        """
+        Queue a call to a handler.
+
+        :param handler: The handler to call
+        :type handler: FileHandler
+        :param args: The arguments to call the handler with
+        :type args: tuple
+        :param method: The name of the handler method to call
+        :type method: str
+        :param priority: The lane to queue the call in
+        :type priority: int
+        :returns: A Deferred that fires with the result of the call
+        :rtype: twisted.internet.defer.Deferred
+        """
+        key = handler.__class__
+        d = defer.Deferred()
+        heapq.heappush(self._lanes.setdefault(key, []),
+            (priority, self._counter.next(), handler, method, args, d))
+        self.pending += 1
+        self.total += 1
+        self._run(key)
+        return d
+
+    def wait(self):
+        """
+        Used by producers to apply back-pressure, returns None if there is
+        room in the queue, otherwise a Deferred that fires once there is.
+        """
+        if self.pending < self.max_pending:
+            return None
+        d = defer.Deferred()
+        self._waiters.append(d)
+        return d
+
+    def _limit(self, key):
+        return self.limits.get(key, key.concurrency)
+
+    def _run(self, key):
+        # Handlers that complete synchronously end up back here, the guard
+        # turns that into another turn of the loop rather than recursing.
+        if key in self._running:
+            return
+
+        self._running.add(key)
+        try:
+            lane = self._lanes[key]
+            limit = self._limit(key)
+            while lane and self._active.get(key, 0) < limit:
+                (priority, count, handler, method, args,
+                    d) = heapq.heappop(lane)
+                self.pending -= 1
+                self._active[key] = self._active.get(key, 0) + 1
+                defer.maybeDeferred(getattr(handler, method), *args
+                    ).addBoth(self._finished, key, d)
+        finally:
+            self._running.discard(key)
+
+        while self._waiters and self.pending < self.max_pending:
+            self._waiters.pop(0).callback(None)
+
+    def _finished(self, result, key, d):
+        self._active[key] -= 1
+        self.completed += 1
+        if self.progress:
+            self.progress(self.completed, self.total)
+
+        if isinstance(result, Failure):
+            d.errback(result)
+        else:
+            d.callback(result)
+        self._run(key)
+
+class JobGroup(object):
+    """
+    Keeps count of a group of queued calls so it is possible to wait for
+    them all to complete without holding onto a Deferred for each one.
+    Failures are logged and counted.
+    """
+
+    def __init__(self):
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self._closed = False
+        self._deferred = defer.Deferred()
+
+    def add(self, d):
+        """
+        Add the Deferred for a call to the group.
+        """
+        self.pending += 1
+        d.addBoth(self._done)
+
+    def close(self):
+        """
+        Signal that no more calls will be added to the group.
+
+        :returns: A Deferred that fires with the group once all the calls
+            have completed
+        :rtype: twisted.internet.defer.Deferred
+        """
+        self._closed = True
+        self._check()
+        return self._deferred
+
+    def _done(self, result):
+        self.pending -= 1
+        self.completed += 1
+        if isinstance(result, Failure):
+            self.failed += 1
+            log.error('Indexing failed: %s', result.getTraceback())
+        self._check()
+
+    def _check(self):
+        if self._closed and not self.pending and not self._deferred.called:
+            self._deferred.callback(self)
@@ -0,0 +1,177 @@
+#
+# encore/backend/indexing/similar.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+"""
+Finds photos that look alike, e.g. resized exports and re-saved edits of
+the same photo, by the perceptual hashes of their thumbnails. The hashes
+of the whole library are kept in a BK-tree, so finding the photos like
+one doesn't mean comparing it to every other photo.
+"""
+
+import logging
+
+from twisted.internet import defer
+
+from encore.backend.model import Photo, db
+from encore.utils.bktree import BKTree
+
+log = logging.getLogger(__name__)
+
+# The number of bits the hashes of photos that are considered alike may
+# differ by, out of 64.
+MAX_DISTANCE = 10
+
+class SimilarPhotos(object):
+    """
+    An index of the perceptual hashes of the photos in the store. The
+    hashes are loaded from the store when the index is first used, and
+    kept up to date by the ImageHandlers as photos are indexed.
+
+    :param max_distance: The default number of bits the hashes of similar
+        photos may differ by
+    :type max_distance: int
+    """
+
+    def __init__(self, max_distance=MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.loaded = False
+        self.tree = BKTree()
+        self._hashes = {}
+        self._waiting = []
+
+    def load(self):
+        """
+        Load the hashes of the photos in the store, if they haven't been
+        already.
+
+        :returns: A Deferred that fires once the hashes have been loaded
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if self.loaded:
+            return defer.succeed(None)
+
+        d = defer.Deferred()
+        self._waiting.append(d)
+        if len(self._waiting) == 1:
+            db.read(self._load).addBoth(self._loaded)
+        return d
+
+    def _load(self, session):
+        return session.query(Photo.id, Photo.phash).filter(
+            Photo.phash != None).all()
+
+    def _loaded(self, result):
+        waiting, self._waiting = self._waiting, []
+        if isinstance(result, list):
+            # Photos updated since the hashes were read are already right
+            for photo_id, phash in result:
+                if photo_id not in self._hashes:
+                    self.update(photo_id, phash)
+            self.loaded = True
+            log.debug('Loaded the hashes of %d photos', len(self.tree))
+            result = None
+
+        for d in waiting:
+            if self.loaded:
+                d.callback(None)
+            else:
+                d.errback(result)
+
+    def update(self, photo_id, phash):
+        """
+        Set the hash of a photo.
+
+        :param photo_id: The id of the photo
+        :type photo_id: int
+        :param phash: The perceptual hash of the photo, or None to remove it
+        :type phash: str
+        """
+        old = self._hashes.get(photo_id)
+        if old is not None:
+            self.tree.remove(old, photo_id)
+
+        # Removed photos are remembered as None so loading doesn't bring
+        # them back.
+        if not phash:
+            self._hashes[photo_id] = None
+            return
+        value = int(phash, 16)
+        self._hashes[photo_id] = value
+        self.tree.add(value, photo_id)
+
+    def remove(self, photo_id):
+        """
+        Remove a photo from the index.
+        """
+        self.update(photo_id, None)
+
+    def find(self, phash, max_distance=None):
+        """
+        Find the photos that look like one with a hash.
+
+        :param phash: The perceptual hash
+        :type phash: str
+        :param max_distance: The number of bits the hashes may differ by
+        :type max_distance: int
+        :returns: A Deferred that fires with a list of (distance, photo_id),
+            closest first
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+        return self.load().addCallback(lambda _: self.tree.find(
+            int(phash, 16), max_distance))
+
+    def duplicates(self, max_distance=None):
+        """
+        Group the photos in the library that look alike.
+
+        :param max_distance: The number of bits the hashes may differ by
+        :type max_distance: int
+        :returns: A Deferred that fires with a list of lists of photo ids,
+            each holding at least two photos
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+        return self.load().addCallback(lambda _: self._group(max_distance))
+
+    def _group(self, max_distance):
+        groups = {}
+        for photo_id, value in self._hashes.iteritems():
+            if value is None or photo_id in groups:
+                continue
+
+            # Photos are grouped with everything alike to anything in the
+            # group, so a chain of small edits ends up together.
+            group = [photo_id]
+            groups[photo_id] = group
+            for member in group:
+                for distance, other in self.tree.find(self._hashes[member],
+                        max_distance):
+                    if other not in groups:
+                        groups[other] = group
+                        group.append(other)
+
+        unique = dict((id(group), group) for group in groups.itervalues())
+        return sorted(sorted(group) for group in unique.itervalues()
+            if len(group) > 1)
@@ -0,0 +1,183 @@
+#
+# encore/backend/indexing/sync.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+import time
+import logging
+
+from twisted.internet import defer, reactor, task
+
+from encore.backend.indexing.scheduler import JobGroup, PRIORITY_RECHECK
+from encore.backend.model import db, Episode, Show
+
+log = logging.getLogger(__name__)
+
+# The number of series looked up in a single query
+QUERY_CHUNK = 500
+
+class MetadataSync(object):
+    """
+    Keeps the metadata fetched from thetvdb.org up to date. The updates
+    feed is checked periodically for series and episodes that have changed
+    since the last check, their cached responses are dropped and the
+    indexed episodes that are out of date are queued to be indexed again.
+
+    :param indexer: The indexer to queue episodes with
+    :type indexer: encore.backend.indexing.indexer.Indexer
+    :param tvdb: The tvdb api to check for updates with
+    :type tvdb: encore.lib.tvdb.TvDb
+    :param filename: The file to record the time of the last check in
+    :type filename: str
+    :param interval: The number of seconds between checks
+    :type interval: int
+    """
+
+    def __init__(self, indexer, tvdb, filename, interval=6 * 60 * 60,
+            database=None):
+        self.indexer = indexer
+        self.tvdb = tvdb
+        self.filename = filename
+        self.interval = interval
+        self.db = database or db
+        self.clock = reactor
+        self._loop = None
+        self._syncing = None
+
+    def start(self):
+        """
+        Start checking for updates, the first check is made straight away.
+        """
+        self._loop = task.LoopingCall(self.sync)
+        self._loop.clock = self.clock
+        self._loop.start(self.interval, now=True).addErrback(log.error)
+
+    def stop(self):
+        if self._loop and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+
+    def sync(self):
+        """
+        Check for updates since the last check.
+
+        :returns: A Deferred that fires with the JobGroup of the episodes
+            queued to be indexed again, or None if the check failed or one
+            was already in progress
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if self._syncing:
+            return defer.succeed(None)
+
+        last_sync = self.last_sync
+        if last_sync is None:
+            # Everything fetched so far is up to date, so just start
+            # keeping track from now on.
+            self.last_sync = int(time.time())
+            return JobGroup().close()
+
+        def on_done(result):
+            self._syncing = None
+            return result
+
+        def on_error(failure):
+            log.warning('Unable to check thetvdb.org for updates: %s',
+                failure.getErrorMessage())
+
+        d = self._syncing = self.tvdb.get_updates(last_sync)
+        d.addCallback(self._on_updates)
+        d.addErrback(on_error)
+        d.addBoth(on_done)
+        return d
+
+    def _on_updates(self, updates):
+        # The updates feeds cover every series on thetvdb.org, only those
+        # in the library are of interest.
+        changed = set(updates.series) | set(updates.episodes)
+        return self.db.read(self._find_series, list(changed)).addCallback(
+            self._invalidate, updates)
+
+    def _find_series(self, session, series_ids):
+        """
+        Find which of some series are in the library.
+        """
+        found = []
+        for i in xrange(0, len(series_ids), QUERY_CHUNK):
+            chunk = series_ids[i:i + QUERY_CHUNK]
+            found.extend(series_id for (series_id,) in session.query(
+                Show.series_id).filter(Show.series_id.in_(chunk)))
+        return found
+
+    def _invalidate(self, series_ids, updates):
+        log.info('%d series in the library have changed on thetvdb.org',
+            len(series_ids))
+        if series_ids:
+            self.tvdb.invalidate_series(*series_ids)
+
+        return self.db.read(self._find_outdated, updates.episodes
+            ).addCallback(self._requeue, updates)
+
+    def _find_outdated(self, session, episodes):
+        """
+        Find the paths of episodes that are older than the changes to
+        their series.
+        """
+        paths = []
+        series_ids = episodes.keys()
+        for i in xrange(0, len(series_ids), QUERY_CHUNK):
+            chunk = series_ids[i:i + QUERY_CHUNK]
+            rows = session.query(Episode.path, Episode.lastupdated,
+                Show.series_id).filter(Episode.show_id == Show.id).filter(
+                Show.series_id.in_(chunk))
+            for path, lastupdated, series_id in rows:
+                if path and (lastupdated or 0) < episodes[series_id]:
+                    paths.append(path)
+        return paths
+
+    def _requeue(self, paths, updates):
+        log.info('Queuing %d episodes to be indexed again', len(paths))
+        group = JobGroup()
+        for path in paths:
+            handler = self.indexer._get_handler(path)
+            if handler and os.path.exists(path):
+                group.add(self.indexer.queue.submit(handler, (path,),
+                    priority=PRIORITY_RECHECK))
+
+        self.last_sync = updates.time
+        return group.close()
+
+    def _get_last_sync(self):
+        try:
+            return int(open(self.filename).read().strip())
+        except (IOError, ValueError):
+            return None
+
+    def _set_last_sync(self, value):
+        tmp_path = self.filename + '.tmp'
+        fp = open(tmp_path, 'w')
+        try:
+            fp.write('%d\n' % value)
+        finally:
+            fp.close()
+        os.rename(tmp_path, self.filename)
+
+    last_sync = property(_get_last_sync, _set_last_sync,
+        doc='The time of the last check for updates')
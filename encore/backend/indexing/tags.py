@@ -0,0 +1,657 @@
+#
+# encore/backend/indexing/tags.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+"""
+Reads the tags of music files straight from the headers of the files.
+ID3v1 and ID3v2 tags (mp3), Vorbis comments (ogg, opus and flac) and MP4
+metadata atoms (m4a) are understood. Only the parts of a file holding the
+tags are read, embedded pictures are skipped over.
+
+Tags are returned in a dict keyed by the names GStreamer gives them, e.g.
+'artist' and 'track-number'. Text is unicode, numbers are ints and dates
+are datetime.dates.
+"""
+
+import re
+import struct
+import logging
+import datetime
+import cPickle as pickle
+from cStringIO import StringIO
+
+from twisted.internet import defer, threads
+
+from encore.backend.indexing.workers import WorkerPool, serve
+
+log = logging.getLogger(__name__)
+
+# The most that is read of a frame, comment or atom holding a tag, larger
+# ones are skipped.
+MAX_FIELD_SIZE = 64 * 1024
+
+# The most that is read of a tag that has to be read in one go
+MAX_TAG_SIZE = 1024 * 1024
+
+ID3V1_GENRES = [
+    'Blues', 'Classic Rock', 'Country', 'Dance', 'Disco', 'Funk', 'Grunge',
+    'Hip-Hop', 'Jazz', 'Metal', 'New Age', 'Oldies', 'Other', 'Pop', 'R&B',
+    'Rap', 'Reggae', 'Rock', 'Techno', 'Industrial', 'Alternative', 'Ska',
+    'Death Metal', 'Pranks', 'Soundtrack', 'Euro-Techno', 'Ambient',
+    'Trip-Hop', 'Vocal', 'Jazz+Funk', 'Fusion', 'Trance', 'Classical',
+    'Instrumental', 'Acid', 'House', 'Game', 'Sound Clip', 'Gospel', 'Noise',
+    'AlternRock', 'Bass', 'Soul', 'Punk', 'Space', 'Meditative',
+    'Instrumental Pop', 'Instrumental Rock', 'Ethnic', 'Gothic', 'Darkwave',
+    'Techno-Industrial', 'Electronic', 'Pop-Folk', 'Eurodance', 'Dream',
+    'Southern Rock', 'Comedy', 'Cult', 'Gangsta', 'Top 40', 'Christian Rap',
+    'Pop/Funk', 'Jungle', 'Native American', 'Cabaret', 'New Wave',
+    'Psychadelic', 'Rave', 'Showtunes', 'Trailer', 'Lo-Fi', 'Tribal',
+    'Acid Punk', 'Acid Jazz', 'Polka', 'Retro', 'Musical', 'Rock & Roll',
+    'Hard Rock', 'Folk', 'Folk-Rock', 'National Folk', 'Swing', 'Fast Fusion',
+    'Bebob', 'Latin', 'Revival', 'Celtic', 'Bluegrass', 'Avantgarde',
+    'Gothic Rock', 'Progressive Rock', 'Psychedelic Rock', 'Symphonic Rock',
+    'Slow Rock', 'Big Band', 'Chorus', 'Easy Listening', 'Acoustic', 'Humour',
+    'Speech', 'Chanson', 'Opera', 'Chamber Music', 'Sonata', 'Symphony',
+    'Booty Bass', 'Primus', 'Porn Groove', 'Satire', 'Slow Jam', 'Club',
+    'Tango', 'Samba', 'Folklore', 'Ballad', 'Power Ballad', 'Rhythmic Soul',
+    'Freestyle', 'Duet', 'Punk Rock', 'Drum Solo', 'A capella',
+    'Euro-House', 'Dance Hall', 'Goa', 'Drum & Bass', 'Club-House',
+    'Hardcore', 'Terror', 'Indie', 'BritPop', 'Negerpunk', 'Polsk Punk',
+    'Beat', 'Christian Gangsta Rap', 'Heavy Metal', 'Black Metal',
+    'Crossover', 'Contemporary Christian', 'Christian Rock', 'Merengue',
+    'Salsa', 'Thrash Metal', 'Anime', 'JPop', 'Synthpop'
+]
+
+# The tags held by ID3v2 text frames, with the frame ids of ID3v2.2 first
+ID3_FRAMES = {
+    'TT2': 'title', 'TIT2': 'title',
+    'TP1': 'artist', 'TPE1': 'artist',
+    'TP2': 'album-artist', 'TPE2': 'album-artist',
+    'TAL': 'album', 'TALB': 'album',
+    'TCM': 'composer', 'TCOM': 'composer',
+    'TCO': 'genre', 'TCON': 'genre',
+    'TRK': 'track-number', 'TRCK': 'track-number',
+    'TPA': 'album-disc-number', 'TPOS': 'album-disc-number',
+    'TYE': 'date', 'TYER': 'date', 'TDRC': 'date',
+}
+
+# The MusicBrainz ids, keyed by the lowercased names they are stored under
+# in ID3v2 TXXX frames and MP4 freeform atoms.
+MUSICBRAINZ_IDS = {
+    'musicbrainz artist id': 'musicbrainz-artistid',
+    'musicbrainz album id': 'musicbrainz-albumid',
+    'musicbrainz album artist id': 'musicbrainz-albumartistid',
+    'musicbrainz track id': 'musicbrainz-trackid',
+}
+
+VORBIS_TAGS = {
+    'title': 'title',
+    'artist': 'artist',
+    'albumartist': 'album-artist',
+    'album artist': 'album-artist',
+    'album': 'album',
+    'composer': 'composer',
+    'genre': 'genre',
+    'date': 'date',
+    'tracknumber': 'track-number',
+    'tracktotal': 'track-count',
+    'totaltracks': 'track-count',
+    'discnumber': 'album-disc-number',
+    'disctotal': 'album-disc-count',
+    'totaldiscs': 'album-disc-count',
+    'comment': 'comment',
+    'description': 'comment',
+    'musicbrainz_artistid': 'musicbrainz-artistid',
+    'musicbrainz_albumid': 'musicbrainz-albumid',
+    'musicbrainz_albumartistid': 'musicbrainz-albumartistid',
+    'musicbrainz_trackid': 'musicbrainz-trackid',
+}
+
+MP4_ATOMS = {
+    '\xa9nam': 'title',
+    '\xa9ART': 'artist',
+    'aART': 'album-artist',
+    '\xa9alb': 'album',
+    '\xa9wrt': 'composer',
+    '\xa9gen': 'genre',
+    '\xa9day': 'date',
+    '\xa9cmt': 'comment',
+}
+
+# The tags that hold a number, possibly with a count after it
+COUNTS = {
+    'track-number': 'track-count',
+    'album-disc-number': 'album-disc-count',
+}
+
+NUMBER_RE = re.compile(r'\s*(\d+)(?:\s*/\s*(\d+))?')
+DATE_RE = re.compile(r'\s*(\d{4})(?:-(\d\d)(?:-(\d\d))?)?')
+GENRE_RE = re.compile(r'^\((\d+)\)(.*)$')
+
+ID3_ENCODINGS = ('latin-1', 'utf-16', 'utf-16-be', 'utf-8')
+
+class TagError(Exception):
+    pass
+
+def read_tags(path):
+    """
+    Read the tags of a music file.
+
+    :param path: The path to the file
+    :type path: str
+    :returns: The tags
+    :rtype: dict
+    :raises IOError: If the file can't be read
+    """
+    fp = open(path, 'rb')
+    try:
+        header = fp.read(12)
+        fp.seek(0)
+        tags = {}
+        try:
+            if header.startswith('ID3'):
+                read_id3v2(fp, tags)
+                read_id3v1(fp, tags)
+            elif header.startswith('fLaC'):
+                read_flac(fp, tags)
+            elif header.startswith('OggS'):
+                read_ogg(fp, tags)
+            elif header[4:8] == 'ftyp':
+                read_mp4(fp, tags)
+            else:
+                read_id3v1(fp, tags)
+        except (TagError, struct.error, ValueError) as e:
+            log.debug('Unable to read all of the tags of %s: %s', path, e)
+        return tags
+    finally:
+        fp.close()
+
+def read_file_tags(path):
+    """
+    Read the tags of a music file, returning None if it can't be read.
+    """
+    try:
+        return read_tags(path)
+    except (IOError, OSError):
+        return None
+
+def _set(tags, name, value):
+    """
+    Add a tag, converting its value to the type GStreamer would give it.
+    Tags that are already set are left alone.
+    """
+    if name in tags or value is None:
+        return
+    if isinstance(value, str):
+        value = value.decode('utf-8', 'replace')
+    value = value.strip(u'\x00\ufeff ')
+    if not value:
+        return
+
+    if name in COUNTS:
+        match = NUMBER_RE.match(value)
+        if match:
+            tags[name] = int(match.group(1))
+            if match.group(2):
+                _set(tags, COUNTS[name], match.group(2))
+    elif name in ('track-count', 'album-disc-count'):
+        if value.isdigit():
+            tags[name] = int(value)
+    elif name == 'date':
+        match = DATE_RE.match(value)
+        if match:
+            try:
+                tags[name] = datetime.date(int(match.group(1)),
+                    int(match.group(2) or 1), int(match.group(3) or 1))
+            except ValueError:
+                pass
+    elif name == 'genre':
+        tags[name] = _genre(value)
+    else:
+        tags[name] = value
+
+def _genre(value):
+    """
+    Resolve references to the ID3v1 genres, e.g. '(17)' and '17'.
+    """
+    match = GENRE_RE.match(value)
+    if match:
+        if match.group(2):
+            return match.group(2)
+        value = match.group(1)
+    if value.isdigit() and int(value) < len(ID3V1_GENRES):
+        return unicode(ID3V1_GENRES[int(value)])
+    return value
+
+def _read(fp, size, limit=MAX_FIELD_SIZE):
+    """
+    Read size bytes, or skip over them if there are more than limit.
+    """
+    if size > limit:
+        fp.seek(size, 1)
+        return None
+    data = fp.read(size)
+    if len(data) < size:
+        raise TagError('Unexpected end of file')
+    return data
+
+# ID3
+
+def _syncsafe(data):
+    value = 0
+    for byte in data:
+        value = (value << 7) | (ord(byte) & 0x7f)
+    return value
+
+def _unsync(data):
+    return data.replace('\xff\x00', '\xff')
+
+def _id3_text(data):
+    """
+    Decode the text of an ID3v2 frame, which starts with its encoding.
+    Returns the strings separated by nulls.
+    """
+    encoding = ord(data[0])
+    if encoding >= len(ID3_ENCODINGS):
+        raise TagError('Unknown text encoding %d' % encoding)
+    text = data[1:].decode(ID3_ENCODINGS[encoding], 'replace')
+    return text.split(u'\x00')
+
+def read_id3v2(fp, tags):
+    """
+    Read an ID3v2 tag from the start of a file.
+    """
+    header = fp.read(10)
+    if len(header) < 10 or not header.startswith('ID3'):
+        return
+    version = ord(header[3])
+    flags = ord(header[5])
+    end = 10 + _syncsafe(header[6:10])
+    if version not in (2, 3, 4):
+        raise TagError('Unknown ID3v2 version %d' % version)
+
+    # A tag that has been unsynchronised as a whole has to be undone before
+    # the frames can be found.
+    if flags & 0x80 and version < 4:
+        fp = StringIO(_unsync(fp.read(min(end - 10, MAX_TAG_SIZE))))
+        end = len(fp.getvalue())
+        fp.seek(0)
+    else:
+        fp.seek(10)
+
+    if flags & 0x40 and version == 3:
+        fp.seek(struct.unpack('>I', fp.read(4))[0], 1)
+    elif flags & 0x40 and version == 4:
+        fp.seek(_syncsafe(fp.read(4)) - 4, 1)
+
+    if version == 2:
+        id_size, header_size = 3, 6
+    else:
+        id_size, header_size = 4, 10
+
+    comments = []
+    while fp.tell() + header_size <= end:
+        header = fp.read(header_size)
+        frame_id = header[:id_size]
+        if len(header) < header_size or frame_id[0] == '\x00':
+            break
+
+        if version == 2:
+            size = struct.unpack('>I', '\x00' + header[3:6])[0]
+        elif version == 3:
+            size = struct.unpack('>I', header[4:8])[0]
+        else:
+            size = _syncsafe(header[4:8])
+        format_flags = version > 2 and ord(header[9]) or 0
+
+        wanted = (frame_id in ID3_FRAMES or frame_id in ('COMM', 'COM',
+            'TXXX', 'TXX', 'UFID', 'UFI', 'TDAT'))
+        data = _read(fp, size, wanted and MAX_FIELD_SIZE or 0)
+        if not data:
+            continue
+
+        # Skip compressed and encrypted frames, and undo the rest of the
+        # frame flags.
+        if version == 3:
+            if format_flags & 0xc0:
+                continue
+            if format_flags & 0x20:
+                data = data[1:]
+        elif version == 4:
+            if format_flags & 0x0c:
+                continue
+            if format_flags & 0x02:
+                data = _unsync(data)
+            if format_flags & 0x01:
+                data = data[4:]
+        if not data:
+            continue
+
+        if frame_id in ID3_FRAMES:
+            _set(tags, ID3_FRAMES[frame_id], _id3_text(data)[0])
+        elif frame_id == 'TDAT' and 'date' in tags:
+            # The day and month of an ID3v2.3 TYER year, as DDMM
+            day = _id3_text(data)[0]
+            if len(day) == 4 and day.isdigit():
+                try:
+                    tags['date'] = tags['date'].replace(month=int(day[2:]),
+                        day=int(day[:2]))
+                except ValueError:
+                    pass
+        elif frame_id in ('COMM', 'COM'):
+            strings = _id3_text(data[0] + data[4:])
+            if len(strings) > 1:
+                comments.append((strings[0], strings[1]))
+        elif frame_id in ('TXXX', 'TXX'):
+            strings = _id3_text(data)
+            if len(strings) > 1:
+                name = MUSICBRAINZ_IDS.get(strings[0].lower())
+                if name:
+                    _set(tags, name, strings[1])
+        elif frame_id in ('UFID', 'UFI'):
+            owner, sep, identifier = data.partition('\x00')
+            if owner == 'http://musicbrainz.org':
+                _set(tags, 'musicbrainz-trackid', identifier)
+
+    # Prefer comments without a description, many players store other
+    # things in comments with one.
+    comments.sort(key=lambda comment: bool(comment[0]))
+    for description, text in comments:
+        if not description.startswith(u'iTun'):
+            _set(tags, 'comment', text)
+            break
+
+def read_id3v1(fp, tags):
+    """
+    Read an ID3v1 tag from the end of a file. Tags that have already been
+    read from an ID3v2 tag are kept.
+    """
+    fp.seek(0, 2)
+    if fp.tell() < 128:
+        return
+    fp.seek(-128, 2)
+    data = fp.read(128)
+    if not data.startswith('TAG'):
+        return
+
+    def text(start, end):
+        return data[start:end].split('\x00')[0].decode('latin-1')
+
+    _set(tags, 'title', text(3, 33))
+    _set(tags, 'artist', text(33, 63))
+    _set(tags, 'album', text(63, 93))
+    _set(tags, 'date', text(93, 97))
+    _set(tags, 'comment', text(97, 127))
+
+    # ID3v1.1 keeps the track number at the end of the comment
+    if data[125] == '\x00' and data[126] != '\x00':
+        _set(tags, 'track-number', unicode(ord(data[126])))
+    if ord(data[127]) < len(ID3V1_GENRES):
+        _set(tags, 'genre', unicode(ID3V1_GENRES[ord(data[127])]))
+
+# Vorbis comments
+
+def _vorbis_comments(data, tags):
+    """
+    Read the tags in a Vorbis comment block.
+    """
+    fp = StringIO(data)
+    vendor_size = struct.unpack('<I', fp.read(4))[0]
+    fp.seek(vendor_size, 1)
+    count = struct.unpack('<I', fp.read(4))[0]
+    for i in xrange(count):
+        size = struct.unpack('<I', fp.read(4))[0]
+        comment = fp.read(size)
+        name, sep, value = comment.partition('=')
+        if sep and name.lower() in VORBIS_TAGS:
+            _set(tags, VORBIS_TAGS[name.lower()], value)
+
+def read_flac(fp, tags):
+    """
+    Read the Vorbis comments from the metadata blocks of a FLAC file.
+    """
+    fp.seek(4)
+    while True:
+        header = fp.read(4)
+        if len(header) < 4:
+            return
+        block_type = ord(header[0]) & 0x7f
+        size = struct.unpack('>I', '\x00' + header[1:4])[0]
+        if block_type == 4:
+            data = _read(fp, size, MAX_TAG_SIZE)
+            if data:
+                _vorbis_comments(data, tags)
+            return
+        fp.seek(size, 1)
+        if ord(header[0]) & 0x80:
+            return
+
+def _ogg_packets(fp):
+    """
+    Yield the packets of the first logical stream of an Ogg file.
+    """
+    serial = None
+    packet = []
+    read = 0
+    while read < MAX_TAG_SIZE:
+        header = fp.read(27)
+        if len(header) < 27:
+            return
+        if not header.startswith('OggS'):
+            raise TagError('Lost sync in Ogg stream')
+        page_serial = struct.unpack('<I', header[14:18])[0]
+        lacing = fp.read(ord(header[26]))
+        data = fp.read(sum([ord(size) for size in lacing]))
+        read += len(data)
+
+        if serial is None:
+            serial = page_serial
+        elif page_serial != serial:
+            continue
+
+        offset = 0
+        for size in lacing:
+            size = ord(size)
+            packet.append(data[offset:offset + size])
+            offset += size
+            if size < 255:
+                yield ''.join(packet)
+                packet = []
+
+def read_ogg(fp, tags):
+    """
+    Read the Vorbis comments from an Ogg Vorbis or Opus file.
+    """
+    packets = _ogg_packets(fp)
+    for first in packets:
+        break
+    else:
+        return
+
+    for comments in packets:
+        if first.startswith('\x01vorbis') and comments.startswith(
+                '\x03vorbis'):
+            _vorbis_comments(comments[7:], tags)
+        elif first.startswith('OpusHead') and comments.startswith(
+                'OpusTags'):
+            _vorbis_comments(comments[8:], tags)
+        return
+
+# MP4
+
+def _atoms(fp, end):
+    """
+    Yield the type, size and end of the atoms up to end, leaving the file
+    at the start of the contents of each.
+    """
+    while fp.tell() + 8 <= end:
+        start = fp.tell()
+        size, atom_type = struct.unpack('>I4s', fp.read(8))
+        if size == 1:
+            size = struct.unpack('>Q', fp.read(8))[0]
+        elif size == 0:
+            size = end - start
+        if size < 8:
+            raise TagError('Invalid atom size')
+        yield atom_type, fp.tell(), start + size
+        fp.seek(start + size)
+
+def _find_atom(fp, end, path):
+    """
+    Find the atom at a path of types, e.g. ['moov', 'udta'].
+    """
+    for atom_type, start, atom_end in _atoms(fp, end):
+        if atom_type == path[0]:
+            if len(path) == 1:
+                return start, atom_end
+            fp.seek(start)
+            if atom_type == 'meta':
+                # meta is a full atom, it has a version and flags
+                fp.seek(4, 1)
+            return _find_atom(fp, atom_end, path[1:])
+    return None
+
+def read_mp4(fp, tags):
+    """
+    Read the iTunes style metadata of an MP4 file.
+    """
+    fp.seek(0, 2)
+    size = fp.tell()
+    fp.seek(0)
+    found = _find_atom(fp, size, ['moov', 'udta', 'meta', 'ilst'])
+    if not found:
+        return
+
+    start, end = found
+    fp.seek(start)
+    for item_type, item_start, item_end in _atoms(fp, end):
+        if item_type == 'covr':
+            continue
+        data = _read(fp, item_end - item_start)
+        if not data:
+            continue
+
+        values = {}
+        item = StringIO(data)
+        for atom_type, atom_start, atom_end in _atoms(item, len(data)):
+            value = item.read(atom_end - atom_start)
+            if atom_type == 'data':
+                values['data'] = value[8:]
+                values['flags'] = struct.unpack('>I', value[:4])[0]
+            elif atom_type == 'name':
+                values['name'] = value[4:]
+        if 'data' not in values:
+            continue
+
+        value = values['data']
+        if item_type in MP4_ATOMS:
+            _set(tags, MP4_ATOMS[item_type], value)
+        elif item_type in ('trkn', 'disk') and len(value) >= 6:
+            number, count = struct.unpack('>HH', value[2:6])
+            name = item_type == 'trkn' and 'track-number' or \
+                'album-disc-number'
+            if number:
+                _set(tags, name, unicode(number))
+            if count:
+                _set(tags, COUNTS[name], unicode(count))
+        elif item_type == 'gnre' and len(value) >= 2:
+            genre = struct.unpack('>H', value[:2])[0] - 1
+            if 0 <= genre < len(ID3V1_GENRES):
+                _set(tags, 'genre', unicode(ID3V1_GENRES[genre]))
+        elif item_type == '----' and 'name' in values:
+            name = MUSICBRAINZ_IDS.get(values['name'].lower())
+            if name:
+                _set(tags, name, value)
+
+class TagReader(object):
+    """
+    Reads the tags of music files in the background. By default a thread
+    is used per file, given processes the files are read by a pool of
+    that many worker processes instead, which suits reading the tags of
+    thousands of files at once.
+
+    :param processes: The number of processes to read tags with
+    :type processes: int
+    """
+
+    def __init__(self, processes=None):
+        self.processes = processes
+        self.pool = processes and WorkerPool(__name__, processes)
+
+    def read(self, path):
+        """
+        Read the tags of a file.
+
+        :param path: The path to the file
+        :type path: str
+        :returns: A Deferred that fires with the tags, or None if the file
+            can't be read
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if not self.pool:
+            return threads.deferToThread(read_file_tags, path)
+        return self.pool.call(path).addCallback(self._on_read)
+
+    def _on_read(self, result):
+        if result:
+            return pickle.loads(result)
+
+    def read_files(self, paths):
+        """
+        Read the tags of a number of files.
+
+        :param paths: The paths to the files
+        :type paths: list
+        :returns: A Deferred that fires with a dict of path to tags
+        :rtype: twisted.internet.defer.Deferred
+        """
+        paths = list(paths)
+
+        def on_read(results):
+            return dict(zip(paths, [tags for (success, tags) in results]))
+
+        return defer.DeferredList([self.read(path) for path in paths]
+            ).addCallback(on_read)
+
+    def stop(self):
+        """
+        Stop the worker processes, if any have been started.
+
+        :returns: A Deferred that fires once the workers have exited
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if not self.pool:
+            return defer.succeed(None)
+        return self.pool.stop()
+
+def read_pickled_tags(path):
+    tags = read_file_tags(path)
+    if tags is not None:
+        return pickle.dumps(tags, pickle.HIGHEST_PROTOCOL)
+
+def main():
+    """
+    Run as a worker process for a TagReader.
+    """
+    serve(read_pickled_tags)
+
+if __name__ == '__main__':
+    main()
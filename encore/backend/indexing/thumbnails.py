@@ -0,0 +1,249 @@
+#
+# encore/backend/indexing/thumbnails.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+"""
+Generates thumbnails of photos. Thumbnails are stored under the
+fingerprint of the photo rather than its path, so they remain valid when
+the photo is moved and are shared by copies of it.
+
+A perceptual hash of each photo is computed from its smallest thumbnail,
+which is the same for resized and re-saved copies of the photo, unlike
+the fingerprint.
+"""
+
+import os
+import logging
+
+from twisted.internet import defer, threads
+
+from encore.config import config
+from encore.backend.indexing.workers import WorkerPool, serve
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+log = logging.getLogger(__name__)
+
+# The name of each thumbnail size and the largest width or height it is
+# scaled to.
+THUMBNAIL_SIZES = [
+    ('small', 160),
+    ('medium', 320),
+    ('large', 1024)
+]
+
+JPEG_QUALITY = 85
+
+# The size the image is reduced to for the perceptual hash, a bit is taken
+# from each pair of neighbouring pixels in a row.
+HASH_SIZE = 8
+
+def thumbnail_path(thumb_dir, fingerprint, size):
+    """
+    Return the path of the thumbnail of a size for a photo. Thumbnails are
+    spread over subdirectories by the start of the fingerprint.
+
+    :param thumb_dir: The directory the thumbnails are stored in
+    :type thumb_dir: str
+    :param fingerprint: The fingerprint of the photo
+    :type fingerprint: str
+    :param size: The name of the size
+    :type size: str
+    :rtype: str
+    """
+    return os.path.join(thumb_dir, size, fingerprint[:2], fingerprint + '.jpg')
+
+def _is_valid(path):
+    """
+    Thumbnails are renamed into place once written, so any that exists is
+    complete.
+    """
+    try:
+        return os.path.getsize(path) > 0
+    except OSError:
+        return False
+
+def dhash(image):
+    """
+    Compute the difference hash of an image, which has a bit set for each
+    pixel that is brighter than the one to its right once the image has
+    been reduced to 9x8 greys. Similar images have hashes that differ in
+    few bits.
+
+    :param image: The image
+    :type image: PIL.Image.Image
+    :returns: The hash, as 16 hex digits
+    :rtype: str
+    """
+    image = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE),
+        Image.ANTIALIAS)
+    pixels = list(image.getdata())
+    value = 0
+    for row in xrange(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in xrange(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] >
+                pixels[offset + col + 1])
+    return '%016x' % value
+
+def make_thumbnails(path, fingerprint, thumb_dir):
+    """
+    Write the thumbnails of a photo that don't already exist, and compute
+    its perceptual hash from the smallest of them.
+
+    JPEGs are decoded with draft(), which has the decoder scale the image
+    down while decompressing it, so a large photo is never decoded at full
+    resolution just to be shrunk.
+
+    :param path: The path to the photo
+    :type path: str
+    :param fingerprint: The fingerprint of the photo
+    :type fingerprint: str
+    :param thumb_dir: The directory the thumbnails are stored in
+    :type thumb_dir: str
+    :returns: The (width, height, phash) of the photo
+    :rtype: tuple
+    """
+    # Only the header of the image is read when it is opened
+    image = Image.open(path)
+    width, height = image.size
+
+    missing = [(size, max_size) for (size, max_size) in THUMBNAIL_SIZES
+        if not _is_valid(thumbnail_path(thumb_dir, fingerprint, size))]
+    smallest = min(THUMBNAIL_SIZES, key=lambda s: s[1])
+    if smallest not in missing:
+        phash = dhash(Image.open(thumbnail_path(thumb_dir, fingerprint,
+            smallest[0])))
+    if not missing:
+        return (width, height, phash)
+
+    # Draft to the largest thumbnail needed, the rest are scaled from it
+    largest = max(max_size for (size, max_size) in missing)
+    image.draft('RGB', (largest, largest))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    for size, max_size in sorted(missing, key=lambda s: s[1], reverse=True):
+        image.thumbnail((max_size, max_size), Image.ANTIALIAS)
+        filename = thumbnail_path(thumb_dir, fingerprint, size)
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another worker in the meantime
+                if not os.path.isdir(directory):
+                    raise
+
+        tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+        image.save(tmp_filename, 'JPEG', quality=JPEG_QUALITY)
+        os.rename(tmp_filename, filename)
+
+    if smallest in missing:
+        phash = dhash(image)
+    return (width, height, phash)
+
+def make_file_thumbnails(path, fingerprint, thumb_dir):
+    """
+    Same as make_thumbnails(), but returns None if the photo can't be
+    read rather than raising an error.
+    """
+    try:
+        return make_thumbnails(path, fingerprint, thumb_dir)
+    except Exception as e:
+        log.warning('Unable to make thumbnails of %s: %s', path, e)
+        return None
+
+class Thumbnailer(object):
+    """
+    Generates the thumbnails of photos in the background. Decoding and
+    scaling images is heavy on the CPU, so by default it is done by a pool
+    of worker processes, given no processes a thread is used per photo
+    instead.
+
+    Thumbnails are only generated if PIL is installed.
+
+    :param processes: The number of processes to generate thumbnails with
+    :type processes: int
+    :param thumb_dir: The directory to store thumbnails in, by default
+        config.IMAGE_THUMB_DIR
+    :type thumb_dir: str
+    """
+
+    def __init__(self, processes=2, thumb_dir=None):
+        self.processes = processes
+        self.thumb_dir = thumb_dir
+        self.pool = processes and WorkerPool(__name__, processes)
+
+    def generate(self, path, fingerprint):
+        """
+        Generate the thumbnails of a photo that don't already exist.
+
+        :param path: The path to the photo
+        :type path: str
+        :param fingerprint: The fingerprint of the photo
+        :type fingerprint: str
+        :returns: A Deferred that fires with the (width, height, phash)
+            of the photo, or None if it couldn't be read
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if Image is None or not fingerprint:
+            return defer.succeed(None)
+
+        thumb_dir = self.thumb_dir or config.IMAGE_THUMB_DIR
+        if not self.pool:
+            return threads.deferToThread(make_file_thumbnails, path,
+                fingerprint, thumb_dir)
+        return self.pool.call('\0'.join([path, fingerprint, thumb_dir])
+            ).addCallback(self._on_generated)
+
+    def _on_generated(self, result):
+        if result:
+            width, height, phash = result.split()
+            return (int(width), int(height), phash)
+
+    def stop(self):
+        """
+        Stop the worker processes, if any have been started.
+
+        :returns: A Deferred that fires once the workers have exited
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if not self.pool:
+            return defer.succeed(None)
+        return self.pool.stop()
+
+def serve_thumbnails(request):
+    result = make_file_thumbnails(*request.split('\0'))
+    if result:
+        return '%d %d %s' % result
+
+def main():
+    """
+    Run as a worker process for a Thumbnailer.
+    """
+    serve(serve_thumbnails)
+
+if __name__ == '__main__':
+    main()
@@ -21,60 +21,45 @@
 #
 
 import os
-import gst
 import logging
 import datetime
 
+from encore.backend.indexing.tags import read_tags
+
 log = logging.getLogger(__name__)
 
 class TagGetter(object):
     """
-    A utility class for getting metadata from mp3 files.
+    A utility class for getting metadata from music files. The tags are
+    available as attributes, e.g. tag_getter.track_number, and are None
+    if the file doesn't have them.
+
+    :param filename: The path to the file
+    :type filename: str
+    :param tags: The tags of the file if they have already been read,
+        e.g. by a TagReader
+    :type tags: dict
     """
 
-    def __init__(self, filename):
-        # Ensure that the file exists as otherwise the message.pop() method
-        # causes this to hang.
+    def __init__(self, filename, tags=None):
         if not os.path.isfile(filename):
             raise IOError("No such file: '%s'" % filename)
 
-        self.tags = {}
-
-        self.pipeline = gst.parse_launch(
-            'filesrc location=%s ! id3demux ! fakesink' % filename)
-
-        bus = self.pipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect('message::tag', self.handle_bus_message_tag)
-        self.pipeline.set_state(gst.STATE_PAUSED)
-
-        while True:
-            message = bus.pop()
-            if not message:
-                continue
-            if message.type == gst.MESSAGE_TAG:
-                for key in message.parse_tag().keys():
-                    self.tags[key] = message.parse_tag()[key]
-                break
-
-    def handle_bus_message_tag(self, message):
-        """
-        Handle the 'message::tag' bus message.
-        """
-        taglist = message.parse_tag()
-        for key in taglist.keys():
-            self.tags[key] = taglist[key]
+        if tags is None:
+            tags = read_tags(filename)
+        self.tags = tags
 
     def __getattr__(self, attr):
-        # TODO: handle types better
+        if attr.startswith('__') or attr == 'tags':
+            raise AttributeError(attr)
 
         val = self.tags.get(attr.replace('_', '-'))
 
         if val is None:
             return None
 
-        if type(val) == gst.Date:
-            return datetime.date(val.year, val.month, val.day)
+        if isinstance(val, datetime.date):
+            return val
 
         try:
             return int(val)
@@ -24,8 +24,15 @@ import os
 import re
 from collections import namedtuple
 
-from encore.lib.tmdb import MovieDb, config as tmdb_config
+from xdg.BaseDirectory import xdg_cache_home
+
+from encore.backend.indexing.hashing import HashCache, Hasher
+from encore.lib.cache import ResponseCache
+from encore.lib.http import HTTPClient
+from encore.lib.matching import Matcher, parse_year
+from encore.lib.tmdb import AsyncMovieDb, TmdNoResults, config as tmdb_config
 from encore.lib.tvdb import TvDb
+from encore.utils.lru import memoize
 
 # The TV DB key
 TVDB_KEY = '5B4FABAEAB3DAB49'
@@ -33,12 +40,26 @@ TVDB_KEY = '5B4FABAEAB3DAB49'
 # The Movie DB key
 TMDB_KEY = '9b41e54a1df985e5d9e90cab7646e5ca'
 
+# The responses from both apis are kept in the same cache, and fetched
+# using the same pool of connections.
+cache = ResponseCache(os.path.join(xdg_cache_home, 'encore',
+    'metadata.cache'))
+http = HTTPClient(max_per_host=4)
+
 # Configure and create the moviedb api
 tmdb_config['key'] = TMDB_KEY
-mdb = MovieDb()
+mdb = AsyncMovieDb(cache, http)
+
+# Search results from both apis are ranked by the same matcher
+matcher = Matcher()
 
 # Create the tvdb api
-tvdb = TvDb(TVDB_KEY)
+tvdb = TvDb(TVDB_KEY, cache=cache, http=http, matcher=matcher)
+
+# Hashes of video files, used to look movies up by their contents
+hasher = Hasher(HashCache(os.path.join(xdg_cache_home, 'encore',
+    'hashes.cache')))
+hasher.cache.load()
 
 # Title split keywords
 TITLE_SPLIT_KEYWORDS = [
@@ -62,8 +83,45 @@ SERIES_PATH_RE = [
     re.compile(r'(?P<title>.*?)\s*?(/|-)\s*[a-zA-Z]+\s+(?P<season>\d{1,2})/[^/]*?(?P<episode>\d{1,2})[^/]*?')
 ]
 
+def _combine(regexps):
+    """
+    Join a list of regexps into a single one that matches the same as the
+    first of them to match. The groups of each are renamed, so title in
+    the second becomes title_1.
+    """
+    patterns = []
+    for i, regexp in enumerate(regexps):
+        patterns.append(re.sub(r'\(\?P<(\w+)>', r'(?P<\1_%d>' % i,
+            regexp.pattern))
+    return re.compile('|'.join(patterns)), len(patterns)
+
+def _groups(match, count):
+    """
+    Return the title, season and episode groups of whichever of the
+    combined regexps matched.
+    """
+    for i in xrange(count):
+        if match.start('season_%d' % i) != -1:
+            return (match.group('title_%d' % i), match.group('season_%d' % i),
+                match.group('episode_%d' % i), match.start('episode_%d' % i))
+
+# The regexps above all start with a lazy match of the title, so if they
+# match anywhere they match at the start of the string and match() can be
+# used rather than search().
+TITLE_SPLIT_RE = re.compile('|'.join([re.escape(item) for item in
+    TITLE_SPLIT_KEYWORDS]))
+SERIES_FILENAME_MATCH, SERIES_FILENAME_COUNT = _combine(SERIES_FILENAME_RE)
+SERIES_PATH_MATCH, SERIES_PATH_COUNT = _combine(SERIES_PATH_RE)
+
+# Matches the episode number taken from a filename by SERIES_PATH_RE
+EPISODE_RE = re.compile(r'\d{1,2}')
+
 VideoFileInfo = namedtuple('VideoFileInfo', 'title episode season')
 
+# The widths of the movie posters and backdrops to use
+POSTER_WIDTH = 500
+BACKDROP_WIDTH = 1280
+
 class VideoMetadata(object):
 
     def __init__(self, data=None):
@@ -81,11 +139,11 @@ class MovieMetadata(VideoMetadata):
     
     @property
     def poster(self):
-        return self.images[0]
+        return self.images.best('poster', POSTER_WIDTH)
 
     @property
     def backdrop(self):
-        return self.images[1]
+        return self.images.best('backdrop', BACKDROP_WIDTH)
 
 class SeriesMetadata(VideoMetadata):
 
@@ -121,11 +179,36 @@ def strip_filename(filename):
     for item in TITLE_STRIP_SEARCH:
         filename = filename.replace(item, ' ')
 
-    # Split title at keywords
-    for item in TITLE_SPLIT_KEYWORDS:
-        filename = filename.split(item)[0]
+    # Split title at the first keyword
+    match = TITLE_SPLIT_RE.search(filename)
+    if match:
+        filename = filename[:match.start()]
     return filename.strip()
 
+@memoize(4096)
+def _parse_directory(directory, has_digit):
+    """
+    Search a directory for the title and season of the episodes within
+    it. The result only depends on whether the filename contains a digit,
+    so it is shared by every episode in the directory.
+
+    :returns: A tuple of (title, season, episode), where episode is None
+        if it is to be taken from the filename, or None if the directory
+        doesn't match
+    :rtype: tuple
+    """
+    path = directory + (has_digit and '/0' or '/')
+    match = SERIES_PATH_MATCH.match(path)
+    if not match:
+        return None
+
+    title, season, episode, start = _groups(match, SERIES_PATH_COUNT)
+    if start > len(directory):
+        episode = None
+    else:
+        episode = int(episode)
+    return (os.path.basename(title).strip(), int(season), episode)
+
 def parse_path(path):
     """
     Parse the path to the video file. Parsing the whole path allows for
@@ -143,57 +226,94 @@ def parse_path(path):
 
     # Lowercase path and get the filename minus extension
     path = path.lower()
+    directory, sep, basename = path.rpartition('/')
 
     # Strip the filename
-    filename = strip_filename(os.path.basename(path))
+    filename = strip_filename(basename)
 
     # Search the filename for the title, season and episode
-    for regexp in SERIES_FILENAME_RE:
-        match = regexp.search(filename)
-        if match:
-            break
+    match = SERIES_FILENAME_MATCH.match(filename)
+    if match:
+        title, season, episode, start = _groups(match, SERIES_FILENAME_COUNT)
+        return VideoFileInfo(
+            title   = os.path.basename(title).strip(),
+            season  = int(season),
+            episode = int(episode)
+        )
 
     # Search the path for the title, season and episode
-    if not match:
-        for regexp in SERIES_PATH_RE:
-            match = regexp.search(path)
-            if match:
-                break
-
-    if not match:
+    episode = sep and EPISODE_RE.search(basename)
+    info = sep and _parse_directory(directory, bool(episode))
+    if not info:
         return VideoFileInfo(
             title   = filename,
             season  = None,
             episode = None
         )
 
-    # Get the information from the regexp match
-    return VideoFileInfo (
-        title   = os.path.basename(match.group('title')).strip(),
-        season  = int(match.group('season')),
-        episode = int(match.group('episode'))
+    title, season, dir_episode = info
+    if dir_episode is None:
+        dir_episode = int(episode.group())
+    return VideoFileInfo(
+        title   = title,
+        season  = season,
+        episode = dir_episode
     )
 
+def parse_paths(paths):
+    """
+    Parse the paths to a number of video files.
+
+    :param paths: The paths of the videos
+    :type paths: iterable
+    :returns: A list of the parsed paths, as returned by parse_path()
+    :rtype: list
+    """
+    return [parse_path(path) for path in paths]
+
 def get_movie_metadata(title):
     """
     Search themoviedb.org for metadata for the movie specified.
 
     :param title: The movie title
     :type title: str
-    :returns: Information about the movie
-    :rtype: MovieMetadata
+    :returns: A Deferred that fires with information about the movie, or
+        None if it can't be found
+    :rtype: twisted.internet.defer.Deferred
     """
 
-    results = mdb.search(title)
-    for result in results:
-        if title == result['name'].lower():
-            break
-        result = None
+    def got_results(results):
+        index, score = matcher.match(title,
+            [result.get('name') for result in results],
+            [parse_year(result.get('released')) for result in results])
+        if index is not None:
+            return MovieMetadata(results[index])
 
-    if result is None:
-        return
+    return mdb.search(title).addCallback(got_results)
+
+def get_movie_metadata_by_file(filename):
+    """
+    Look a movie up on themoviedb.org by the OpenSubtitles hash of its
+    file.
+
+    :param filename: The path to the movie
+    :type filename: str
+    :returns: A Deferred that fires with detailed information about the
+        movie, or None if it can't be found
+    :rtype: twisted.internet.defer.Deferred
+    """
 
-    return MovieMetadata(result)
+    def got_hash(fhash):
+        if not fhash:
+            return None
+        return mdb.hashGetInfo(fhash).addCallbacks(MovieMetadata,
+            no_results)
+
+    def no_results(failure):
+        failure.trap(TmdNoResults)
+        return None
+
+    return hasher.hash(filename).addCallback(got_hash)
 
 def get_movie_info(movie_id):
     """
@@ -201,18 +321,19 @@ def get_movie_info(movie_id):
 
     :param movie_id: The moviedb.org movie id
     :type movie_id: str or int
-    :returns: Detailed information about the movie
-    :rtype: MovieMetadata
+    :returns: A Deferred that fires with detailed information about the
+        movie
+    :rtype: twisted.internet.defer.Deferred
     """
-    
-    return MovieMetadata(mdb.getMovieInfo(movie_id))
+
+    return mdb.getMovieInfo(movie_id).addCallback(MovieMetadata)
 
 def get_series_metadata(title):
     """
     Search thetvdb.org for metadata for the series specified.
 
-    :param title: The series title
-    :type title: str
+    :param title: The series title or id
+    :type title: str/int
     :returns: Information about the series
     :rtype: SeriesMetadata
     """
@@ -220,7 +341,10 @@ def get_series_metadata(title):
     def got_series_metadata(series):
         return SeriesMetadata(series._data)
 
-    return tvdb.get_series(title).addCallback(got_series_metadata)
+    if isinstance(title, int):
+        return tvdb.get_series_by_id(title).addCallback(got_series_metadata)
+    else:
+        return tvdb.get_series(title).addCallback(got_series_metadata)
 
 def get_season_metadata(title, season):
     """
@@ -0,0 +1,233 @@
+#
+# encore/backend/indexing/walker.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+import stat
+import logging
+from collections import deque
+
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+from encore.backend.indexing.manifest import file_stat
+
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+log = logging.getLogger(__name__)
+
+def list_directory(path, accept, manifest=None):
+    """
+    Read a single directory, returning its mtime, the accepted files within
+    it and the names of its subdirectories.
+
+    :param path: The directory to read
+    :type path: str
+    :param accept: Called with each filename, returns whether the file
+        should be included
+    :type accept: callable
+    :param manifest: If provided, the recorded listing is returned for
+        directories that haven't changed
+    :type manifest: Manifest
+    :returns: A tuple of (mtime, [(path, FileStat)], [subdir names])
+    :rtype: tuple
+    """
+    st = os.stat(path)
+    listing = manifest and manifest.listing(path, st)
+    if not listing:
+        if scandir is None:
+            listing = _listdir(path, accept)
+        else:
+            listing = _scandir(path, accept)
+    return (st.st_mtime,) + tuple(listing)
+
+def _listdir(path, accept):
+    entries, subdirs = [], []
+    for name in os.listdir(path):
+        fpath = os.path.join(path, name)
+        try:
+            st = os.stat(fpath)
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            subdirs.append(name)
+        elif stat.S_ISREG(st.st_mode) and accept(name):
+            entries.append((fpath, file_stat(st)))
+    return entries, subdirs
+
+def _scandir(path, accept):
+    # The directory entry type comes for free with the listing, so only
+    # the accepted files need to be stat'd.
+    entries, subdirs = [], []
+    for entry in scandir(path):
+        try:
+            if entry.is_dir():
+                subdirs.append(entry.name)
+            elif entry.is_file() and accept(entry.name):
+                entries.append((entry.path, file_stat(entry.stat())))
+        except OSError:
+            continue
+    return entries, subdirs
+
+class Walker(object):
+    """
+    Abstract class for the engines the indexer uses to walk directories.
+    """
+
+    def walk(self, directory, accept, callback, manifest=None):
+        """
+        Walk a directory tree, calling callback with (path, mtime,
+        [(path, FileStat)], [subdir names]) in the reactor thread for each
+        directory found. If the callback returns a Deferred no more
+        directories are read until it has fired.
+
+        :param directory: The directory to walk
+        :type directory: str
+        :param accept: Called with each filename, returns whether the file
+            should be included
+        :type accept: callable
+        :param callback: Called for each directory
+        :type callback: callable
+        :param manifest: If provided, used to skip reading directories
+            that haven't changed since the manifest was recorded
+        :type manifest: Manifest
+        :returns: A Deferred that fires once the walk has completed
+        :rtype: twisted.internet.defer.Deferred
+        """
+        raise NotImplementedError
+
+class SimpleWalker(Walker):
+    """
+    Walks directories one at a time in the reactor thread.
+    """
+
+    def walk(self, directory, accept, callback, manifest=None):
+        pending = [directory]
+
+        def next_directory(result=None):
+            while pending:
+                path = pending.pop()
+                try:
+                    mtime, entries, subdirs = list_directory(path, accept,
+                        manifest)
+                except OSError as e:
+                    log.warning('Unable to read %s: %s', path, e)
+                    continue
+
+                pending.extend([os.path.join(path, d) for d in subdirs])
+                d = callback(path, mtime, entries, subdirs)
+                if isinstance(d, defer.Deferred):
+                    return d.addCallback(next_directory)
+
+        return defer.maybeDeferred(next_directory)
+
+class ParallelWalker(Walker):
+    """
+    Walks directories using a bounded pool of threads so that several
+    directories are read at once, which hides the latency of network
+    filesystems. Results are passed back to the reactor a directory at a
+    time as they are read.
+    """
+
+    def __init__(self, max_threads=4):
+        self.max_threads = max_threads
+        self.threadpool = ThreadPool(0, max_threads, 'ParallelWalker')
+        self._shutdown_trigger = None
+
+    def walk(self, directory, accept, callback, manifest=None):
+        if not self.threadpool.started:
+            self.threadpool.start()
+            self._shutdown_trigger = reactor.addSystemEventTrigger(
+                'during', 'shutdown', self.stop)
+        return _ParallelWalk(self, directory, accept, callback,
+            manifest).start()
+
+    def stop(self):
+        """
+        Stop the thread pool used by the walker, a new one is started by
+        the next walk.
+        """
+        if self._shutdown_trigger:
+            reactor.removeSystemEventTrigger(self._shutdown_trigger)
+            self._shutdown_trigger = None
+        if self.threadpool.started:
+            self.threadpool.stop()
+            self.threadpool = ThreadPool(0, self.max_threads,
+                'ParallelWalker')
+
+class _ParallelWalk(object):
+    """
+    The state of a single walk started by a ParallelWalker.
+    """
+
+    def __init__(self, walker, directory, accept, callback, manifest):
+        self.walker = walker
+        self.accept = accept
+        self.callback = callback
+        self.manifest = manifest
+        self.pending = deque([directory])
+        self.active = 0
+        self.paused = 0
+        self.deferred = defer.Deferred()
+
+    def start(self):
+        self._next()
+        return self.deferred
+
+    def _next(self):
+        if self.paused:
+            return
+
+        while self.pending and self.active < self.walker.max_threads:
+            path = self.pending.popleft()
+            self.active += 1
+            threads.deferToThreadPool(reactor, self.walker.threadpool,
+                list_directory, path, self.accept, self.manifest
+            ).addCallbacks(self._on_listed, self._on_error,
+                callbackArgs=(path,), errbackArgs=(path,))
+
+        if not self.active and not self.pending and not self.deferred.called:
+            self.deferred.callback(None)
+
+    def _on_listed(self, result, path):
+        self.active -= 1
+        mtime, entries, subdirs = result
+        self.pending.extend([os.path.join(path, d) for d in subdirs])
+        try:
+            d = self.callback(path, mtime, entries, subdirs)
+            if isinstance(d, defer.Deferred):
+                self.paused += 1
+                d.addBoth(self._on_resume)
+        finally:
+            self._next()
+
+    def _on_resume(self, result):
+        self.paused -= 1
+        self._next()
+        return result
+
+    def _on_error(self, failure, path):
+        self.active -= 1
+        log.warning('Unable to read %s: %s', path, failure.getErrorMessage())
+        self._next()
@@ -0,0 +1,142 @@
+#
+# encore/backend/indexing/watcher.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import logging
+
+from twisted.internet import reactor
+from twisted.python import filepath
+
+try:
+    from twisted.internet import inotify
+except ImportError:
+    # inotify is only available on Linux
+    inotify = None
+
+log = logging.getLogger(__name__)
+
+class Watcher(object):
+    """
+    Watches directory trees for changes using inotify. Events are
+    coalesced, so a burst of activity (e.g. a download finishing) results
+    in a single call to the callback with every affected path.
+
+    The callback is called with a set of changed file paths and a set of
+    directories which have been created, moved or removed as a whole.
+    """
+
+    # Files are only interesting once they have been completely written or
+    # moved into place, but directories need picking up as soon as they
+    # appear as their contents won't generate any events of their own.
+    FILE_MASK = 0
+    DIRECTORY_MASK = 0
+    if inotify is not None:
+        FILE_MASK = (inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO |
+            inotify.IN_MOVED_FROM | inotify.IN_DELETE)
+        DIRECTORY_MASK = (inotify.IN_CREATE | inotify.IN_MOVED_TO |
+            inotify.IN_MOVED_FROM | inotify.IN_DELETE)
+
+    def __init__(self, callback, delay=2.0, max_delay=30.0):
+        """
+        :param callback: Called with (files, directories) once events have
+            settled
+        :type callback: callable
+        :param delay: How long to wait after the last event before calling
+            the callback
+        :type delay: float
+        :param max_delay: The longest to wait after the first event, so a
+            constant stream of events can't postpone the callback forever
+        :type max_delay: float
+        """
+        if inotify is None:
+            raise NotImplementedError('inotify is not supported')
+
+        self.callback = callback
+        self.delay = delay
+        self.max_delay = max_delay
+        self.files = set()
+        self.directories = set()
+        self._first_event = None
+        self._delayed_call = None
+        self._notifier = inotify.INotify()
+        self._notifier.startReading()
+
+    @classmethod
+    def is_supported(cls):
+        """
+        Check whether or not watching is supported on this platform.
+        """
+        return inotify is not None
+
+    def watch(self, directory):
+        """
+        Start watching a directory and all of its subdirectories.
+
+        :param directory: The directory to watch
+        :type directory: str
+        :returns: Whether or not the directory is being watched
+        :rtype: bool
+        """
+        try:
+            self._notifier.watch(filepath.FilePath(directory),
+                self.FILE_MASK | self.DIRECTORY_MASK, autoAdd=True,
+                callbacks=[self._on_event], recursive=True)
+        except Exception as e:
+            log.warning('Unable to watch %s: %s', directory, e)
+            return False
+        return True
+
+    def stop(self):
+        """
+        Stop watching all directories, discarding any pending events.
+        """
+        if self._delayed_call and self._delayed_call.active():
+            self._delayed_call.cancel()
+        self._delayed_call = None
+        self._notifier.loseConnection()
+
+    def _on_event(self, watch, path, mask):
+        if mask & inotify.IN_ISDIR:
+            if not mask & self.DIRECTORY_MASK:
+                return
+            self.directories.add(path.path)
+        else:
+            if not mask & self.FILE_MASK:
+                return
+            self.files.add(path.path)
+
+        now = reactor.seconds()
+        if self._first_event is None:
+            self._first_event = now
+        delay = max(0, min(self.delay,
+            self._first_event + self.max_delay - now))
+
+        if self._delayed_call and self._delayed_call.active():
+            self._delayed_call.reset(delay)
+        else:
+            self._delayed_call = reactor.callLater(delay, self._flush)
+
+    def _flush(self):
+        files, directories = self.files, self.directories
+        self.files, self.directories = set(), set()
+        self._first_event = None
+        self._delayed_call = None
+        self.callback(files, directories)
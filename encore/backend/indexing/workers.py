@@ -0,0 +1,166 @@
+#
+# encore/backend/indexing/workers.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+"""
+Pools of worker processes for work that is too heavy on the CPU to do in
+threads. The workers are started afresh rather than forked, as forking a
+process that is running threads isn't safe.
+"""
+
+import os
+import sys
+import logging
+import traceback
+from collections import deque
+
+from twisted.internet import defer, protocol, reactor
+
+log = logging.getLogger(__name__)
+
+# The directory containing the encore package, so that worker processes
+# import the same encore as this one.
+ENCORE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__)))))
+
+class WorkerProtocol(protocol.ProcessProtocol):
+    """
+    Talks to a worker process started by a WorkerPool. Requests are
+    written to the worker a line at a time and it answers each with a
+    line holding the result, or an empty line if there isn't one.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.pending = deque()
+        self.ended = defer.Deferred()
+        self._buffer = ''
+
+    def call(self, arg):
+        d = defer.Deferred()
+        self.pending.append(d)
+        self.transport.write(arg.encode('string_escape') + '\n')
+        return d
+
+    def outReceived(self, data):
+        lines = (self._buffer + data).split('\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            self.pending.popleft().callback(
+                line and line.decode('string_escape') or None)
+
+    def errReceived(self, data):
+        log.warning('%s worker: %s', self.name, data.rstrip())
+
+    def processEnded(self, reason):
+        while self.pending:
+            self.pending.popleft().errback(reason)
+        self.ended.callback(None)
+
+class WorkerPool(object):
+    """
+    A number of worker processes running a module, which answers the
+    requests sent to it with serve(). The workers are started when the
+    first request is made, and a worker that exits is replaced when the
+    next one is made.
+
+    :param module: The name of the module the workers run
+    :type module: str
+    :param processes: The number of worker processes
+    :type processes: int
+    """
+
+    def __init__(self, module, processes):
+        self.module = module
+        self.processes = processes
+        self._workers = []
+        self._shutdown_trigger = None
+
+    def call(self, arg):
+        """
+        Send a request to the least busy worker.
+
+        :param arg: The request
+        :type arg: str
+        :returns: A Deferred that fires with the result, or None if there
+            wasn't one
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if len(self._workers) < self.processes:
+            self._start()
+        worker = min(self._workers, key=lambda w: len(w.pending))
+        return worker.call(arg)
+
+    def stop(self):
+        """
+        Stop the worker processes, if any have been started.
+
+        :returns: A Deferred that fires once the workers have exited
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if self._shutdown_trigger:
+            reactor.removeSystemEventTrigger(self._shutdown_trigger)
+            self._shutdown_trigger = None
+
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.transport.closeStdin()
+        return defer.DeferredList([worker.ended for worker in workers])
+
+    def _start(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([ENCORE_ROOT] + sys.path)
+        args = [sys.executable, '-m', self.module]
+        name = self.module.rsplit('.', 1)[-1]
+        while len(self._workers) < self.processes:
+            worker = WorkerProtocol(name)
+            reactor.spawnProcess(worker, sys.executable, args, env=env)
+            worker.ended.addCallback(self._ended, worker)
+            self._workers.append(worker)
+        if not self._shutdown_trigger:
+            self._shutdown_trigger = reactor.addSystemEventTrigger('before',
+                'shutdown', self.stop)
+
+    def _ended(self, result, worker):
+        # Any requests still pending on the worker have failed, it is
+        # replaced when the next request is made.
+        if worker in self._workers:
+            log.warning('%s worker exited unexpectedly', worker.name)
+            self._workers.remove(worker)
+        return result
+
+def serve(func):
+    """
+    Run as a worker process, answering each request with func(request).
+    func should return a str, or None if there is no result. Requests that
+    func fails on are answered with None.
+
+    :param func: The function to call
+    :type func: callable
+    """
+    for line in iter(sys.stdin.readline, ''):
+        try:
+            result = func(line.rstrip('\n').decode('string_escape'))
+        except Exception:
+            traceback.print_exc()
+            result = None
+        sys.stdout.write('%s\n' % (result or '').encode('string_escape'))
+        sys.stdout.flush()
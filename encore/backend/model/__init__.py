@@ -21,30 +21,209 @@
 #
 
 import os
+import logging
 
-from sqlalchemy import create_engine, func, text
+from sqlalchemy import create_engine, event, func, text
 from sqlalchemy.orm import sessionmaker, scoped_session
+from twisted.internet import reactor, threads
+from twisted.python.threadpool import ThreadPool
 
 from encore.backend.model.classes import *
+from encore.backend.model.migrations import migrate, set_schema_version
+from encore.backend.model.migrations import SCHEMA_VERSION
 from encore.component import Component
 from encore.config import config
 
+log = logging.getLogger(__name__)
+
+def configure_connection(dbapi_conn, connection_record):
+    """
+    Tune each new SQLite connection. WAL mode lets the library be read
+    while the indexer is writing and, combined with synchronous=NORMAL,
+    avoids an fsync on every commit.
+    """
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode = WAL')
+    cursor.execute('PRAGMA synchronous = NORMAL')
+    cursor.execute('PRAGMA cache_size = -16000')
+    cursor.execute('PRAGMA temp_store = MEMORY')
+    cursor.close()
+
+    # Stop the sqlite3 module from managing transactions itself, it
+    # commits before schema changes and breaks savepoints. Transactions
+    # are started by begin_transaction() instead.
+    dbapi_conn.isolation_level = None
+
+def begin_transaction(conn):
+    conn.execute('BEGIN')
+
 class Database(Component):
+    """
+    The media library database.
 
-    def __init__(self):
+    SQL is kept off the reactor thread by read() and write(), which run a
+    function with a session in a thread pool and return a Deferred that
+    fires with its result. Reads are run by several threads at once,
+    writes are serialized through a single thread and committed in
+    batches.
+    """
+
+    def __init__(self, filename=None, batch_size=500, batch_interval=0.5,
+            read_threads=3):
         super(Database, self).__init__('Database')
+        self.filename = filename
         self.engine = None
-        
+
+        # Writes are committed together once batch_size of them have been
+        # made, or batch_interval seconds after the first of them,
+        # whichever comes first.
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.clock = reactor
+        self._batched = 0
+        self._flush_call = None
+        self._shutdown_trigger = None
+
+        self.read_threads = read_threads
+        self.readers = None
+        self.writer = None
+
     def initialize(self):
-        dburi = 'sqlite:///' + config.DB_FILE
+        filename = self.filename or config.DB_FILE
+        dburi = 'sqlite:///' + filename
         self.engine = create_engine(dburi)
+        event.listen(self.engine, 'connect', configure_connection)
+        event.listen(self.engine, 'begin', begin_transaction)
+
+        # Objects are handed back to the reactor thread after the write
+        # that made them has been committed, so don't expire them.
         sm = sessionmaker(autoflush=False, autocommit=False,
-            bind=self.engine)
+            expire_on_commit=False, bind=self.engine)
         self.Session = scoped_session(sm)
+        self._write_session = sm()
 
-        # Create the database if it doesn't already exist
-        if not os.path.isfile(config.DB_FILE):
+        # Create the database if it doesn't already exist, otherwise bring
+        # it up to date.
+        if not os.path.isfile(filename):
             meta.create_all(bind=self.engine)
+            set_schema_version(self.engine, SCHEMA_VERSION)
+        else:
+            migrate(self.engine)
+
+        self.readers = ThreadPool(0, self.read_threads, 'DatabaseReader')
+        self.writer = ThreadPool(1, 1, 'DatabaseWriter')
+        self.readers.start()
+        self.writer.start()
+
+        # Make sure nothing that has been batched is lost on shutdown
+        self._shutdown_trigger = reactor.addSystemEventTrigger('before',
+            'shutdown', self.close)
+
+    def close(self):
+        """
+        Commit any batched writes and close the database.
+
+        :returns: A Deferred that fires once the database has been closed
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if self._shutdown_trigger:
+            reactor.removeSystemEventTrigger(self._shutdown_trigger)
+            self._shutdown_trigger = None
+        return self.flush().addBoth(self._close)
+
+    def _close(self, result):
+        self.readers.stop()
+        self.writer.stop()
+        self._write_session.close()
+        self.Session.remove()
+        self.engine.dispose()
+        return result
+
+    def read(self, func, *args, **kwargs):
+        """
+        Run func(session, *args, **kwargs) in one of the reader threads.
+        The session is closed afterwards, so anything needed from the
+        objects returned must be loaded by func. Writes are only seen once
+        their batch has been committed.
+
+        :param func: The function to call
+        :type func: callable
+        :returns: A Deferred that fires with the result of func
+        :rtype: twisted.internet.defer.Deferred
+        """
+        return threads.deferToThreadPool(reactor, self.readers,
+            self._read, func, args, kwargs)
+
+    def _read(self, func, args, kwargs):
+        session = self.Session()
+        try:
+            return func(session, *args, **kwargs)
+        finally:
+            self.Session.remove()
+
+    def write(self, func, *args, **kwargs):
+        """
+        Run func(session, *args, **kwargs) in the writer thread. The
+        changes func makes are flushed and form part of the current batch
+        of writes. If func fails only its own changes are rolled back.
+
+        :param func: The function to call
+        :type func: callable
+        :returns: A Deferred that fires with the result of func
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if not self._flush_call:
+            self._flush_call = self.clock.callLater(self.batch_interval,
+                self.flush)
+        return threads.deferToThreadPool(reactor, self.writer,
+            self._write, func, args, kwargs)
+
+    def _write(self, func, args, kwargs):
+        session = self._write_session
+        savepoint = session.begin_nested()
+        try:
+            result = func(session, *args, **kwargs)
+            savepoint.commit()
+        except:
+            savepoint.rollback()
+            raise
+
+        self._batched += 1
+        if self._batched >= self.batch_size:
+            self._commit()
+        return result
+
+    def _commit(self):
+        if not self._batched:
+            return
+        log.debug('Committing %d batched writes', self._batched)
+        self._write_session.commit()
+        self._batched = 0
+
+    def save(self, *objects):
+        """
+        Add or update objects as part of the current batch of writes.
+
+        :returns: A Deferred that fires once the objects have been saved
+        :rtype: twisted.internet.defer.Deferred
+        """
+        return self.write(lambda session: session.add_all(objects))
+
+    def flush(self):
+        """
+        Commit the current batch of writes.
+
+        :returns: A Deferred that fires once the batch has been committed
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if self._flush_call and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        return threads.deferToThreadPool(reactor, self.writer, self._commit)
+
+    # The methods below use a session belonging to the calling thread and
+    # block it while the database is accessed. Code running in the reactor
+    # thread should use read() and write() instead.
 
     def add(self, *args):
         return self.Session.add(*args)
@@ -34,18 +34,39 @@ class Photo(object):
 class Show(object):
     pass
 
+class ShowAlias(object):
+    pass
+
 class Season(object):
     pass
 
 class Episode(object):
     pass
 
+class Artist(object):
+    pass
+
+class Album(object):
+    pass
+
+class Track(object):
+    pass
+
 mapper(Movie, movies)
 mapper(Photo, photos)
 mapper(Show, shows)
+mapper(ShowAlias, show_aliases)
 mapper(Season, seasons, properties = {
     'show': relation(Show, uselist=False, backref='seasons')
 })
 mapper(Episode, episodes, properties = {
     'season': relation(Season, uselist=False, backref='episodes')
 })
+mapper(Artist, artists)
+mapper(Album, albums, properties = {
+    'artist': relation(Artist, uselist=False, backref='albums')
+})
+mapper(Track, tracks, properties = {
+    'artist': relation(Artist, uselist=False, backref='tracks'),
+    'album': relation(Album, uselist=False, backref='tracks')
+})
@@ -0,0 +1,182 @@
+#
+# encore/backend/model/migrations.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+"""
+Upgrades existing databases to the current schema. The schema version is
+stored in the SQLite user_version pragma, databases created before it was
+introduced are version 0.
+
+To change the schema, update tables.py and append a migration to
+MIGRATIONS that brings a database from the previous version up to date.
+Each migration is run in a transaction together with the version change.
+"""
+
+import logging
+
+from encore.backend.model.tables import *
+from encore.utils.text import normalize_title, title_key
+
+log = logging.getLogger(__name__)
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').scalar()
+
+def set_schema_version(conn, version):
+    conn.execute('PRAGMA user_version = %d' % version)
+
+def add_column(conn, table, name):
+    """
+    Add a column defined in tables.py to an existing table.
+    """
+    existing = [row[1] for row in conn.execute(
+        'PRAGMA table_info(%s)' % table.name)]
+    if name in existing:
+        return
+
+    column = table.c[name]
+    conn.execute('ALTER TABLE %s ADD COLUMN %s %s' % (table.name,
+        column.name, column.type.compile(dialect=conn.dialect)))
+
+def create_indexes(conn, table, *names):
+    """
+    Create indexes defined in tables.py on an existing table.
+    """
+    existing = [row[0] for row in conn.execute('SELECT name FROM '
+        'sqlite_master WHERE type = ? AND tbl_name = ?', 'index', table.name)]
+    for index in table.indexes:
+        if index.name in names and index.name not in existing:
+            index.create(bind=conn)
+
+def remove_duplicate_paths(conn, table):
+    """
+    Remove rows with a duplicate path, keeping the oldest of each so a
+    unique index can be created on the path column.
+    """
+    conn.execute('DELETE FROM %(table)s WHERE path IS NOT NULL AND '
+        'id NOT IN (SELECT MIN(id) FROM %(table)s GROUP BY path)' % {
+            'table': table.name})
+
+def migrate_1(conn):
+    """
+    Add the path, title and episode lookup indexes.
+    """
+    add_column(conn, shows, 'normalized_title')
+    for (show_id, title) in conn.execute('SELECT id, title FROM shows'):
+        conn.execute(shows.update().where(shows.c.id == show_id).values(
+            normalized_title=normalize_title(title)))
+
+    for table in (movies, photos, episodes):
+        remove_duplicate_paths(conn, table)
+
+    create_indexes(conn, movies, 'ix_movies_path')
+    create_indexes(conn, photos, 'ix_photos_path')
+    create_indexes(conn, shows, 'ix_shows_series_id',
+        'ix_shows_normalized_title')
+    create_indexes(conn, episodes, 'ix_episodes_path', 'ix_episodes_episode')
+
+def migrate_2(conn):
+    """
+    Add the fingerprint columns used to recognise moved files.
+    """
+    for table in (movies, photos, episodes):
+        add_column(conn, table, 'fingerprint')
+        create_indexes(conn, table, 'ix_%s_fingerprint' % table.name)
+
+def migrate_3(conn):
+    """
+    Add the show aliases table, with the titles of the existing shows.
+    """
+    show_aliases.create(bind=conn, checkfirst=True)
+    aliases = {}
+    for (series_id, title) in conn.execute(
+            'SELECT series_id, title FROM shows WHERE series_id IS NOT NULL'):
+        if title_key(title):
+            aliases[title_key(title)] = series_id
+    for title, series_id in aliases.iteritems():
+        conn.execute(show_aliases.insert().values(title=title,
+            series_id=series_id, override=False))
+
+def migrate_4(conn):
+    """
+    Add the music tables.
+    """
+    for table in (artists, albums, tracks):
+        table.create(bind=conn, checkfirst=True)
+
+def migrate_5(conn):
+    """
+    Add the dimensions of photos.
+    """
+    add_column(conn, photos, 'width')
+    add_column(conn, photos, 'height')
+
+def migrate_6(conn):
+    """
+    Add the EXIF metadata of photos, indexed by the date they were taken.
+    """
+    for name in ('taken', 'camera_make', 'camera_model', 'orientation',
+            'latitude', 'longitude'):
+        add_column(conn, photos, name)
+    create_indexes(conn, photos, 'ix_photos_taken')
+
+def migrate_7(conn):
+    """
+    Add the perceptual hashes of photos.
+    """
+    add_column(conn, photos, 'phash')
+    create_indexes(conn, photos, 'ix_photos_phash')
+
+MIGRATIONS = [
+    migrate_1,
+    migrate_2,
+    migrate_3,
+    migrate_4,
+    migrate_5,
+    migrate_6,
+    migrate_7
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate(engine):
+    """
+    Run any migrations required to bring the database up to date.
+
+    :param engine: The engine for the database
+    :type engine: sqlalchemy.engine.Engine
+    """
+    conn = engine.connect()
+    try:
+        version = get_schema_version(conn)
+        for number, migration in enumerate(MIGRATIONS[version:],
+                version + 1):
+            log.info('Migrating database to version %d', number)
+            trans = conn.begin()
+            try:
+                migration(conn)
+                set_schema_version(conn, number)
+                trans.commit()
+            except:
+                trans.rollback()
+                raise
+    finally:
+        conn.close()
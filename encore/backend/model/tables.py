@@ -20,7 +20,7 @@
 #   Boston, MA    02110-1301, USA.
 #
 
-from sqlalchemy import MetaData, Table, Column, ForeignKey
+from sqlalchemy import MetaData, Table, Column, ForeignKey, Index
 from sqlalchemy import PrimaryKeyConstraint, ForeignKeyConstraint
 from sqlalchemy import Boolean, DateTime, Float, Integer, String, Text, Time
 
@@ -35,19 +35,37 @@ movies = Table('movies', meta,
     Column('rating', Float),
     Column('cover', String(100)),
     Column('backdrop', String(100)),
+    Column('fingerprint', String(32)),
     PrimaryKeyConstraint('id')
 )
+Index('ix_movies_path', movies.c.path, unique=True)
+Index('ix_movies_fingerprint', movies.c.fingerprint)
 
 photos = Table('photos', meta,
     Column('id', Integer),
     Column('path', String(200)),
+    Column('fingerprint', String(32)),
+    Column('width', Integer),
+    Column('height', Integer),
+    Column('taken', DateTime),
+    Column('camera_make', String(50)),
+    Column('camera_model', String(50)),
+    Column('orientation', Integer),
+    Column('latitude', Float),
+    Column('longitude', Float),
+    Column('phash', String(16)),
     PrimaryKeyConstraint('id')
 )
+Index('ix_photos_path', photos.c.path, unique=True)
+Index('ix_photos_fingerprint', photos.c.fingerprint)
+Index('ix_photos_taken', photos.c.taken)
+Index('ix_photos_phash', photos.c.phash)
 
 shows = Table('shows', meta,
     Column('id', Integer),
     Column('series_id', Integer),
     Column('title', String(100)),
+    Column('normalized_title', String(100)),
     Column('description', Text),
     Column('genre', String(100)),
     Column('rating', Float),
@@ -55,6 +73,18 @@ shows = Table('shows', meta,
     Column('backdrop', String(100)),
     PrimaryKeyConstraint('id')
 )
+Index('ix_shows_series_id', shows.c.series_id)
+Index('ix_shows_normalized_title', shows.c.normalized_title)
+
+# Maps the titles shows have been found by to their series, so each title
+# only has to be looked up once. Aliases the user has set are overrides and
+# are never replaced by ones that have been looked up.
+show_aliases = Table('show_aliases', meta,
+    Column('title', String(100)),
+    Column('series_id', Integer),
+    Column('override', Boolean, default=False),
+    PrimaryKeyConstraint('title')
+)
 
 seasons = Table('seasons', meta,
     Column('show_id', Integer),
@@ -78,9 +108,54 @@ episodes = Table('episodes', meta,
     Column('guest_stars', String(250)),
     Column('image', String(100)),
     Column('lastupdated', Integer),
+    Column('fingerprint', String(32)),
     PrimaryKeyConstraint('id'),
     ForeignKeyConstraint(
         ['show_id', 'season_number'],
         ['seasons.show_id', 'seasons.number']
     )
 )
+Index('ix_episodes_path', episodes.c.path, unique=True)
+Index('ix_episodes_episode', episodes.c.show_id, episodes.c.season_number,
+    episodes.c.episode)
+Index('ix_episodes_fingerprint', episodes.c.fingerprint)
+
+# Artists and albums are looked up by their normalized name, so that
+# differently spelt tags of the same one share a row.
+artists = Table('artists', meta,
+    Column('id', Integer),
+    Column('name', String(100)),
+    Column('normalized_name', String(100)),
+    PrimaryKeyConstraint('id')
+)
+Index('ix_artists_normalized_name', artists.c.normalized_name, unique=True)
+
+albums = Table('albums', meta,
+    Column('id', Integer),
+    Column('artist_id', Integer),
+    Column('title', String(100)),
+    Column('normalized_title', String(100)),
+    Column('year', Integer),
+    PrimaryKeyConstraint('id'),
+    ForeignKeyConstraint(['artist_id'], ['artists.id'])
+)
+Index('ix_albums_title', albums.c.artist_id, albums.c.normalized_title,
+    unique=True)
+
+tracks = Table('tracks', meta,
+    Column('id', Integer),
+    Column('artist_id', Integer),
+    Column('album_id', Integer),
+    Column('path', String(200)),
+    Column('title', String(100)),
+    Column('track_number', Integer),
+    Column('disc_number', Integer),
+    Column('genre', String(100)),
+    Column('fingerprint', String(32)),
+    PrimaryKeyConstraint('id'),
+    ForeignKeyConstraint(['artist_id'], ['artists.id']),
+    ForeignKeyConstraint(['album_id'], ['albums.id'])
+)
+Index('ix_tracks_path', tracks.c.path, unique=True)
+Index('ix_tracks_album_id', tracks.c.album_id)
+Index('ix_tracks_fingerprint', tracks.c.fingerprint)
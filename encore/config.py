@@ -49,6 +49,8 @@ class Config(Component):
 
         self.LOG_FILE = os.path.join(self.cache_dir, 'encore.log')
         self.DB_FILE = os.path.join(self.cache_dir, 'media.db')
+        self.MANIFEST_FILE = os.path.join(self.cache_dir, 'media.manifest')
+        self.TVDB_SYNC_FILE = os.path.join(self.cache_dir, 'tvdb.sync')
 
         self.THUMB_DIR = os.path.join(self.cache_dir, 'thumbnails')
         self.IMAGE_THUMB_DIR = os.path.join(self.THUMB_DIR, 'image')
@@ -71,12 +73,49 @@ class Config(Component):
         :returns: list of the directories
         :rtype: list
         """
+        return self._get_directories('video_dirs', 'XDG_VIDEOS_DIR')
 
-        if 'video_dirs' in self._config:
-            return self._config['video_dirs']
+    def get_music_directories(self):
+        """
+        Returns all the directories configured to scan for music.
+
+        :returns: list of the directories
+        :rtype: list
+        """
+        return self._get_directories('music_dirs', 'XDG_MUSIC_DIR')
+
+    def get_photo_directories(self):
+        """
+        Returns all the directories configured to scan for photos.
+
+        :returns: list of the directories
+        :rtype: list
+        """
+        return self._get_directories('photo_dirs', 'XDG_PICTURES_DIR')
+
+    def get_media_directories(self):
+        """
+        Returns all the directories configured to scan for any type of
+        media, without duplicates.
+
+        :returns: list of the directories
+        :rtype: list
+        """
+        directories = []
+        for directory in (self.get_video_directories() +
+                self.get_music_directories() + self.get_photo_directories()):
+            if directory not in directories:
+                directories.append(directory)
+        return directories
+
+    def _get_directories(self, key, xdg_name):
+        """
+        Returns the directories stored under key in the configuration,
+        falling back to the XDG user directory xdg_name.
+        """
 
-        # TODO: Move this code into a common function to make it easier
-        # to load up other directories.
+        if key in self._config:
+            return self._config[key]
 
         # Check for the ~/.config/user-dirs.dirs file
         user_dirs = BaseDirectory.load_first_config('user-dirs.dirs')
@@ -92,14 +131,14 @@ class Config(Component):
         if not BaseDirectory.load_first_config('user-dirs.dirs'):
             return []
 
-        # Load the user-dirs.dirs config file to get the configured videos
+        # Load the user-dirs.dirs config file to get the configured
         # directory.
         for line in open(BaseDirectory.load_first_config('user-dirs.dirs')):
             line = line.strip()
-            if line.startswith('#'):
+            if not line or line.startswith('#'):
                 continue
             (name, value) = line.split('=', 1)
-            if name == 'XDG_VIDEOS_DIR':
+            if name == xdg_name:
                 return [os.path.expandvars(value[1:-1])]
 
         return []
@@ -0,0 +1,358 @@
+#
+# encore/lib/cache.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+"""
+A persistent cache for responses from web services, stored compressed in
+a single SQLite database. Each entry has a kind which decides how long it
+stays fresh; stale entries are still returned so the caller can use them
+while fetching a replacement.
+"""
+
+import os
+import time
+import zlib
+import sqlite3
+import logging
+import contextlib
+
+from twisted.internet import defer
+from twisted.internet.error import TCPTimedOutError, TimeoutError
+from twisted.python import failure
+
+log = logging.getLogger(__name__)
+
+# The default number of seconds entries of each kind stay fresh for
+DAY = 24 * 60 * 60
+DEFAULT_TTLS = {
+    'languages': 30 * DAY,
+    'mirrors':   7 * DAY,
+    'search':    DAY,
+    'series':    DAY,
+    'episode':   7 * DAY,
+    'banners':   7 * DAY,
+    'record':    DAY,
+    'movie':     7 * DAY,
+}
+DEFAULT_TTL = DAY
+
+# Errors after which a request is tried again
+RETRY_ERRORS = (TCPTimedOutError, TimeoutError, defer.TimeoutError)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    fetched REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_responses_accessed ON responses (accessed);
+"""
+
+class ResponseCache(object):
+    """
+    Caches responses by key, usually the url they were fetched from.
+    When the compressed responses grow past max_size the least recently
+    used are evicted.
+
+    :param filename: The file to store the cache in
+    :type filename: str
+    :param max_size: The maximum size of the cached responses, in bytes
+    :type max_size: int
+    :param ttls: The number of seconds each kind of entry stays fresh for
+    :type ttls: dict
+    """
+
+    def __init__(self, filename, max_size=64 * 1024 * 1024, ttls=None):
+        self.filename = filename
+        self.max_size = max_size
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.clock = time.time
+        self._in_transaction = False
+
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        self._conn = sqlite3.connect(filename, isolation_level=None)
+        self._conn.text_factory = str
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        self._conn.executescript(SCHEMA)
+        self.size = self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+    def get(self, key):
+        """
+        Look up a cached response.
+
+        :param key: The key the response was cached under
+        :type key: str
+        :returns: A (data, fresh) tuple, or None if nothing is cached
+        :rtype: tuple
+        """
+        row = self._conn.execute('SELECT kind, data, fetched FROM responses '
+            'WHERE key = ?', (key,)).fetchone()
+        if not row:
+            return None
+
+        kind, data, fetched = row
+        now = self.clock()
+        self._conn.execute('UPDATE responses SET accessed = ? WHERE key = ?',
+            (now, key))
+        fresh = now - fetched < self.ttls.get(kind, DEFAULT_TTL)
+        return zlib.decompress(data), fresh
+
+    def set(self, key, data, kind):
+        """
+        Cache a response, replacing any existing one.
+
+        :param key: The key to cache the response under
+        :type key: str
+        :param data: The response
+        :type data: str
+        :param kind: The kind of response, used to look up its ttl
+        :type kind: str
+        """
+        data = zlib.compress(data)
+        now = self.clock()
+        self.invalidate(key)
+        self._conn.execute('INSERT INTO responses (key, kind, data, size, '
+            'fetched, accessed) VALUES (?, ?, ?, ?, ?, ?)', (key, kind,
+            sqlite3.Binary(data), len(data), now, now))
+        self.size += len(data)
+
+        if self.size > self.max_size:
+            self._evict()
+
+    def invalidate(self, key):
+        """
+        Remove a cached response.
+
+        :param key: The key the response was cached under
+        :type key: str
+        """
+        row = self._conn.execute('SELECT size FROM responses WHERE key = ?',
+            (key,)).fetchone()
+        if row:
+            self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self.size -= row[0]
+
+    def invalidate_prefix(self, prefix):
+        """
+        Remove all the cached responses with keys starting with prefix.
+
+        :param prefix: The start of the keys to remove
+        :type prefix: str
+        """
+        bounds = (prefix, prefix + '\xff')
+        size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM '
+            'responses WHERE key >= ? AND key < ?', bounds).fetchone()[0]
+        self._conn.execute('DELETE FROM responses WHERE key >= ? AND '
+            'key < ?', bounds)
+        self.size -= size
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Make the changes within a with block in a single transaction,
+        rather than committing each of them. Transactions within one are
+        part of it.
+        """
+        if self._in_transaction:
+            yield
+            return
+
+        self._conn.execute('BEGIN')
+        self._in_transaction = True
+        try:
+            yield
+            self._conn.execute('COMMIT')
+        except:
+            self._conn.execute('ROLLBACK')
+            self.size = self._conn.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            raise
+        finally:
+            self._in_transaction = False
+
+    def clear(self):
+        """
+        Remove all the cached responses.
+        """
+        self._conn.execute('DELETE FROM responses')
+        self.size = 0
+
+    def __contains__(self, key):
+        return self._conn.execute('SELECT 1 FROM responses WHERE key = ?',
+            (key,)).fetchone() is not None
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM responses'
+            ).fetchone()[0]
+
+    def _evict(self):
+        # Evict down to 90% of the maximum so that every new entry doesn't
+        # cause another eviction.
+        target = self.max_size * 0.9
+        with self.transaction():
+            rows = self._conn.execute('SELECT key, size FROM responses '
+                'ORDER BY accessed')
+            for key, size in rows.fetchall():
+                if self.size <= target:
+                    break
+                self._conn.execute('DELETE FROM responses WHERE key = ?',
+                    (key,))
+                self.size -= size
+        log.debug('Evicted cached responses, %d bytes remaining', self.size)
+
+class CachedClient(object):
+    """
+    Fetches urls through a ResponseCache. Cached responses are returned
+    straight away, stale ones are fetched again in the background, and
+    callers asking for a url that is already being fetched share that
+    fetch rather than starting another.
+
+    :param http: The client to fetch urls with
+    :type http: encore.lib.http.HTTPClient
+    :param cache: The cache to store responses in
+    :type cache: ResponseCache
+    :param retry_limit: The number of times to retry a timed out request
+    :type retry_limit: int
+    """
+
+    def __init__(self, http, cache, retry_limit=3):
+        self.http = http
+        self.cache = cache
+        self.retry_limit = retry_limit
+
+        # Functions called with each response of a kind that is fetched,
+        # before it is cached.
+        self.processors = {}
+
+        # Fetches that are in progress, keyed by url, with the Deferreds
+        # of the other callers waiting on them.
+        self._in_flight = {}
+        self.stats = {
+            'hits': 0,
+            'stale': 0,
+            'misses': 0,
+            'coalesced': 0,
+        }
+
+    def get(self, url, kind):
+        """
+        Get the response for a url, from the cache if possible.
+
+        :param url: The url to fetch
+        :type url: str
+        :param kind: The kind of response, used to look up its ttl
+        :type kind: str
+        :returns: A Deferred that fires with the response
+        :rtype: twisted.internet.defer.Deferred
+        """
+        cached = self.cache.get(url)
+        if cached:
+            response, fresh = cached
+            if fresh:
+                self.stats['hits'] += 1
+            else:
+                self.stats['stale'] += 1
+                self._refresh(url, kind)
+            return defer.succeed(response)
+
+        self.stats['misses'] += 1
+        return self.fetch(url, kind)
+
+    def fetch(self, url, kind):
+        """
+        Fetch a url without looking in the cache, sharing the fetch with
+        any other callers that ask for the same url before it completes.
+        Responses without a kind aren't cached.
+
+        :param url: The url to fetch
+        :type url: str
+        :param kind: The kind of response, used to look up its ttl
+        :type kind: str
+        :returns: A Deferred that fires with the response
+        :rtype: twisted.internet.defer.Deferred
+        """
+        if url in self._in_flight:
+            self.stats['coalesced'] += 1
+            d = defer.Deferred()
+            self._in_flight[url].append(d)
+            return d
+
+        waiters = self._in_flight[url] = []
+
+        def on_fetched(result):
+            del self._in_flight[url]
+            for d in waiters:
+                if isinstance(result, failure.Failure):
+                    d.errback(result)
+                else:
+                    d.callback(result)
+            return result
+
+        return self._fetch(url, kind).addBoth(on_fetched)
+
+    def _fetch(self, url, kind, count=0):
+        log.debug("requesting '%s', count is %d", url, count)
+        return self.http.get(url).addCallbacks(
+            self._on_response,
+            self._on_error,
+            callbackArgs=(url, kind),
+            errbackArgs=(url, kind, count)
+        )
+
+    def _on_response(self, response, url, kind):
+        if kind is None:
+            return response
+
+        try:
+            if kind in self.processors:
+                self.processors[kind](response)
+            self.cache.set(url, response, kind)
+        except Exception as e:
+            log.exception(e)
+        return response
+
+    def _on_error(self, failure, url, kind, count):
+        if failure.check(*RETRY_ERRORS) and count < self.retry_limit:
+            return self._fetch(url, kind, count + 1)
+        return failure
+
+    def _refresh(self, url, kind):
+        """
+        Fetch a stale response again in the background.
+        """
+        def on_error(failure):
+            log.warning("unable to refresh '%s': %s", url,
+                failure.getErrorMessage())
+
+        self.fetch(url, kind).addErrback(on_error)
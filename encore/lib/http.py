@@ -0,0 +1,132 @@
+#
+# encore/lib/http.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+"""
+A HTTP client shared by the web service APIs. Connections are kept alive
+and reused from a pool, gzipped responses are decoded transparently and
+the number of requests made to each host at once is limited.
+"""
+
+import os
+import logging
+from urlparse import urlparse
+
+from twisted.internet import defer, reactor
+from twisted.web import error
+from twisted.web.client import Agent, ContentDecoderAgent, GzipDecoder
+from twisted.web.client import HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+
+log = logging.getLogger(__name__)
+
+USER_AGENT = 'Encore'
+
+class HTTPClient(object):
+    """
+    Makes HTTP requests using a pool of persistent connections.
+
+    :param max_per_host: The maximum number of requests made to a host at
+        once, which is also the number of idle connections kept to it
+    :type max_per_host: int
+    :param timeout: The number of seconds to wait for a response
+    :type timeout: int
+    :param idle_timeout: The number of seconds idle connections are kept
+    :type idle_timeout: int
+    """
+
+    def __init__(self, max_per_host=4, timeout=30, idle_timeout=60,
+            clock=reactor):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.clock = clock
+
+        self.pool = HTTPConnectionPool(clock, persistent=True)
+        self.pool.maxPersistentPerHost = max_per_host
+        self.pool.cachedConnectionTimeout = idle_timeout
+        self.agent = ContentDecoderAgent(Agent(clock, connectTimeout=timeout,
+            pool=self.pool), [('gzip', GzipDecoder)])
+        self._semaphores = {}
+
+    def close(self):
+        """
+        Close the idle connections in the pool.
+
+        :returns: A Deferred that fires once the connections are closed
+        :rtype: twisted.internet.defer.Deferred
+        """
+        return self.pool.closeCachedConnections()
+
+    def get(self, url):
+        """
+        Fetch a url. Responses other than 200 OK fail with a
+        twisted.web.error.Error, as with twisted.web.client.getPage.
+
+        :param url: The url to fetch
+        :type url: str
+        :returns: A Deferred that fires with the body of the response
+        :rtype: twisted.internet.defer.Deferred
+        """
+        host = urlparse(url).netloc
+        semaphore = self._semaphores.get(host)
+        if not semaphore:
+            semaphore = self._semaphores[host] = defer.DeferredSemaphore(
+                self.max_per_host)
+        return semaphore.run(self._get, url)
+
+    def _get(self, url):
+        headers = Headers({'User-Agent': [USER_AGENT]})
+        d = self.agent.request('GET', url, headers)
+        d.addCallback(self._on_response, url)
+        d.addTimeout(self.timeout, self.clock)
+        return d
+
+    def _on_response(self, response, url):
+        if response.code != 200:
+            # Read the body anyway so the connection can be reused
+            d = readBody(response)
+            d.addBoth(self._on_error_body, response, url)
+            return d
+        return readBody(response)
+
+    def _on_error_body(self, body, response, url):
+        log.debug("'%s' returned %d %s", url, response.code,
+            response.phrase)
+        raise error.Error(response.code, response.phrase)
+
+    def download(self, url, destination):
+        """
+        Fetch a url and save the body of the response to a file.
+
+        :param url: The url to fetch
+        :type url: str
+        :param destination: The path to save the response to
+        :type destination: str
+        :returns: A Deferred that fires once the file has been written
+        :rtype: twisted.internet.defer.Deferred
+        """
+        return self.get(url).addCallback(self._write_file, destination)
+
+    def _write_file(self, body, destination):
+        tmp_path = destination + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(body)
+        os.rename(tmp_path, destination)
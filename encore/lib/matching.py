@@ -0,0 +1,186 @@
+#
+# encore/lib/matching.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+"""
+Ranks the results of a movie or series search against the title that was
+searched for. Names are compared by the words they share and by the
+trigrams they share, which allows for misspellings, and a year found in
+both the title and the result has to agree.
+"""
+
+import re
+
+from encore.utils.lru import LRUCache
+from encore.utils.text import normalize_title
+
+YEAR_RE = re.compile(r'^(19|20)\d\d$')
+
+# How much of a name's score comes from the words it shares with the
+# title, the rest comes from the trigrams.
+TOKEN_WEIGHT = 0.5
+
+# What a score is multiplied by when the years of the title and a name are
+# the same, a year apart, or further apart.
+YEAR_FACTORS = (1.0, 0.9, 0.6)
+
+# What a score is multiplied by when the title has a year but the name
+# doesn't.
+MISSING_YEAR_FACTOR = 0.95
+
+def split_year(title):
+    """
+    Split a title into its words and the year at the end of it, if it has
+    one. A leading 'the' is dropped.
+
+    :param title: The title to split
+    :type title: unicode
+    :returns: A tuple of (words, year), year is None if there isn't one
+    :rtype: tuple
+    """
+    words = normalize_title(title).split()
+    year = None
+    if len(words) > 1 and YEAR_RE.match(words[-1]):
+        year = int(words.pop())
+    if len(words) > 1 and words[0] == 'the':
+        words.pop(0)
+    return (words, year)
+
+def trigrams(words):
+    """
+    Return the set of trigrams in a list of words, including the ones
+    that span the space between them.
+
+    :param words: The words
+    :type words: list
+    :rtype: set
+    """
+    text = '  %s ' % ' '.join(words)
+    return set([text[i:i + 3] for i in xrange(len(text) - 2)])
+
+def dice(shared, a, b):
+    """
+    The Dice coefficient of two sets of size a and b sharing shared items.
+    """
+    if not a and not b:
+        return 1.0
+    return 2.0 * shared / (a + b)
+
+def parse_year(date):
+    """
+    Return the year from a date such as '1999-09-16', or None.
+    """
+    if date and YEAR_RE.match(date[:4]):
+        return int(date[:4])
+    return None
+
+class Matcher(object):
+    """
+    Picks the best match for a title from a list of names. Decisions are
+    remembered, so asking again with the same title and names doesn't
+    score them again.
+
+    :param threshold: The lowest score a name can have to be a match
+    :type threshold: float
+    :param cache_size: The number of decisions to remember
+    :type cache_size: int
+    """
+
+    def __init__(self, threshold=0.5, cache_size=1024):
+        self.threshold = threshold
+        self.decisions = LRUCache(cache_size)
+
+    def rank(self, title, names, years=None):
+        """
+        Score each name against the title.
+
+        :param title: The title that was searched for
+        :type title: unicode
+        :param names: The names of the search results
+        :type names: list
+        :param years: The year of each search result, or None for those
+            with no year. A year at the end of a name is used if there
+            isn't one.
+        :type years: list
+        :returns: A list of (score, index) tuples, best first. Scores are
+            between 0 and 1.
+        :rtype: list
+        """
+        words, year = split_year(title)
+        tokens = set(words)
+        grams = trigrams(words)
+
+        # Build an index of the trigrams in every name, and count the ones
+        # shared with the title in a single pass over it.
+        candidates = []
+        index = {}
+        for i, name in enumerate(names):
+            name_words, name_year = split_year(name or '')
+            if years and years[i]:
+                name_year = years[i]
+            name_grams = trigrams(name_words)
+            candidates.append((set(name_words), name_year, len(name_grams)))
+            for gram in name_grams:
+                index.setdefault(gram, []).append(i)
+
+        shared = [0] * len(candidates)
+        for gram in grams:
+            for i in index.get(gram, ()):
+                shared[i] += 1
+
+        ranked = []
+        for i, (name_tokens, name_year, gram_count) in enumerate(candidates):
+            if name_tokens == tokens:
+                score = 1.0
+            else:
+                score = (TOKEN_WEIGHT * dice(len(tokens & name_tokens),
+                    len(tokens), len(name_tokens)) + (1 - TOKEN_WEIGHT) *
+                    dice(shared[i], len(grams), gram_count))
+
+            if year and name_year:
+                score *= YEAR_FACTORS[min(abs(year - name_year), 2)]
+            elif year:
+                score *= MISSING_YEAR_FACTOR
+            ranked.append((score, i))
+
+        ranked.sort(key=lambda item: (-item[0], item[1]))
+        return ranked
+
+    def match(self, title, names, years=None):
+        """
+        Find the name that best matches the title.
+
+        :returns: A tuple of (index, score), index is None if no name
+            scores above the threshold
+        :rtype: tuple
+        """
+        key = (title, tuple(names), years and tuple(years))
+        decision = self.decisions.get(key)
+        if decision is None:
+            ranked = self.rank(title, names, years)
+            if not ranked:
+                decision = (None, 0.0)
+            elif ranked[0][0] < self.threshold:
+                decision = (None, ranked[0][0])
+            else:
+                decision = (ranked[0][1], ranked[0][0])
+            self.decisions.set(key, decision)
+        return decision
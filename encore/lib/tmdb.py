@@ -25,6 +25,12 @@ import urllib
 
 import xml.etree.cElementTree as ElementTree
 
+from twisted.web import error
+
+from encore.lib.cache import CachedClient
+from encore.lib.http import HTTPClient
+from encore.lib.xmlstream import iterelements
+
 
 class TmdBaseError(Exception):
     pass
@@ -41,42 +47,42 @@ class TmdXmlError(TmdBaseError):
     pass
 
 
+# The fields AsyncMovieDb keeps from each movie, along with its images and
+# categories. Its cast, studios and countries are dropped.
+MOVIE_FIELDS = frozenset(['id', 'name', 'original_name', 'alternative_name',
+    'imdb_id', 'url', 'overview', 'rating', 'released', 'runtime',
+    'certification', 'language', 'type', 'popularity', 'score',
+    'last_modified_at'])
+
+# The size of the windows at the start and end of a file that are hashed
+HASH_CHUNK_SIZE = 65536
+HASH_CHUNK_FORMAT = '<%dq' % (HASH_CHUNK_SIZE / 8)
+
 def opensubtitleHashFile(name):
     """Hashes a file using OpenSubtitle's method.
 
     > In natural language it calculates: size + 64bit chksum of the first and
     > last 64k (even if they overlap because the file is smaller than 128k).
 
-    A slightly more Pythonic version of the Python solution on..
+    Each 64k window is read in one go and unpacked into 64bit integers in a
+    single call.
     http://trac.opensubtitles.org/projects/opensubtitles/wiki/HashSourceCodes
     """
-    longlongformat = 'q'
-    bytesize = struct.calcsize(longlongformat)
-
-    f = open(name, "rb")
-
     filesize = os.path.getsize(name)
-    fhash = filesize
-
-    if filesize < 65536 * 2:
-       raise ValueError("File size must be larger than %s bytes (is %s)" % (65536*2, filesize))
-
-    for x in range(65536/bytesize):
-        buf = f.read(bytesize)
-        (l_value,)= struct.unpack(longlongformat, buf)
-        fhash += l_value
-        fhash = fhash & 0xFFFFFFFFFFFFFFFF # to remain as 64bit number
+    if filesize < HASH_CHUNK_SIZE * 2:
+       raise ValueError("File size must be larger than %s bytes (is %s)" % (HASH_CHUNK_SIZE*2, filesize))
 
+    f = open(name, "rb")
+    try:
+        head = f.read(HASH_CHUNK_SIZE)
+        f.seek(filesize - HASH_CHUNK_SIZE, 0)
+        tail = f.read(HASH_CHUNK_SIZE)
+    finally:
+        f.close()
 
-    f.seek(max(0,filesize-65536),0)
-    for x in range(65536/bytesize):
-        buf = f.read(bytesize)
-        (l_value,)= struct.unpack(longlongformat, buf)
-        fhash += l_value
-        fhash = fhash & 0xFFFFFFFFFFFFFFFF
-
-    f.close()
-    return  "%016x" % fhash
+    fhash = filesize + sum(struct.unpack(HASH_CHUNK_FORMAT, head)) + \
+        sum(struct.unpack(HASH_CHUNK_FORMAT, tail))
+    return "%016x" % (fhash & 0xFFFFFFFFFFFFFFFF)
 
 
 class XmlHandler:
@@ -193,19 +199,63 @@ class Countries(dict):
         self.setdefault(code, {})[name] = url
 
 
+# The width in pixels of each size of image themoviedb.org has, by type.
+# The width of an original is unknown, so it is taken to be the largest.
+IMAGE_WIDTHS = {
+    'poster': {'thumb': 92, 'w154': 154, 'cover': 185, 'w342': 342,
+        'mid': 500, 'original': None},
+    'backdrop': {'thumb': 300, 'poster': 780, 'w1280': 1280,
+        'original': None},
+}
+
+
 class Image(dict):
     """Stores image information for a single poster/backdrop (includes
     multiple sizes)
     """
 
+    __slots__ = ()
+
     def __init__(self, _id, _type, size, url):
         self['id'] = _id
         self['type'] = _type
+        if size:
+            self[size] = url
+
+    def _width(self, size):
+        width = IMAGE_WIDTHS.get(self['type'], {}).get(size, 0)
+        if width is None:
+            return float('inf')
+        return width
+
+    def sizes(self):
+        """Returns the sizes of the image, smallest first
+        """
+        sizes = [k for k in self if k not in ('id', 'type')]
+        sizes.sort(key=self._width)
+        return sizes
 
     def largest(self):
-        for csize in ["original", "mid", "cover", "thumb"]:
-            if csize in self:
-                return csize
+        sizes = self.sizes()
+        if sizes:
+            return sizes[-1]
+
+    def best(self, width=None):
+        """Returns the url of the largest size no wider than width, or the
+        smallest size if they are all wider. The largest size is returned
+        if width is None.
+        """
+        sizes = self.sizes()
+        if not sizes:
+            return None
+        if width is None:
+            return self[sizes[-1]]
+
+        best = sizes[0]
+        for size in sizes:
+            if self._width(size) <= width:
+                best = size
+        return self[best]
 
     def __repr__(self):
         return "<Image (%s for ID %s)>" % (self['type'], self['id'])
@@ -213,8 +263,21 @@ class Image(dict):
 
 class ImagesList(list):
     """Stores a list of Images, and functions to filter "only posters" etc
+
+    The images are indexed by id and type as they are added with set().
     """
 
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self._by_id = {}
+        self._by_type = {}
+        for image in self:
+            self._index(image)
+
+    def _index(self, image):
+        self._by_id[image['id']] = image
+        self._by_type.setdefault(image['type'], []).append(image)
+
     def set(self, image_et):
         """Takes an elementtree Element ('image') and stores the url,
         along with the type, id and size.
@@ -233,22 +296,37 @@ class ImagesList(list):
         size = image_et.get("size")
         url = image_et.get("url")
 
-        cur = self.find_by('id', _id)
-        if len(cur) == 0:
+        cur = self._by_id.get(_id)
+        if cur is None:
             nimg = Image(_id = _id, _type = _type, size = size, url = url)
             self.append(nimg)
-        elif len(cur) == 1:
-            cur[0][size] = url
+            self._index(nimg)
         else:
-            raise ValueError("Found more than one poster with id %s, this should never happen" % (_id))
+            cur[size] = url
 
     def find_by(self, key, value):
+        if key == 'id':
+            cur = self._by_id.get(value)
+            return cur is not None and [cur] or []
+        if key == 'type':
+            return list(self._by_type.get(value, ()))
+
         ret = []
         for cur in self:
             if cur[key] == value:
                 ret.append(cur)
         return ret
 
+    def best(self, _type, width=None):
+        """Returns the url of the first image of a type in the size that
+        best fits width, see Image.best()
+        """
+        for image in self._by_type.get(_type, ()):
+            url = image.best(width)
+            if url:
+                return url
+        return None
+
     @property
     def posters(self):
         return self.find_by('type', 'poster')
@@ -356,31 +434,35 @@ class MovieDb:
         cur_movie['cast'] = cur_cast
         return cur_movie
 
+    def _searchResults(self, etree):
+        search_results = SearchResults()
+        for cur_result in etree.find("movies").findall("movie"):
+            cur_movie = self._parseSearchResults(cur_result)
+            search_results.append(cur_movie)
+        return search_results
+
+    def _movieInfo(self, etree, description):
+        moviesTree = etree.find("movies").findall("movie")
+
+        if len(moviesTree) == 0:
+            raise TmdNoResults("No results for %s" % description)
+
+        return self._parseMovie(moviesTree[0])
+
     def search(self, title):
         """Searches for a film by its title.
         Returns SearchResults (a list) containing all matches (Movie instances)
         """
         title = urllib.quote(title.encode("utf-8"))
         url = config['urls']['movie.search'] % (title)
-        etree = XmlHandler(url).getEt()
-        search_results = SearchResults()
-        for cur_result in etree.find("movies").findall("movie"):
-            cur_movie = self._parseSearchResults(cur_result)
-            search_results.append(cur_movie)
-        return search_results
+        return self._searchResults(XmlHandler(url).getEt())
 
     def getMovieInfo(self, id):
         """Returns movie info by it's TheMovieDb ID.
         Returns a Movie instance
         """
         url = config['urls']['movie.getInfo'] % (id)
-        etree = XmlHandler(url).getEt()
-        moviesTree = etree.find("movies").findall("movie")
-
-        if len(moviesTree) == 0:
-            raise TmdNoResults("No results for id %s" % id)
-
-        return self._parseMovie(moviesTree[0])
+        return self._movieInfo(XmlHandler(url).getEt(), "id %s" % id)
 
     def hashGetInfo(self, hash):
         """Returns movie info by it's OpenSubtitle-format hash.
@@ -389,13 +471,93 @@ class MovieDb:
         Example hash of "Underworld (2003).avi": 00277ff46533b155
         """
         url = config['urls']['hash.getInfo'] % (hash)
-        etree = XmlHandler(url).getEt()
-        moviesTree = etree.find("movies").findall("movie")
+        return self._movieInfo(XmlHandler(url).getEt(), "hash %s" % hash)
 
-        if len(moviesTree) == 0:
-            raise TmdNoResults("No results for hash %s" % hash)
 
-        return self._parseMovie(moviesTree[0])
+class AsyncMovieDb(MovieDb):
+    """Non-blocking interface to www.themoviedb.com
+
+    Works like MovieDb, except that each method returns a Deferred that
+    fires with the result. Responses are fetched with a pooled HTTP client
+    and kept in a ResponseCache; concurrent requests for the same url
+    share a single fetch.
+
+    Responses are parsed a movie at a time and only the fields in
+    MOVIE_FIELDS are kept, so cast lists aren't built.
+    """
+
+    def __init__(self, cache, http=None, retry_limit=3):
+        self.cache = cache
+        self.http = http or HTTPClient(max_per_host=4)
+        self.client = CachedClient(self.http, cache, retry_limit)
+
+    def _request(self, url, kind):
+        return self.client.get(url, kind).addErrback(self._onHttpError)
+
+    def _iterMovies(self, xml):
+        try:
+            for movie_element in iterelements(xml, ('movie',)):
+                yield movie_element
+        except SyntaxError, errormsg:
+            raise TmdXmlError(errormsg)
+
+    def _parseMovieFields(self, movie_element, cur_movie):
+        cur_images = ImagesList()
+        cur_categories = Categories()
+        for item in movie_element:
+            tag = item.tag.lower()
+            if tag == "images":
+                for subitem in item:
+                    cur_images.set(subitem)
+            elif tag == "categories":
+                for subitem in item:
+                    cur_categories.set(subitem)
+            elif tag in MOVIE_FIELDS:
+                cur_movie[item.tag] = item.text
+        cur_movie['images'] = cur_images
+        if isinstance(cur_movie, Movie):
+            cur_movie['categories'] = cur_categories
+        return cur_movie
+
+    def _searchResults(self, xml):
+        search_results = SearchResults()
+        for movie_element in self._iterMovies(xml):
+            search_results.append(self._parseMovieFields(movie_element,
+                MovieResult()))
+        return search_results
+
+    def _movieInfo(self, xml, description):
+        for movie_element in self._iterMovies(xml):
+            return self._parseMovieFields(movie_element, Movie())
+        raise TmdNoResults("No results for %s" % description)
+
+    def _onHttpError(self, failure):
+        failure.trap(error.Error)
+        raise TmdHttpError(failure.getErrorMessage())
+
+    def search(self, title):
+        """Searches for a film by its title.
+        Returns a Deferred that fires with SearchResults
+        """
+        title = urllib.quote(title.encode("utf-8"))
+        url = config['urls']['movie.search'] % (title)
+        return self._request(url, 'search').addCallback(self._searchResults)
+
+    def getMovieInfo(self, id):
+        """Returns a Deferred that fires with the movie info for its
+        TheMovieDb ID.
+        """
+        url = config['urls']['movie.getInfo'] % (id)
+        return self._request(url, 'movie').addCallback(self._movieInfo,
+            "id %s" % id)
+
+    def hashGetInfo(self, hash):
+        """Returns a Deferred that fires with the movie info for its
+        OpenSubtitle-format hash.
+        """
+        url = config['urls']['hash.getInfo'] % (hash)
+        return self._request(url, 'movie').addCallback(self._movieInfo,
+            "hash %s" % hash)
 
 
 def search(name):
@@ -21,20 +21,46 @@
 #
 
 import os
-import zlib
-import hashlib
+import time
 import logging
-import tempfile
-
-from twisted.web import client
-from twisted.internet import defer
-from twisted.internet.error import TCPTimedOutError
+import zipfile
+from collections import namedtuple
+from cStringIO import StringIO
 
 from xdg.BaseDirectory import xdg_cache_home
 from xml.etree import cElementTree
 
+from encore.lib.cache import CachedClient, ResponseCache, RETRY_ERRORS
+from encore.lib.http import HTTPClient
+from encore.lib.matching import Matcher, parse_year
+from encore.lib.xmlstream import iterelements, record
+
 TVDB_URL = 'http://www.thetvdb.com'
 
+# Once this many episodes of a series have been asked for, the rest are
+# fetched along with the full series record.
+BULK_THRESHOLD = 2
+
+# The updates feeds, and the number of seconds each covers
+UPDATE_PERIODS = (
+    ('day', 24 * 60 * 60),
+    ('week', 7 * 24 * 60 * 60),
+    ('month', 30 * 24 * 60 * 60),
+)
+
+# The fields kept from each kind of record, the rest are dropped while
+# the response is parsed.
+SERIES_FIELDS = frozenset(['id', 'seriesname', 'overview', 'genre',
+    'rating', 'poster', 'fanart', 'banner', 'firstaired', 'status',
+    'network', 'language', 'lastupdated'])
+EPISODE_FIELDS = frozenset(['id', 'seriesid', 'seasonnumber',
+    'episodenumber', 'episodename', 'overview', 'rating', 'writer',
+    'director', 'gueststars', 'filename', 'firstaired', 'language',
+    'lastupdated'])
+BANNER_FIELDS = frozenset(['id', 'bannerpath', 'bannertype', 'bannertype2',
+    'season', 'language', 'rating'])
+SEARCH_FIELDS = frozenset(['id', 'seriesname', 'firstaired'])
+
 log = logging.getLogger(__name__)
 
 class TvDbError(Exception):
@@ -46,6 +72,11 @@ class SeriesNotFoundError(TvDbError):
 class EpisodeNotFoundError(TvDbError):
     pass
 
+# The changes listed by an updates feed. series maps the id of each series
+# that changed to the time it changed, episodes maps the id of each series
+# with changed episodes to the time of the latest of them.
+Updates = namedtuple('Updates', 'time series episodes')
+
 class TvDbResponse(object):
 
     def __init__(self, tvdb, data=None):
@@ -108,83 +139,59 @@ class Banner(TvDbResponse):
 
     def download(self, destination, count=0):
         url = '%s/banners/%s' % (TVDB_URL, self.bannerpath)
-        return client.downloadPage(url, destination).addErrback(
+        return self._tvdb.http.download(url, destination).addErrback(
             self._on_download_err, destination, count)
 
     def _on_download_err(self, failure, destination, count):
-        if failure.type is TCPTimedOutError and count < self._retry_limit:
+        if failure.check(*RETRY_ERRORS) and count < self._retry_limit:
             return self.download(destination, count + 1)
         return failure
 
 
 class TvDb(object):
 
-    def __init__(self, api_key, language='en', retry_limit=3):
+    def __init__(self, api_key, language='en', retry_limit=3, cache=None,
+            http=None, matcher=None):
         self.api_key = api_key
         self.language = language
         self.retry_limit = retry_limit
         self.mirror = TVDB_URL
 
-        self.cache_dir = os.path.join(xdg_cache_home, 'encore', 'tvdb')
-        if not os.path.isdir(self.cache_dir):
-            os.makedirs(self.cache_dir)
+        if cache is None:
+            cache = ResponseCache(os.path.join(xdg_cache_home, 'encore',
+                'tvdb.cache'))
+        self.cache = cache
+        self.http = http or HTTPClient(max_per_host=4)
+        self.client = CachedClient(self.http, cache, retry_limit)
+        self.client.processors['record'] = self._cache_record
+        self.matcher = matcher or Matcher()
+
+        # The number of episodes asked for of each series
+        self._episode_counts = {}
 
     @property
     def api_url(self):
         return '%s/api/%s/' % (self.mirror, self.api_key)
 
-    def _on_api_error(self, failure, url, count):
-        if failure.type is TCPTimedOutError and count < self.retry_limit:
-            return self._request(url, count + 1)
-        return failure
-
-    def _on_api_response(self, response, url, count):
-        # FIXME: Write a new Twisted HTTP downloader that supports gzip
-        # decompression. This is hacky and waste of resources.
-        try:
-            decompress = zlib.decompressobj(zlib.MAX_WBITS + 32)
-            response = zlib.decompress(response)
-        except zlib.error:
-            pass
-
-        url_hash = hashlib.sha1(url).hexdigest()
-        cache_path = os.path.join(self.cache_dir, url_hash) + '.xml'
-        try:
-            open(cache_path, 'w').write(response)
-        except IOError as e:
-            log.exception(e)
-        return response
-
-    def _request(self, path, count=0, key=True):
-        log.debug("using mirror '%s' with key '%s'", self.mirror, self.api_key)
-        log.debug("requesting '%s', count is %d", path, count)
+    @property
+    def stats(self):
+        return self.client.stats
 
+    def _url(self, path, key=True):
         if key:
-            url = '%s/api/%s/%s' % (self.mirror, self.api_key, path)
+            return '%s/api/%s/%s' % (self.mirror, self.api_key, path)
         else:
-            url = '%s/api/%s' % (self.mirror, path)
-
-        # Attempt to get the information from the cache
-        url_hash = hashlib.sha1(url).hexdigest()
-        cache_path = os.path.join(self.cache_dir, url_hash) + '.xml'
-
-        if os.path.isfile(cache_path):
-            d = defer.Deferred()
-            d.callback(open(cache_path).read())
-            return d
+            return '%s/api/%s' % (self.mirror, path)
 
-        return client.getPage(url).addCallbacks(
-            self._on_api_response,
-            self._on_api_error,
-            callbackArgs=(url, count),
-            errbackArgs=(url, count)
-        )
+    def _request(self, path, kind, key=True):
+        log.debug("using mirror '%s' with key '%s'", self.mirror, self.api_key)
+        return self.client.get(self._url(path, key), kind)
 
     def get_languages(self):
         """
         Return the supported languages by the tvdb
         """
-        return self._request('languages.xml').addCallback(
+        return self._request('languages.xml', 'languages').addCallback(
             self._on_got_languages)
 
     def _on_got_languages(self, langs):
@@ -203,10 +210,8 @@ class TvDb(object):
         thetvdb.org.
         """
 
-        self._request('mirrors.xml').addCallbacks(
-            self._on_got_mirrors,
-            self._on_api_error
-        )
+        self._request('mirrors.xml', 'mirrors').addCallback(
+            self._on_got_mirrors)
 
     def _on_got_mirrors(self, result):
         pass
@@ -219,27 +224,29 @@ class TvDb(object):
         :type series: str
         """
         url = 'GetSeries.php?seriesname=' + series.replace(' ', '+')
-        return self._request(url, key=False).addCallback(
+        return self._request(url, 'search', key=False).addCallback(
             self._on_got_series, series)
 
     def _on_got_series(self, results, series_name):
-        etree = cElementTree.fromstring(results)
+        results = [record(elm, SEARCH_FIELDS) for elm in
+            iterelements(results, ('Series',))]
 
         # Check to see if any series were found
-        if not etree:
+        if not results:
             raise SeriesNotFoundError("Cannot find '%s'", series_name)
 
-        # Get the first match
-        series = None
-        for elm in etree:
-            series = dict([(k.tag.lower(), k.text) for k in elm])
-            break
+        # Pick the result that best matches the name
+        index, score = self.matcher.match(series_name,
+            [series.get('seriesname') for series in results],
+            [parse_year(series.get('firstaired')) for series in results])
 
         # Ensure that there has been a match
-        if not series:
+        if index is None:
             raise SeriesNotFoundError("Cannot find '%s'", series_name)
 
-        return self.get_series_by_id(series['id'])
+        log.debug('Matched %s to %s (%.2f)', series_name,
+            results[index].get('seriesname'), score)
+        return self.get_series_by_id(results[index]['id'])
 
     def get_series_by_id(self, series_id):
         """
@@ -250,18 +257,15 @@ class TvDb(object):
         """
 
         url = 'series/%s/%s.xml' % (series_id, self.language)
-        return self._request(url).addCallback(
+        return self._request(url, 'series').addCallback(
             self._on_got_series_details)
 
     def _on_got_series_details(self, results):
-        etree = cElementTree.fromstring(results)
+        for elm in iterelements(results, ('Series',)):
+            return Series(self, record(elm, SERIES_FIELDS))
 
-        # Check to see if any series were found
-        if not etree:
-            raise SeriesNotFoundError
-
-        data = dict([(k.tag.lower(), k.text) for k in etree.find('Series')])
-        return Series(self, data)
+        # No series was found
+        raise SeriesNotFoundError
 
     def get_banners(self, series_id):
         """
@@ -272,20 +276,82 @@ class TvDb(object):
         """
 
         url = 'series/%s/banners.xml' % series_id
-        return self._request(url).addCallback(
+        return self._request(url, 'banners').addCallback(
             self._on_got_banners)
 
     def _on_got_banners(self, response):
-        etree = cElementTree.fromstring(response)
-
         banners = []
-        for elm in etree:
-            data = dict([(k.tag.lower(), k.text) for k in elm])
+        for elm in iterelements(response, ('Banner',)):
+            data = record(elm, BANNER_FIELDS)
             if 'season' in data:
                 data['season'] = int(data['season'])
             banners.append(Banner(self, data))
         return banners
 
+    def get_series_record(self, series_id):
+        """
+        Get the full record of a series, which contains the series, all
+        of its episodes and its banners. Once it has been fetched, the
+        series, episodes and banners are all in the cache.
+
+        :param series_id: The id of the series to fetch
+        :type series_id: int
+        """
+        url = 'series/%s/all/%s.zip' % (series_id, self.language)
+        return self._request(url, 'record').addCallback(
+            self._on_got_series_record)
+
+    def _read_record(self, record):
+        archive = zipfile.ZipFile(StringIO(record))
+        try:
+            data = archive.read('%s.xml' % self.language)
+            try:
+                banners = archive.read('banners.xml')
+            except KeyError:
+                banners = None
+        finally:
+            archive.close()
+        return data, banners
+
+    def _on_got_series_record(self, response):
+        data, banners = self._read_record(response)
+        return self._on_got_series_details(data)
+
+    def _cache_record(self, response):
+        """
+        Split a full series record into the responses that would have been
+        fetched for each part of it and cache them.
+        """
+        data, banners = self._read_record(response)
+        series_id = None
+
+        def cache(path, kind, elm):
+            root = cElementTree.Element('Data')
+            root.append(elm)
+            self.cache.set(self._url(path), cElementTree.tostring(root), kind)
+
+        # The parts are cached in a single transaction rather than
+        # committing each of them. The series comes before its episodes.
+        with self.cache.transaction():
+            for elm in iterelements(data, ('Series', 'Episode')):
+                if elm.tag == 'Series':
+                    series_id = elm.findtext('id')
+                    cache('series/%s/%s.xml' % (series_id, self.language),
+                        'series', elm)
+                    continue
+
+                try:
+                    season = int(elm.findtext('SeasonNumber'))
+                    episode = int(elm.findtext('EpisodeNumber'))
+                except (TypeError, ValueError):
+                    continue
+                cache('series/%s/default/%d/%d/%s.xml' % (series_id, season,
+                    episode, self.language), 'episode', elm)
+
+            if banners:
+                self.cache.set(self._url('series/%s/banners.xml' %
+                    series_id), banners, 'banners')
+
     def get_episode(self, series_id, season, episode):
         """
         Get the data for the specified episode.
@@ -299,15 +365,92 @@ class TvDb(object):
         """
         url = 'series/%s/default/%s/%s/%s.xml' % (
             series_id, season, episode, self.language)
-        return self._request(url).addCallback(
-            self._on_got_episode)
+
+        # Once a few episodes of a series have been asked for, fetch the
+        # rest in one go rather than an episode at a time.
+        count = self._episode_counts.get(str(series_id), 0) + 1
+        self._episode_counts[str(series_id)] = count
+        if count > BULK_THRESHOLD and self._url(url) not in self.cache:
+            d = self.get_series_record(series_id)
+            d.addErrback(self._on_series_record_err, series_id)
+            d.addCallback(lambda result: self._request(url, 'episode'))
+        else:
+            d = self._request(url, 'episode')
+        return d.addCallback(self._on_got_episode)
+
+    def _on_series_record_err(self, failure, series_id):
+        log.warning('unable to fetch the record for series %s: %s',
+            series_id, failure.getErrorMessage())
 
     def _on_got_episode(self, response):
+        for elm in iterelements(response, ('Episode',)):
+            return Episode(self, record(elm, EPISODE_FIELDS))
+
+        # No episode was found
+        raise EpisodeNotFoundError
+
+    def get_updates(self, since):
+        """
+        Get the series and episodes that have changed since a time, using
+        the shortest updates feed that covers it.
+
+        :param since: The time to get changes since
+        :type since: int
+        :returns: A Deferred that fires with an Updates
+        :rtype: twisted.internet.defer.Deferred
+        """
+        period = 'all'
+        for name, length in UPDATE_PERIODS:
+            if time.time() - since < length:
+                period = name
+                break
+
+        url = self._url('updates/updates_%s.xml' % period)
+        return self.client.fetch(url, None).addCallback(
+            self._on_got_updates, since)
+
+    def _on_got_updates(self, response, since):
         etree = cElementTree.fromstring(response)
+        series = {}
+        episodes = {}
 
-        # Check to see if any series were found
-        if not etree:
-            raise EpisodeNotFoundError
+        for elm in etree:
+            try:
+                changed = int(elm.findtext('time'))
+            except (TypeError, ValueError):
+                continue
+            if changed <= since:
+                continue
+
+            if elm.tag == 'Series':
+                series_id = int(elm.findtext('id'))
+                series[series_id] = max(changed, series.get(series_id, 0))
+            elif elm.tag == 'Episode':
+                series_id = int(elm.findtext('Series'))
+                episodes[series_id] = max(changed,
+                    episodes.get(series_id, 0))
+
+        return Updates(int(etree.get('time', 0)) or int(time.time()),
+            series, episodes)
+
+    def invalidate_series(self, *series_ids):
+        """
+        Remove everything cached about some series, so that they are
+        fetched again the next time they are asked for.
 
-        data = dict([(k.tag.lower(), k.text) for k in etree.find('Episode')])
-        return Episode(self, data)
+        :param series_ids: The ids of the series
+        :type series_ids: int
+        """
+        with self.cache.transaction():
+            for series_id in series_ids:
+                self.cache.invalidate(self._url('series/%s/%s.xml' % (
+                    series_id, self.language)))
+                self.cache.invalidate(self._url('series/%s/banners.xml' %
+                    series_id))
+                self.cache.invalidate(self._url('series/%s/all/%s.zip' % (
+                    series_id, self.language)))
+
+                # Episodes are cached by their season and episode number,
+                # which the updates feeds don't give, so drop all of them.
+                self.cache.invalidate_prefix(self._url(
+                    'series/%s/default/' % series_id))
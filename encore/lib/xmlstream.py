@@ -0,0 +1,68 @@
+#
+# encore/lib/xmlstream.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+"""
+Incremental parsing of the XML returned by thetvdb.org and themoviedb.org.
+Rather than building a tree of a whole response, the records in it are
+handed out one at a time as they are parsed and thrown away afterwards,
+so only one of them is held in memory at once.
+"""
+
+from cStringIO import StringIO
+from xml.etree import cElementTree
+
+def iterelements(source, tags):
+    """
+    Parse a document and yield each element with one of the tags. An
+    element is only complete until the next one is asked for, as it is
+    then emptied.
+
+    :param source: The document, or a file-like object to read it from
+    :type source: str
+    :param tags: The tags of the elements to yield
+    :type tags: tuple
+    """
+    if isinstance(source, basestring):
+        source = StringIO(source)
+
+    for event, elem in cElementTree.iterparse(source):
+        if elem.tag in tags:
+            yield elem
+            elem.clear()
+
+def record(elem, fields=None):
+    """
+    Build a dict of the text of the children of an element, keyed by
+    their lowercased tags.
+
+    :param elem: The element
+    :type elem: Element
+    :param fields: The lowercased tags to keep, all of them are if None
+    :type fields: frozenset
+    :rtype: dict
+    """
+    data = {}
+    for child in elem:
+        tag = child.tag.lower()
+        if fields is None or tag in fields:
+            data[tag] = child.text
+    return data
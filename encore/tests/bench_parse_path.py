@@ -0,0 +1,75 @@
+#
+# encore/tests/bench_parse_path.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+"""
+Micro-benchmark for parse_path() over a corpus of 100,000 video paths laid
+out the ways a library usually is. Run it with:
+
+    python -m encore.tests.bench_parse_path
+"""
+
+import time
+
+from encore.backend.indexing.video_metadata import _parse_directory
+from encore.backend.indexing.video_metadata import parse_path, parse_paths
+
+LAYOUTS = [
+    '/media/tv/%(show)s/Season %(season)d/%(episode)02d - %(title)s.avi',
+    '/media/tv/%(show)s - Season %(season)d/%(episode)02d %(title)s.mkv',
+    '/media/tv/%(dotted)s.S%(season)02dE%(episode)02d.%(title)s.XviD.avi',
+    '/media/movies/%(show)s %(title)s (2009) [DVDRip].avi',
+]
+
+def build_corpus(size=100000):
+    paths = []
+    show = 0
+    while len(paths) < size:
+        show += 1
+        name = 'Show Number %d' % show
+        for season in xrange(1, 11):
+            for episode in xrange(1, 21):
+                layout = LAYOUTS[show % len(LAYOUTS)]
+                paths.append(layout % {
+                    'show': name,
+                    'dotted': name.replace(' ', '.'),
+                    'season': season,
+                    'episode': episode,
+                    'title': 'Episode Title'
+                })
+    return paths[:size]
+
+def bench(name, func, paths):
+    start = time.time()
+    func(paths)
+    elapsed = time.time() - start
+    print '%-24s %8.3fs %10.0f paths/s' % (name, elapsed, len(paths) / elapsed)
+
+def main():
+    paths = build_corpus()
+    print 'Parsing %d paths' % len(paths)
+    bench('parse_path', lambda paths: [parse_path(p) for p in paths], paths)
+    _parse_directory.cache.clear()
+    bench('parse_paths (cold)', parse_paths, paths)
+    bench('parse_paths (warm)', parse_paths, paths)
+
+if __name__ == '__main__':
+    main()
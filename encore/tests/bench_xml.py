@@ -0,0 +1,164 @@
+#
+# encore/tests/bench_xml.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+"""
+Benchmark of the streaming parsers for thetvdb.org and themoviedb.org
+responses against building a tree of the whole response. The responses
+are generated in the shape of the real ones for a long running show and
+a movie with a large cast. Run it with:
+
+    python -m encore.tests.bench_xml
+"""
+
+import os
+import time
+import resource
+from xml.etree import cElementTree
+from xml.sax.saxutils import escape
+
+from encore.lib.tmdb import AsyncMovieDb, MovieDb
+from encore.lib.tvdb import Banner, Episode, TvDb, EPISODE_FIELDS
+from encore.lib.xmlstream import iterelements, record
+
+tvdb = TvDb('', cache={}, http=object())
+mdb = AsyncMovieDb(cache={}, http=object())
+
+TEXT = escape('Lorem ipsum dolor sit amet & consectetur. ' * 12)
+
+def build_record(seasons=30, episodes=25):
+    parts = ['<?xml version="1.0" encoding="UTF-8" ?>\n<Data>\n<Series>']
+    for field in ('id', 'Actors', 'Airs_DayOfWeek', 'ContentRating',
+            'FirstAired', 'Genre', 'IMDB_ID', 'Language', 'Network',
+            'Overview', 'Rating', 'SeriesName', 'Status', 'banner', 'fanart',
+            'lastupdated', 'poster'):
+        parts.append('<%s>%s</%s>' % (field, field == 'id' and '1' or TEXT,
+            field))
+    parts.append('</Series>')
+    for season in xrange(1, seasons + 1):
+        for episode in xrange(1, episodes + 1):
+            parts.append('<Episode><id>%d</id><SeasonNumber>%d</SeasonNumber>'
+                '<EpisodeNumber>%d</EpisodeNumber>' % (season * 100 + episode,
+                season, episode))
+            for field in ('DVD_chapter', 'DVD_discid', 'Director',
+                    'EpisodeName', 'FirstAired', 'GuestStars', 'IMDB_ID',
+                    'Language', 'Overview', 'ProductionCode', 'Rating',
+                    'Writer', 'absolute_number', 'filename', 'lastupdated',
+                    'seasonid', 'seriesid'):
+                parts.append('<%s>%s</%s>' % (field, TEXT, field))
+            parts.append('</Episode>')
+    parts.append('</Data>')
+    return '\n'.join(parts)
+
+def build_banners(count=5000):
+    parts = ['<?xml version="1.0" encoding="UTF-8" ?>\n<Banners>']
+    for i in xrange(count):
+        parts.append('<Banner><id>%d</id><BannerPath>seasons/%d.jpg'
+            '</BannerPath><BannerType>season</BannerType><BannerType2>season'
+            '</BannerType2><Language>en</Language><Rating>7.5</Rating>'
+            '<RatingCount>4</RatingCount><Season>%d</Season><Colors>%s'
+            '</Colors><ThumbnailPath>_cache/%d.jpg</ThumbnailPath></Banner>'
+            % (i, i, i % 30, TEXT, i))
+    parts.append('</Banners>')
+    return '\n'.join(parts)
+
+def build_movie(cast=5000):
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<OpenSearchDescription>'
+        '<movies><movie><name>Movie</name><id>1</id><overview>%s</overview>'
+        '<released>2009-01-01</released><images>' % TEXT]
+    for i in xrange(20):
+        parts.append('<image type="poster" size="original" url="http://x/%d'
+            '.jpg" id="%d"/>' % (i, i))
+    parts.append('</images><cast>')
+    for i in xrange(cast):
+        parts.append('<person name="Person %d" character="%s" job="Actor" '
+            'id="%d" url="http://x/%d"/>' % (i, TEXT, i, i))
+    parts.append('</cast></movie></movies></OpenSearchDescription>')
+    return ''.join(parts)
+
+# The parsers as they were before responses were streamed
+
+def tree_record(data):
+    etree = cElementTree.fromstring(data)
+    return [Episode(tvdb, dict([(k.tag.lower(), k.text) for k in elm]))
+        for elm in etree.findall('Episode')]
+
+def tree_banners(data):
+    etree = cElementTree.fromstring(data)
+    banners = []
+    for elm in etree:
+        data = dict([(k.tag.lower(), k.text) for k in elm])
+        if 'season' in data:
+            data['season'] = int(data['season'])
+        banners.append(Banner(tvdb, data))
+    return banners
+
+def tree_movie(data):
+    return MovieDb()._movieInfo(cElementTree.fromstring(data), 'movie')
+
+def stream_record(data):
+    return [Episode(tvdb, record(elm, EPISODE_FIELDS)) for elm in
+        iterelements(data, ('Episode',))]
+
+def stream_banners(data):
+    return tvdb._on_got_banners(data)
+
+def stream_movie(data):
+    return mdb._movieInfo(data, 'movie')
+
+def measure(func, data):
+    """
+    Run func in a child process, so the peak memory used by each parser
+    can be told apart.
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        func(data)
+        elapsed = time.time() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+        os.write(write, '%f %d' % (elapsed, peak))
+        os._exit(0)
+
+    os.close(write)
+    result = os.read(read, 100)
+    os.close(read)
+    os.waitpid(pid, 0)
+    elapsed, peak = result.split()
+    return float(elapsed), int(peak)
+
+def main():
+    cases = [
+        ('series record', build_record(), tree_record, stream_record),
+        ('banners', build_banners(), tree_banners, stream_banners),
+        ('movie info', build_movie(), tree_movie, stream_movie),
+    ]
+    for name, data, tree, stream in cases:
+        print '%s (%d KiB)' % (name, len(data) / 1024)
+        for parser, func in (('tree', tree), ('stream', stream)):
+            elapsed, peak = measure(func, data)
+            print '    %-8s %8.3fs %8d KiB peak' % (parser, elapsed, peak)
+
+if __name__ == '__main__':
+    main()
@@ -29,6 +29,9 @@ from twisted.trial import unittest
 from encore.config import Config
 from encore.backend.model import Database
 
+# Resolved on import, as the tests are run from a different directory
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
 class EncoreTest(unittest.TestCase):
     """
     Test for use in the Encore test suite.
@@ -43,7 +46,7 @@ class EncoreTest(unittest.TestCase):
         self.config = Config()
         self.config.test_dir = self.test_cfg_dir
         self.config.initialize()
-        self.data_dir = os.path.dirname(__file__) + '/data'
+        self.data_dir = DATA_DIR
 
     def tearDown(self):
         """
@@ -57,6 +60,11 @@ class EncoreDbTest(EncoreTest):
     Test that requires a database
     """
 
-    def setupUp(self):
+    def setUp(self):
         EncoreTest.setUp(self)
-        self.db = Database(tempfile.mkstemp(prefix='encore-tests+'))
+        self.db = Database(os.path.join(self.test_dir, 'media.db'))
+        self.db.initialize()
+
+    def tearDown(self):
+        return self.db.close().addCallback(lambda result:
+            EncoreTest.tearDown(self))
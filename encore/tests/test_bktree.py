@@ -0,0 +1,75 @@
+#
+# encore/tests/test_bktree.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+import random
+
+from encore.utils.bktree import BKTree, hamming
+
+from encore.tests.test import EncoreTest
+
+class TestBKTree(EncoreTest):
+    """
+    Tests for encore.utils.bktree.
+    """
+
+    def test_hamming(self):
+        self.assertEqual(hamming(0, 0), 0)
+        self.assertEqual(hamming(0b1011, 0b0001), 2)
+        self.assertEqual(hamming(2 ** 64 - 1, 0), 64)
+
+    def test_find(self):
+        tree = BKTree()
+        tree.add(0b0000, 'a')
+        tree.add(0b0001, 'b')
+        tree.add(0b0011, 'c')
+        tree.add(0b1111, 'd')
+        tree.add(0b0001, 'e')
+        self.assertEqual(len(tree), 5)
+        self.assertEqual(tree.find(0b0000, 1), [(0, 'a'), (1, 'b'),
+            (1, 'e')])
+        self.assertEqual(tree.find(0b0111, 1), [(1, 'c'), (1, 'd')])
+        self.assertEqual(BKTree().find(0, 64), [])
+
+    def test_remove(self):
+        tree = BKTree()
+        tree.add(0b0000, 'a')
+        tree.add(0b0001, 'b')
+        tree.add(0b0011, 'c')
+        self.assertTrue(tree.remove(0b0001, 'b'))
+        self.assertFalse(tree.remove(0b0001, 'b'))
+        self.assertFalse(tree.remove(0b0111, 'c'))
+
+        # Keys under the removed one are still found
+        self.assertEqual(tree.find(0b0011, 0), [(0, 'c')])
+        self.assertEqual(len(tree), 2)
+
+    def test_matches_linear_search(self):
+        rand = random.Random(0)
+        keys = [rand.getrandbits(64) for i in xrange(500)]
+        tree = BKTree()
+        for i, key in enumerate(keys):
+            tree.add(key, i)
+
+        for key in keys[:20]:
+            expected = sorted((hamming(key, other), i)
+                for (i, other) in enumerate(keys)
+                if hamming(key, other) <= 24)
+            self.assertEqual(tree.find(key, 24), expected)
@@ -0,0 +1,311 @@
+#
+# encore/tests/test_cache.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+import time
+import zipfile
+from cStringIO import StringIO
+
+from twisted.internet import defer
+
+from encore.lib.cache import ResponseCache
+from encore.lib.tvdb import TvDb
+
+from encore.tests.test import EncoreTest
+
+LANGUAGES = """<?xml version="1.0" encoding="UTF-8" ?>
+<Languages>
+  <Language><name>English</name><abbreviation>en</abbreviation></Language>
+</Languages>
+"""
+
+RECORD = """<?xml version="1.0" encoding="UTF-8" ?>
+<Data>
+  <Series><id>82283</id><SeriesName>True Blood</SeriesName></Series>
+  <Episode><id>1</id><SeasonNumber>1</SeasonNumber>
+    <EpisodeNumber>1</EpisodeNumber><EpisodeName>Strange Love</EpisodeName>
+  </Episode>
+  <Episode><id>2</id><SeasonNumber>1</SeasonNumber>
+    <EpisodeNumber>2</EpisodeNumber><EpisodeName>The First Taste</EpisodeName>
+  </Episode>
+</Data>
+"""
+
+BANNERS = """<?xml version="1.0" encoding="UTF-8" ?>
+<Banners>
+  <Banner><BannerPath>seasons/82283-1.jpg</BannerPath><Season>1</Season>
+  </Banner>
+</Banners>
+"""
+
+class TestResponseCache(EncoreTest):
+    """
+    Tests for encore.lib.cache.ResponseCache.
+    """
+
+    def setUp(self):
+        super(TestResponseCache, self).setUp()
+        self.now = 1000.0
+        self.cache = ResponseCache(os.path.join(self.test_dir, 'test.cache'),
+            ttls={'series': 60})
+        self.cache.clock = lambda: self.now
+
+    def tearDown(self):
+        self.cache.close()
+        super(TestResponseCache, self).tearDown()
+
+    def test_get(self):
+        self.assertEqual(self.cache.get('a'), None)
+        self.cache.set('a', LANGUAGES, 'series')
+        self.assertEqual(self.cache.get('a'), (LANGUAGES, True))
+
+    def test_stale(self):
+        self.cache.set('a', LANGUAGES, 'series')
+        self.now += 61
+        self.assertEqual(self.cache.get('a'), (LANGUAGES, False))
+
+    def test_invalidate(self):
+        self.cache.set('a', LANGUAGES, 'series')
+        self.cache.invalidate('a')
+        self.assertFalse('a' in self.cache)
+        self.assertEqual(self.cache.size, 0)
+
+    def test_transaction(self):
+        self.cache.set('a', LANGUAGES, 'series')
+        try:
+            with self.cache.transaction():
+                self.cache.invalidate('a')
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertTrue('a' in self.cache)
+        self.assertTrue(self.cache.size > 0)
+
+    def test_persistent(self):
+        self.cache.set('a', LANGUAGES, 'series')
+        self.cache.close()
+        self.cache = ResponseCache(self.cache.filename)
+        self.assertEqual(self.cache.get('a')[0], LANGUAGES)
+        self.assertTrue(self.cache.size > 0)
+
+    def test_eviction(self):
+        data = os.urandom(1000)
+        self.cache.max_size = 3500
+        for key in ('a', 'b', 'c'):
+            self.cache.set(key, data, 'series')
+            self.now += 1
+
+        # Using 'a' should make 'b' the least recently used
+        self.cache.get('a')
+        self.cache.set('d', data, 'series')
+        self.assertFalse('b' in self.cache)
+        self.assertTrue('a' in self.cache)
+        self.assertTrue(self.cache.size <= 3500)
+
+    def test_eviction_in_transaction(self):
+        data = os.urandom(1000)
+        self.cache.max_size = 3500
+        with self.cache.transaction():
+            for key in ('a', 'b', 'c', 'd', 'e'):
+                self.cache.set(key, data, 'series')
+                self.now += 1
+        self.assertTrue(self.cache.size <= 3500)
+        self.assertTrue('e' in self.cache)
+
+class FakeHTTP(object):
+
+    def __init__(self):
+        self.fetched = []
+        self.responses = {}
+        self.pending = None
+
+    def get(self, url):
+        self.fetched.append(url)
+        if self.pending:
+            return self.pending
+        return defer.succeed(self.responses.get(url, LANGUAGES))
+
+class TestTvDbCache(EncoreTest):
+    """
+    Tests for the response caching in encore.lib.tvdb.TvDb.
+    """
+
+    def setUp(self):
+        super(TestTvDbCache, self).setUp()
+        self.cache = ResponseCache(os.path.join(self.test_dir, 'tvdb.cache'))
+        self.http = FakeHTTP()
+        self.tvdb = TvDb('KEY', cache=self.cache, http=self.http)
+        self.url = self.tvdb.api_url + 'languages.xml'
+
+    def tearDown(self):
+        self.cache.close()
+        super(TestTvDbCache, self).tearDown()
+
+    def test_fresh(self):
+        self.cache.set(self.url, LANGUAGES, 'languages')
+
+        def got_languages(languages):
+            self.assertEqual(languages[0]['abbreviation'], 'en')
+            self.assertEqual(self.http.fetched, [])
+
+        return self.tvdb.get_languages().addCallback(got_languages)
+
+    def test_stale(self):
+        # Cache the response as if it had been fetched long ago
+        clock = self.cache.clock
+        self.cache.clock = lambda: 0
+        self.cache.set(self.url, LANGUAGES, 'languages')
+        self.cache.clock = clock
+
+        def got_languages(languages):
+            self.assertEqual(languages[0]['abbreviation'], 'en')
+            self.assertEqual(self.http.fetched, [self.url])
+
+        return self.tvdb.get_languages().addCallback(got_languages)
+
+    def test_coalesced(self):
+        self.http.pending = defer.Deferred()
+        requests = [self.tvdb.get_languages() for i in xrange(3)]
+        self.assertEqual(self.http.fetched, [self.url])
+        self.assertEqual(self.tvdb.stats['misses'], 3)
+        self.assertEqual(self.tvdb.stats['coalesced'], 2)
+
+        def got_languages(results):
+            for languages in results:
+                self.assertEqual(languages[0]['abbreviation'], 'en')
+            self.assertEqual(self.tvdb.client._in_flight, {})
+
+        self.http.pending.callback(LANGUAGES)
+        return defer.gatherResults(requests).addCallback(got_languages)
+
+    def test_coalesced_error(self):
+        self.http.pending = defer.Deferred()
+        requests = [self.tvdb.get_languages() for i in xrange(2)]
+        self.http.pending.errback(ValueError('failed'))
+        return defer.gatherResults([self.assertFailure(d, ValueError)
+            for d in requests])
+
+class TestTvDbUpdates(EncoreTest):
+    """
+    Tests for checking for updates with encore.lib.tvdb.TvDb.
+    """
+
+    def setUp(self):
+        super(TestTvDbUpdates, self).setUp()
+        self.cache = ResponseCache(os.path.join(self.test_dir, 'tvdb.cache'))
+        self.http = FakeHTTP()
+        self.tvdb = TvDb('KEY', cache=self.cache, http=self.http)
+
+    def tearDown(self):
+        self.cache.close()
+        super(TestTvDbUpdates, self).tearDown()
+
+    def test_get_updates(self):
+        since = int(time.time()) - 3600
+        url = self.tvdb.api_url + 'updates/updates_day.xml'
+        self.http.responses[url] = """<Data time="%d">
+            <Series><id>1</id><time>%d</time></Series>
+            <Series><id>2</id><time>%d</time></Series>
+            <Episode><id>10</id><Series>3</Series><time>%d</time></Episode>
+            </Data>""" % (since + 3600, since + 60, since - 60, since + 120)
+
+        def got_updates(updates):
+            self.assertEqual(updates.time, since + 3600)
+            self.assertEqual(updates.series, {1: since + 60})
+            self.assertEqual(updates.episodes, {3: since + 120})
+            self.assertFalse(url in self.cache)
+
+        return self.tvdb.get_updates(since).addCallback(got_updates)
+
+    def test_invalidate_series(self):
+        for path in ('series/1/en.xml', 'series/1/default/1/1/en.xml',
+                'series/1/default/1/2/en.xml', 'series/12/en.xml',
+                'series/12/default/1/1/en.xml'):
+            self.cache.set(self.tvdb.api_url + path, LANGUAGES, 'series')
+
+        self.tvdb.invalidate_series(1)
+        self.assertEqual(len(self.cache), 2)
+        self.assertTrue(self.tvdb.api_url + 'series/12/default/1/1/en.xml'
+            in self.cache)
+
+        self.tvdb.invalidate_series(3, 12)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.size, 0)
+
+class TestTvDbRecord(EncoreTest):
+    """
+    Tests for fetching full series records with encore.lib.tvdb.TvDb.
+    """
+
+    def setUp(self):
+        super(TestTvDbRecord, self).setUp()
+        self.cache = ResponseCache(os.path.join(self.test_dir, 'tvdb.cache'))
+        self.http = FakeHTTP()
+        self.tvdb = TvDb('KEY', cache=self.cache, http=self.http)
+
+        record = StringIO()
+        archive = zipfile.ZipFile(record, 'w')
+        archive.writestr('en.xml', RECORD)
+        archive.writestr('banners.xml', BANNERS)
+        archive.close()
+        self.record_url = self.tvdb.api_url + 'series/82283/all/en.zip'
+        self.http.responses[self.record_url] = record.getvalue()
+
+    def tearDown(self):
+        self.cache.close()
+        super(TestTvDbRecord, self).tearDown()
+
+    def test_series_record(self):
+        def got_series(series):
+            self.assertEqual(series.seriesname, 'True Blood')
+            return self.tvdb.get_banners(82283)
+
+        def got_banners(banners):
+            self.assertEqual(banners[0].season, 1)
+            return self.tvdb.get_series_by_id(82283)
+
+        def got_series_by_id(series):
+            self.assertEqual(series.id, '82283')
+            self.assertEqual(self.http.fetched, [self.record_url])
+
+        d = self.tvdb.get_series_record(82283)
+        d.addCallback(got_series)
+        d.addCallback(got_banners)
+        d.addCallback(got_series_by_id)
+        return d
+
+    def test_bulk_episodes(self):
+        episode_url = self.tvdb.api_url + 'series/82283/default/1/%d/en.xml'
+        self.http.responses[episode_url % 1] = (
+            '<Data><Episode><EpisodeName>Strange Love</EpisodeName>'
+            '</Episode></Data>')
+
+        def got_episodes(episodes):
+            self.assertEqual([e.episodename for e in episodes],
+                ['Strange Love', 'Strange Love', 'The First Taste'])
+            self.assertEqual(self.http.fetched, [episode_url % 1,
+                self.record_url])
+
+        # The first couple of episodes are fetched one at a time
+        return defer.gatherResults([self.tvdb.get_episode(82283, 1, 1),
+            self.tvdb.get_episode(82283, 1, 1),
+            self.tvdb.get_episode(82283, 1, 2)]).addCallback(got_episodes)
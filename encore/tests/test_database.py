@@ -0,0 +1,201 @@
+#
+# encore/tests/test_database.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+import sqlite3
+
+from twisted.internet import defer, task
+
+from encore.backend.model import Database, Photo, Show, ShowAlias
+from encore.backend.model.migrations import SCHEMA_VERSION
+
+from encore.tests.test import EncoreTest, EncoreDbTest
+
+class TestDatabaseBatching(EncoreDbTest):
+    """
+    Tests for the write batching in encore.backend.model.Database.
+    """
+
+    def setUp(self):
+        super(TestDatabaseBatching, self).setUp()
+        self.db.batch_size = 10
+        self.db.clock = task.Clock()
+
+    def committed(self):
+        """
+        Count the photos visible to another connection.
+        """
+        conn = sqlite3.connect(self.db.filename)
+        try:
+            return conn.execute('SELECT COUNT(*) FROM photos').fetchone()[0]
+        finally:
+            conn.close()
+
+    def add_photos(self, count):
+        saved = []
+        for i in xrange(count):
+            photo = Photo()
+            photo.path = u'/photos/%d.jpg' % i
+            saved.append(self.db.save(photo))
+        return defer.DeferredList(saved, fireOnOneErrback=True)
+
+    def test_batched(self):
+        def on_saved(result):
+            self.assertEqual(self.committed(), 0)
+            return self.db.flush()
+
+        def on_flushed(result):
+            self.assertEqual(self.committed(), 5)
+
+        return self.add_photos(5).addCallback(on_saved).addCallback(
+            on_flushed)
+
+    def test_batch_size(self):
+        def on_saved(result):
+            self.assertEqual(self.committed(), 10)
+        return self.add_photos(10).addCallback(on_saved)
+
+    def test_batch_interval(self):
+        def on_saved(result):
+            self.db.clock.advance(self.db.batch_interval)
+            # Wait for the commit queued by the timer to be made
+            return self.db.write(lambda session: None)
+
+        def on_flushed(result):
+            self.assertEqual(self.committed(), 5)
+
+        return self.add_photos(5).addCallback(on_saved).addCallback(
+            on_flushed)
+
+    def test_failed_write(self):
+        def fail(session):
+            photo = Photo()
+            photo.path = u'/photos/0.jpg'
+            session.add(photo)
+            raise ValueError('failed')
+
+        def on_saved(result):
+            return self.assertFailure(self.db.write(fail), ValueError)
+
+        def on_failed(result):
+            return self.db.flush()
+
+        def on_flushed(result):
+            self.assertEqual(self.committed(), 5)
+
+        return self.add_photos(5).addCallback(on_saved).addCallback(
+            on_failed).addCallback(on_flushed)
+
+    def test_read(self):
+        def on_flushed(result):
+            return self.db.read(lambda session: session.query(Photo).count())
+
+        def on_read(count):
+            self.assertEqual(count, 5)
+
+        return self.add_photos(5).addCallback(lambda result:
+            self.db.flush()).addCallback(on_flushed).addCallback(on_read)
+
+class TestDatabaseSchema(EncoreDbTest):
+    """
+    Tests for the schema setup in encore.backend.model.Database.
+    """
+
+    def test_wal(self):
+        mode = self.db.engine.execute('PRAGMA journal_mode').scalar()
+        self.assertEqual(mode, 'wal')
+
+    def test_schema_version(self):
+        version = self.db.engine.execute('PRAGMA user_version').scalar()
+        self.assertEqual(version, SCHEMA_VERSION)
+
+class TestDatabaseMigration(EncoreTest):
+    """
+    Tests for encore.backend.model.migrations.
+    """
+
+    def setUp(self):
+        super(TestDatabaseMigration, self).setUp()
+        self.filename = os.path.join(self.test_dir, 'media.db')
+
+        # The schema as it was before migrations were introduced
+        conn = sqlite3.connect(self.filename)
+        conn.executescript("""
+            CREATE TABLE movies (id INTEGER NOT NULL, movie_id VARCHAR(10),
+                path VARCHAR(200), description TEXT, genre VARCHAR(100),
+                rating FLOAT, cover VARCHAR(100), backdrop VARCHAR(100),
+                PRIMARY KEY (id));
+            CREATE TABLE photos (id INTEGER NOT NULL, path VARCHAR(200),
+                PRIMARY KEY (id));
+            CREATE TABLE shows (id INTEGER NOT NULL, series_id INTEGER,
+                title VARCHAR(100), description TEXT, genre VARCHAR(100),
+                rating FLOAT, cover VARCHAR(100), backdrop VARCHAR(100),
+                PRIMARY KEY (id));
+            CREATE TABLE seasons (show_id INTEGER NOT NULL,
+                number INTEGER NOT NULL, banner VARCHAR(100),
+                PRIMARY KEY (show_id, number),
+                FOREIGN KEY(show_id) REFERENCES shows (id));
+            CREATE TABLE episodes (id INTEGER NOT NULL, show_id INTEGER,
+                path VARCHAR(200), season_number INTEGER, episode INTEGER,
+                title VARCHAR(100), overview TEXT, rating FLOAT,
+                writer VARCHAR(100), director VARCHAR(100),
+                guest_stars VARCHAR(250), image VARCHAR(100),
+                lastupdated INTEGER, PRIMARY KEY (id),
+                FOREIGN KEY(show_id, season_number)
+                    REFERENCES seasons (show_id, number));
+            INSERT INTO shows (id, series_id, title)
+                VALUES (1, 360115, 'Prison.Break');
+            INSERT INTO photos (id, path) VALUES (1, '/photos/a.jpg');
+            INSERT INTO photos (id, path) VALUES (2, '/photos/a.jpg');
+        """)
+        conn.commit()
+        conn.close()
+
+        self.db = Database(self.filename)
+        self.db.initialize()
+
+    def tearDown(self):
+        return self.db.close().addCallback(lambda result:
+            super(TestDatabaseMigration, self).tearDown())
+
+    def test_migrated(self):
+        show = self.db.query(Show).one()
+        self.assertEqual(show.normalized_title, 'prison break')
+        alias = self.db.query(ShowAlias).one()
+        self.assertEqual((alias.title, alias.series_id),
+            ('prison break', 360115))
+        self.assertEqual(self.db.query(Photo).count(), 1)
+
+        version = self.db.engine.execute('PRAGMA user_version').scalar()
+        self.assertEqual(version, SCHEMA_VERSION)
+
+        indexes = [row[1] for row in
+            self.db.engine.execute('PRAGMA index_list(photos)')]
+        self.assertTrue('ix_photos_path' in indexes)
+        self.assertTrue('ix_photos_fingerprint' in indexes)
+        self.assertTrue('ix_photos_taken' in indexes)
+        self.assertTrue('ix_photos_phash' in indexes)
+
+        tables = [row[0] for row in self.db.engine.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")]
+        for table in ('artists', 'albums', 'tracks'):
+            self.assertTrue(table in tables)
@@ -0,0 +1,153 @@
+#
+# encore/tests/test_exif.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+import struct
+import datetime
+
+from encore.backend.indexing.exif import read_exif
+
+from encore.tests.test import EncoreTest
+
+def ifd(order, entries, offset, next_data=''):
+    """
+    Build an IFD at offset in a TIFF structure, entries being a list of
+    (tag, type, count, value) where value is packed data. Values longer
+    than 4 bytes are placed after the IFD, followed by next_data.
+    """
+    data_offset = offset + 2 + 12 * len(entries) + 4
+    header = struct.pack(order + 'H', len(entries))
+    extra = ''
+    for tag, field_type, count, value in entries:
+        if len(value) <= 4:
+            field = value.ljust(4, '\x00')
+        else:
+            field = struct.pack(order + 'I', data_offset + len(extra))
+            extra += value
+        header += struct.pack(order + 'HHI', tag, field_type, count) + field
+    return header + '\x00' * 4 + extra + next_data
+
+def rationals(order, *values):
+    return ''.join(struct.pack(order + 'II', n, d) for (n, d) in values)
+
+def tiff(order):
+    """
+    Build a TIFF structure holding an IFD0, an Exif IFD and a GPS IFD.
+    """
+    mark = order == '<' and 'II' or 'MM'
+    gps = [
+        (1, 2, 2, 'S\x00'),
+        (2, 5, 3, rationals(order, (33, 1), (51, 1), (3000, 100))),
+        (3, 2, 2, 'E\x00'),
+        (4, 5, 3, rationals(order, (151, 1), (12, 1), (0, 1)))
+    ]
+    exif = [
+        (0x9003, 2, 20, '2010:06:21 14:05:33\x00'),
+        (0xA002, 4, 1, struct.pack(order + 'I', 4000)),
+        (0xA003, 4, 1, struct.pack(order + 'I', 3000))
+    ]
+
+    # The sizes of the IFD0 and its data have to be known to place the
+    # other IFDs after it.
+    ifd0 = lambda exif_offset, gps_offset: [
+        (0x010F, 2, 6, 'Canon\x00'),
+        (0x0110, 2, 14, 'Canon EOS 5D\x00\x00'),
+        (0x0112, 3, 1, struct.pack(order + 'H', 6)),
+        (0x8769, 4, 1, struct.pack(order + 'I', exif_offset)),
+        (0x8825, 4, 1, struct.pack(order + 'I', gps_offset))
+    ]
+    size = len(ifd(order, ifd0(0, 0), 8))
+    exif_data = ifd(order, exif, 8 + size)
+    gps_data = ifd(order, gps, 8 + size + len(exif_data))
+    return (mark + struct.pack(order + 'HI', 42, 8) +
+        ifd(order, ifd0(8 + size, 8 + size + len(exif_data)), 8) +
+        exif_data + gps_data)
+
+def segment(marker, data):
+    return '\xff' + chr(marker) + struct.pack('>H', len(data) + 2) + data
+
+def jpeg(*segments):
+    sof = segment(0xC0, struct.pack('>BHHB', 8, 1500, 2000, 3) + '\x00' * 9)
+    return ('\xff\xd8' + ''.join(segments) + sof +
+        segment(0xDA, '\x00' * 10) + 'image data' * 100 + '\xff\xd9')
+
+class TestExif(EncoreTest):
+    """
+    Tests for encore.backend.indexing.exif.
+    """
+
+    def write(self, data):
+        path = os.path.join(self.test_dir, 'a.jpg')
+        open(path, 'wb').write(data)
+        return path
+
+    def check(self, exif):
+        self.assertEqual(exif['taken'], datetime.datetime(2010, 6, 21, 14,
+            5, 33))
+        self.assertEqual(exif['make'], u'Canon')
+        self.assertEqual(exif['model'], u'Canon EOS 5D')
+        self.assertEqual(exif['orientation'], 6)
+        self.assertAlmostEqual(exif['latitude'], -(33 + 51 / 60.0 +
+            30 / 3600.0))
+        self.assertAlmostEqual(exif['longitude'], 151.2)
+
+        # The dimensions of the frame are used over those in the EXIF
+        self.assertEqual((exif['width'], exif['height']), (2000, 1500))
+
+    def test_little_endian(self):
+        self.check(read_exif(self.write(jpeg(segment(0xE1,
+            'Exif\x00\x00' + tiff('<'))))))
+
+    def test_big_endian(self):
+        # Preceded by an APP0 and an XMP APP1 segment, which are skipped
+        self.check(read_exif(self.write(jpeg(
+            segment(0xE0, 'JFIF\x00' + '\x00' * 9),
+            segment(0xE1, 'http://ns.adobe.com/xap/1.0/\x00<x/>'),
+            segment(0xE1, 'Exif\x00\x00' + tiff('>'))))))
+
+    def test_no_exif(self):
+        self.assertEqual(read_exif(self.write(jpeg())),
+            {'width': 2000, 'height': 1500})
+
+    def test_wrong_types(self):
+        # Text tags stored as numbers and pointers stored as text are
+        # ignored
+        entries = [
+            (0x010F, 3, 1, struct.pack('<H', 1)),
+            (0x0112, 2, 2, '6\x00'),
+            (0x0132, 3, 2, struct.pack('<HH', 2010, 6)),
+            (0x8769, 2, 4, 'abcd'),
+            (0x8825, 7, 4, '\x08\x00\x00\x00')
+        ]
+        data = 'Exif\x00\x00II' + struct.pack('<HI', 42, 8) + \
+            ifd('<', entries, 8)
+        self.assertEqual(read_exif(self.write(jpeg(segment(0xE1, data)))),
+            {'width': 2000, 'height': 1500})
+
+    def test_corrupt(self):
+        # The frame header is still read after an invalid EXIF segment
+        data = 'Exif\x00\x00' + tiff('<')[:40]
+        self.assertEqual(read_exif(self.write(jpeg(segment(0xE1, data)))),
+            {'width': 2000, 'height': 1500})
+        self.assertEqual(read_exif(self.write('not a jpeg')), {})
+        self.assertEqual(read_exif(self.write(jpeg()[:15])), {})
+        self.assertRaises(IOError, read_exif, '/missing.jpg')
@@ -0,0 +1,376 @@
+#
+# encore/tests/test_handlers.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+import shutil
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from encore.backend.indexing import handlers, thumbnails
+from encore.backend.indexing.handlers import ImageHandler, MusicHandler
+from encore.backend.indexing.handlers import VideoHandler
+from encore.backend.indexing.similar import SimilarPhotos
+from encore.backend.indexing.thumbnails import Thumbnailer
+from encore.backend.indexing.video_metadata import VideoMetadata
+from encore.backend.model import Album, Artist, Photo, ShowAlias, Track
+
+from encore.tests.test import EncoreDbTest
+
+class TestImageHandler(EncoreDbTest):
+    """
+    Tests for encore.backend.indexing.handlers.ImageHandler.
+    """
+
+    def setUp(self):
+        super(TestImageHandler, self).setUp()
+        self.patch(handlers, 'db', self.db)
+        self.similar = SimilarPhotos()
+        self.handler = ImageHandler(Thumbnailer(None,
+            os.path.join(self.test_dir, 'thumbnails')), self.similar)
+        self.filename = os.path.join(self.test_dir, 'a.jpg')
+        open(self.filename, 'wb').write('jpeg' * 1000)
+
+    def test_index(self):
+        def on_indexed(photo):
+            self.assertEqual(photo.path, self.filename)
+            self.assertNotEqual(photo.fingerprint, None)
+        return self.handler(self.filename).addCallback(on_indexed)
+
+    def test_metadata(self):
+        if thumbnails.Image is None:
+            raise unittest.SkipTest('PIL is not installed')
+        thumbnails.Image.new('RGB', (64, 48)).save(self.filename, 'JPEG')
+
+        def on_indexed(photo):
+            self.assertEqual((photo.width, photo.height), (64, 48))
+            self.assertEqual(photo.taken, None)
+            self.assertEqual(self.similar.tree.find(int(photo.phash, 16), 0),
+                [(0, photo.id)])
+            return self.handler.removed(self.filename)
+
+        def on_removed(result):
+            self.assertEqual(len(self.similar.tree), 0)
+
+        d = self.handler(self.filename)
+        d.addCallback(on_indexed)
+        d.addCallback(on_removed)
+        return d
+
+    def test_batched(self):
+        filenames = [self.filename]
+        for name in ('b.jpg', 'c.jpg'):
+            filenames.append(os.path.join(self.test_dir, name))
+            open(filenames[-1], 'wb').write(name * 1000)
+
+        def on_indexed(photos):
+            self.assertEqual([photo.path for photo in photos], filenames)
+            return self.db.flush()
+
+        def on_flushed(result):
+            self.assertEqual(self.db.query(Photo).count(), 3)
+
+        d = defer.gatherResults([self.handler(filename)
+            for filename in filenames])
+        d.addCallback(on_indexed)
+        d.addCallback(on_flushed)
+        return d
+
+    def test_moved(self):
+        moved = os.path.join(self.test_dir, 'b.jpg')
+
+        def on_indexed(photo):
+            self.photo_id = photo.id
+            os.rename(self.filename, moved)
+            return self.handler(moved)
+
+        def on_moved(photo):
+            # The existing row is reused rather than a new one added
+            self.assertEqual(photo.id, self.photo_id)
+            self.assertEqual(photo.path, moved)
+            return self.db.flush()
+
+        def on_flushed(result):
+            self.assertEqual(self.db.query(Photo).count(), 1)
+
+        d = self.handler(self.filename)
+        d.addCallback(on_indexed)
+        d.addCallback(on_moved)
+        d.addCallback(on_flushed)
+        return d
+
+    def test_exif_failed(self):
+        def read_file_exif(filename):
+            raise TypeError('Unexpected tag type')
+        self.patch(handlers, 'read_file_exif', read_file_exif)
+
+        def on_indexed(photo):
+            self.assertEqual(photo.path, self.filename)
+            self.assertEqual(len(self.flushLoggedErrors(TypeError)), 0)
+        return self.handler(self.filename).addCallback(on_indexed)
+
+    def test_moved_unknown(self):
+        # A photo that wasn't indexed before it was moved is indexed fully
+        def on_moved(photo):
+            self.assertEqual(photo.path, self.filename)
+            self.assertNotEqual(photo.fingerprint, None)
+        return self.handler.moved(os.path.join(self.test_dir, 'old.jpg'),
+            self.filename).addCallback(on_moved)
+
+    def test_copied(self):
+        copy = os.path.join(self.test_dir, 'b.jpg')
+        open(copy, 'wb').write('jpeg' * 1000)
+
+        def on_indexed(photo):
+            return self.handler(copy)
+
+        def on_copied(photo):
+            # The original still exists, so the copy is a new photo
+            self.assertEqual(photo.path, copy)
+            return self.db.flush()
+
+        def on_flushed(result):
+            self.assertEqual(self.db.query(Photo).count(), 2)
+
+        d = self.handler(self.filename)
+        d.addCallback(on_indexed)
+        d.addCallback(on_copied)
+        d.addCallback(on_flushed)
+        return d
+
+    def test_copy_removed(self):
+        copy = os.path.join(self.test_dir, 'b.jpg')
+        open(copy, 'wb').write('jpeg' * 1000)
+
+        def on_indexed(photo):
+            return self.handler(copy)
+
+        def on_copy_indexed(photo):
+            self.copy_id = photo.id
+
+            # The original vanishes before its removal has been handled
+            os.remove(self.filename)
+            return self.handler(copy)
+
+        def on_changed(photo):
+            # The copy keeps its own row rather than taking the original's
+            self.assertEqual(photo.id, self.copy_id)
+            self.assertEqual(photo.path, copy)
+            return self.db.flush()
+
+        def on_flushed(result):
+            self.assertEqual(self.db.query(Photo).count(), 2)
+
+        d = self.handler(self.filename)
+        d.addCallback(on_indexed)
+        d.addCallback(on_copy_indexed)
+        d.addCallback(on_changed)
+        d.addCallback(on_flushed)
+        return d
+
+class TestMusicHandler(EncoreDbTest):
+    """
+    Tests for encore.backend.indexing.handlers.MusicHandler.
+    """
+
+    def setUp(self):
+        super(TestMusicHandler, self).setUp()
+        self.patch(handlers, 'db', self.db)
+        self.handler = MusicHandler()
+        self.filenames = []
+        for name in ('a.mp3', 'b.mp3'):
+            filename = os.path.join(self.test_dir, name)
+            shutil.copy(os.path.join(self.data_dir, 'test.mp3'), filename)
+            self.filenames.append(filename)
+
+    def test_index(self):
+        def on_indexed(track):
+            self.assertEqual(track.path, self.filenames[0])
+            self.assertEqual(track.title, 'Flightless Bird, American Mouth')
+            self.assertEqual(track.track_number, 12)
+            self.assertEqual(track.disc_number, 1)
+            self.assertNotEqual(track.fingerprint, None)
+            return self.db.flush()
+
+        def on_flushed(result):
+            track = self.db.query(Track).one()
+            self.assertEqual(track.artist.name, 'Iron and Wine')
+            self.assertEqual(track.album.title, "The Shephard's Dog")
+            self.assertEqual(track.album.year, 2000)
+            self.assertEqual(track.album.artist, track.artist)
+
+        d = self.handler(self.filenames[0])
+        d.addCallback(on_indexed)
+        d.addCallback(on_flushed)
+        return d
+
+    def test_shared_album(self):
+        def on_indexed(tracks):
+            self.assertEqual(len(set(track.album_id for track in tracks)), 1)
+            self.assertEqual(len(set(track.artist_id for track in tracks)), 1)
+
+            # Both tracks were written together and the album cached
+            self.assertEqual(len(self.handler._albums), 1)
+            return self.db.flush()
+
+        def on_flushed(result):
+            self.assertEqual(self.db.query(Track).count(), 2)
+            self.assertEqual(self.db.query(Album).count(), 1)
+            self.assertEqual(self.db.query(Artist).count(), 1)
+
+        d = defer.gatherResults([self.handler.index(filename, None)
+            for filename in self.filenames])
+        d.addCallback(on_indexed)
+        d.addCallback(on_flushed)
+        return d
+
+    def test_removed(self):
+        def on_indexed(track):
+            return self.handler.removed(self.filenames[0])
+
+        def on_removed(result):
+            return self.db.flush()
+
+        def on_flushed(result):
+            self.assertEqual(self.db.query(Track).count(), 0)
+
+        d = self.handler(self.filenames[0])
+        d.addCallback(on_indexed)
+        d.addCallback(on_removed)
+        d.addCallback(on_flushed)
+        return d
+
+class TestVideoHandler(EncoreDbTest):
+    """
+    Tests for encore.backend.indexing.handlers.VideoHandler.
+    """
+
+    def setUp(self):
+        super(TestVideoHandler, self).setUp()
+        self.patch(handlers, 'db', self.db)
+        self.handler = VideoHandler()
+        self.series = VideoMetadata({
+            'id': '360115',
+            'seriesname': 'Prison Break',
+            'overview': '',
+            'genre': 'Drama',
+            'rating': 9.0,
+            'poster': None,
+            'fanart': None
+        })
+
+    def test_new_show(self):
+        lookups = []
+
+        def get_series_metadata(title):
+            lookups.append(title)
+            return defer.succeed(self.series)
+
+        def get_episode_metadata(series_id, season, episode):
+            return defer.succeed(VideoMetadata({
+                'episodename': 'Episode %d' % episode,
+                'overview': '',
+                'rating': 8.0,
+                'writer': None,
+                'director': None,
+                'gueststars': None,
+                'lastupdated': '100'
+            }))
+
+        self.patch(handlers, 'get_series_metadata', get_series_metadata)
+        self.patch(handlers, 'get_season_metadata', lambda series_id,
+            season: defer.succeed(VideoMetadata({'season': season})))
+        self.patch(handlers, 'get_episode_metadata', get_episode_metadata)
+
+        # Keep both episodes in the same uncommitted batch
+        self.db.batch_interval = 60
+
+        def index(result, episode):
+            return self.handler.index(os.path.join(self.test_dir,
+                'Prison.Break.S01E%02d.avi' % episode), None)
+
+        def on_indexed(episode):
+            # The show stored for the first episode is found for the second
+            self.assertEqual(len(lookups), 1)
+            self.assertEqual(episode.title, 'Episode 2')
+
+        d = index(None, 1)
+        d.addCallback(index, 2)
+        d.addCallback(on_indexed)
+        return d
+
+    def test_aliases(self):
+        def on_stored(series_id):
+            self.assertEqual(series_id, 360115)
+            return self.db.flush()
+
+        def on_flushed(result):
+            return defer.gatherResults([
+                self.db.read(self.handler._find_series, title) for title in
+                ('prison break us', 'The Prison Break (2005)', 'lost')])
+
+        def on_found(results):
+            self.assertEqual(results, [(360115, True), (360115, True),
+                (None, False)])
+
+        d = self.db.write(self.handler._store_series, self.series,
+            'prison break us')
+        d.addCallback(on_stored)
+        d.addCallback(on_flushed)
+        d.addCallback(on_found)
+        return d
+
+    def test_same_alias(self):
+        # The title the show was found by has the same key as its name
+        def on_flushed(result):
+            alias = self.db.query(ShowAlias).one()
+            self.assertEqual((alias.title, alias.series_id),
+                (u'prison break', 360115))
+
+        d = self.db.write(self.handler._store_series, self.series,
+            'Prison.Break')
+        d.addCallback(lambda _: self.db.flush())
+        d.addCallback(on_flushed)
+        return d
+
+    def test_override(self):
+        def on_stored(result):
+            return self.db.flush()
+
+        def on_flushed(result):
+            # Storing the series again doesn't replace the override
+            alias = self.db.query(ShowAlias).get(u'prison break us')
+            self.assertEqual(alias.series_id, 1)
+            self.assertTrue(alias.override)
+            return self.db.read(self.handler._find_series, 'prison break us')
+
+        def on_found(result):
+            # The show hasn't been stored, so it has to be fetched by id
+            self.assertEqual(result, (1, False))
+
+        d = self.handler.set_alias('prison.break.us', 1)
+        d.addCallback(lambda _: self.db.write(self.handler._store_series,
+            self.series, 'prison break us'))
+        d.addCallback(on_stored)
+        d.addCallback(on_flushed)
+        d.addCallback(on_found)
+        return d
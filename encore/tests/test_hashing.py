@@ -0,0 +1,148 @@
+#
+# encore/tests/test_hashing.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+
+from twisted.internet import task
+
+from encore.backend.indexing.hashing import HashCache, Hasher
+from encore.backend.indexing.hashing import fingerprint_file
+from encore.lib.tmdb import opensubtitleHashFile
+
+from encore.tests.test import EncoreTest
+
+class TestHashing(EncoreTest):
+    """
+    Tests for encore.backend.indexing.hashing.
+    """
+
+    def setUp(self):
+        super(TestHashing, self).setUp()
+        self.filename = os.path.join(self.test_dir, 'movie.avi')
+        data = ''.join([chr(i % 251) for i in xrange(200000)])
+        open(self.filename, 'wb').write(data)
+        self.cache = HashCache(os.path.join(self.test_dir, 'hashes.cache'))
+        self.clock = task.Clock()
+
+    def hasher(self, **kwargs):
+        hasher = Hasher(self.cache, **kwargs)
+        hasher.clock = self.clock
+        self.addCleanup(hasher.stop)
+        return hasher
+
+    def test_opensubtitles_hash(self):
+        # Computed with the reference implementation
+        self.assertEqual(opensubtitleHashFile(self.filename),
+            'e19d5212c9812cd6')
+
+    def test_fingerprint(self):
+        fingerprint = fingerprint_file(self.filename)
+        self.assertEqual(len(fingerprint), 32)
+        self.assertTrue(fingerprint.startswith('%016x' % 200000))
+
+        # Only the size, start and end of the file are fingerprinted
+        other = os.path.join(self.test_dir, 'moved.avi')
+        data = open(self.filename, 'rb').read()
+        open(other, 'wb').write(data[:100000] + 'x' + data[100001:])
+        self.assertEqual(fingerprint_file(other), fingerprint)
+
+        open(other, 'wb').write(data[:-1] + 'x')
+        self.assertNotEqual(fingerprint_file(other), fingerprint)
+        self.assertEqual(fingerprint_file('/missing.avi'), None)
+
+    def test_too_small(self):
+        open(self.filename, 'wb').write('x' * 1000)
+        def on_hashed(fhash):
+            self.assertEqual(fhash, None)
+        return self.hasher().hash(self.filename).addCallback(on_hashed)
+
+    def test_cached(self):
+        hasher = self.hasher()
+        st = os.stat(self.filename)
+
+        def on_hashed(fhash):
+            self.assertEqual(self.cache.get(self.filename, st), fhash)
+
+            # A cached hash is used without reading the file, as long as
+            # its size and mtime haven't changed
+            self.cache.set(self.filename, st, 'cached')
+            return hasher.hash(self.filename)
+
+        def on_cached(fhash):
+            self.assertEqual(fhash, 'cached')
+            os.utime(self.filename, (st.st_atime, st.st_mtime + 10))
+            return hasher.hash(self.filename)
+
+        def on_changed(fhash):
+            self.assertEqual(fhash, 'e19d5212c9812cd6')
+
+        d = hasher.hash(self.filename)
+        d.addCallback(on_hashed)
+        d.addCallback(on_cached)
+        d.addCallback(on_changed)
+        return d
+
+    def test_process_pool(self):
+        hasher = self.hasher(processes=2)
+
+        def on_hashed(hashes):
+            self.assertEqual(hashes, {self.filename: 'e19d5212c9812cd6',
+                '/missing.avi': None})
+
+            cache = HashCache(self.cache.filename)
+            cache.load()
+            self.assertEqual(cache.get(self.filename,
+                os.stat(self.filename)), 'e19d5212c9812cd6')
+
+        return hasher.hash_files([self.filename, '/missing.avi']
+            ).addCallback(on_hashed)
+
+    def test_save(self):
+        hasher = self.hasher(save_delay=30)
+
+        def saved_hashes():
+            cache = HashCache(self.cache.filename)
+            cache.load()
+            return cache.hashes
+
+        def on_hashed(fhash):
+            # The cache is saved once the delay has passed
+            self.assertEqual(saved_hashes(), {})
+            self.clock.advance(30)
+            self.assertTrue(self.filename in saved_hashes())
+
+            os.remove(self.filename)
+            return hasher.hash(self.filename)
+
+        def on_removed(fhash):
+            # Or when the hasher is stopped
+            self.assertTrue(self.filename in saved_hashes())
+            return hasher.stop()
+
+        def on_stopped(result):
+            self.assertEqual(saved_hashes(), {})
+
+        d = hasher.hash(self.filename)
+        d.addCallback(on_hashed)
+        d.addCallback(on_removed)
+        d.addCallback(on_stopped)
+        return d
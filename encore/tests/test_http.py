@@ -0,0 +1,98 @@
+#
+# encore/tests/test_http.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+
+from twisted.internet import reactor
+from twisted.web import error, resource, server
+from twisted.web.server import GzipEncoderFactory
+from twisted.web.resource import EncodingResourceWrapper
+
+from encore.lib.http import HTTPClient
+
+from encore.tests.test import EncoreTest
+
+BODY = '<Data>' + 'x' * 1000 + '</Data>'
+
+class Page(resource.Resource):
+    isLeaf = True
+
+    def __init__(self):
+        resource.Resource.__init__(self)
+        self.clients = set()
+
+    def render_GET(self, request):
+        self.clients.add(request.transport.getPeer().port)
+        self.encoding = request.getHeader('accept-encoding')
+        return BODY
+
+class TestHTTPClient(EncoreTest):
+    """
+    Tests for encore.lib.http.HTTPClient.
+    """
+
+    def setUp(self):
+        super(TestHTTPClient, self).setUp()
+        self.page = Page()
+        root = resource.Resource()
+        root.putChild('data.xml', EncodingResourceWrapper(self.page,
+            [GzipEncoderFactory()]))
+        root.putChild('missing.xml', resource.NoResource())
+        self.port = reactor.listenTCP(0, server.Site(root),
+            interface='127.0.0.1')
+        self.base = 'http://127.0.0.1:%d/' % self.port.getHost().port
+        self.client = HTTPClient(max_per_host=2)
+
+    def tearDown(self):
+        d = self.client.close()
+        d.addCallback(lambda result: self.port.stopListening())
+        d.addCallback(lambda result: super(TestHTTPClient, self).tearDown())
+        return d
+
+    def test_get(self):
+        def on_get(body):
+            self.assertEqual(body, BODY)
+            self.assertTrue('gzip' in self.page.encoding)
+        return self.client.get(self.base + 'data.xml').addCallback(on_get)
+
+    def test_persistent(self):
+        def on_second(body):
+            self.assertEqual(len(self.page.clients), 1)
+
+        def on_first(body):
+            return self.client.get(self.base + 'data.xml').addCallback(
+                on_second)
+
+        return self.client.get(self.base + 'data.xml').addCallback(on_first)
+
+    def test_error(self):
+        d = self.client.get(self.base + 'missing.xml')
+        return self.assertFailure(d, error.Error)
+
+    def test_download(self):
+        destination = os.path.join(self.test_dir, 'data.xml')
+
+        def on_downloaded(result):
+            self.assertEqual(open(destination).read(), BODY)
+
+        return self.client.download(self.base + 'data.xml',
+            destination).addCallback(on_downloaded)
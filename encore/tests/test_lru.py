@@ -0,0 +1,61 @@
+#
+# encore/tests/test_lru.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+from encore.utils.lru import LRUCache, memoize
+
+from encore.tests.test import EncoreTest
+
+class TestLRUCache(EncoreTest):
+    """
+    Tests for encore.utils.lru.
+    """
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        # Using a makes b the least recently used
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache.get('b', 'missing'), 'missing')
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_memoize(self):
+        calls = []
+
+        @memoize(2)
+        def double(value):
+            calls.append(value)
+            return value * 2
+
+        self.assertEqual(double(2), 4)
+        self.assertEqual(double(2), 4)
+        self.assertEqual(calls, [2])
+
+        double(3)
+        double(4)
+        self.assertEqual(double(2), 4)
+        self.assertEqual(calls, [2, 3, 4, 2])
@@ -0,0 +1,172 @@
+#
+# encore/tests/test_manifest.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+
+from twisted.internet import defer
+
+from encore.backend.indexing.handlers import FileHandler
+from encore.backend.indexing.indexer import Indexer
+from encore.backend.indexing.manifest import Manifest, FileStat
+
+from encore.tests.test import EncoreTest
+
+class RecordingHandler(FileHandler):
+    """
+    A handler that just records what it has been asked to do.
+    """
+
+    def __init__(self):
+        super(RecordingHandler, self).__init__()
+        self.calls = []
+
+    def __call__(self, filename):
+        self.calls.append(('handle', filename))
+        return defer.succeed(None)
+
+    def moved(self, old_filename, filename):
+        self.calls.append(('moved', old_filename, filename))
+        return defer.succeed(None)
+
+    def removed(self, filename):
+        self.calls.append(('removed', filename))
+        return defer.succeed(None)
+
+class TestManifest(EncoreTest):
+    """
+    Tests for encore.backend.indexing.manifest.Manifest.
+    """
+
+    def test_update_diff(self):
+        manifest = Manifest()
+        manifest.update('/media', {
+            '/media/a.avi': FileStat(1, 1.0, 1, 1),
+            '/media/b.avi': FileStat(2, 1.0, 2, 1),
+            '/media/c.avi': FileStat(3, 1.0, 3, 1),
+            '/media/d.avi': FileStat(4, 1.0, 4, 1)
+        }, {})
+
+        diff = manifest.update('/media', {
+            '/media/a.avi': FileStat(1, 1.0, 1, 1),
+            '/media/b.avi': FileStat(5, 2.0, 2, 1),
+            '/media/e.avi': FileStat(3, 1.0, 3, 1),
+            '/media/f.avi': FileStat(6, 1.0, 6, 1)
+        }, {})
+
+        self.assertEqual(diff.added, ['/media/f.avi'])
+        self.assertEqual(diff.changed, ['/media/b.avi'])
+        self.assertEqual(diff.moved, [('/media/c.avi', '/media/e.avi')])
+        self.assertEqual(diff.removed, ['/media/d.avi'])
+        self.assertEqual(len(diff), 4)
+
+    def test_update_other_roots(self):
+        manifest = Manifest()
+        manifest.update('/music', {'/music/a.mp3': FileStat(1, 1.0, 1, 1)},
+            {})
+        diff = manifest.update('/media', {}, {})
+        self.assertEqual(len(diff), 0)
+        self.assertTrue('/music/a.mp3' in manifest.files)
+
+    def test_update_files(self):
+        manifest = Manifest()
+        manifest.update('/media', {
+            '/media/a.avi': FileStat(1, 1.0, 1, 1),
+            '/media/b.avi': FileStat(2, 1.0, 2, 1)
+        }, {})
+
+        diff = manifest.update_files({
+            '/media/a.avi': None,
+            '/media/c.avi': FileStat(1, 1.0, 1, 1),
+            '/media/d.avi': FileStat(3, 1.0, 3, 1)
+        })
+
+        self.assertEqual(diff.added, ['/media/d.avi'])
+        self.assertEqual(diff.moved, [('/media/a.avi', '/media/c.avi')])
+        self.assertEqual(diff.removed, [])
+        self.assertTrue('/media/b.avi' in manifest.files)
+        self.assertFalse('/media/a.avi' in manifest.files)
+
+    def test_save_load(self):
+        filename = os.path.join(self.test_dir, 'media.manifest')
+        manifest = Manifest(filename)
+        manifest.update('/media', {'/media/a.avi': FileStat(1, 1.0, 1, 1)},
+            {'/media': (1.0, ['a.avi'], [])})
+        manifest.save()
+
+        manifest = Manifest(filename)
+        manifest.load()
+        self.assertEqual(manifest.files['/media/a.avi'], (1, 1.0, 1, 1))
+        self.assertEqual(manifest.dirs['/media'], (1.0, ['a.avi'], []))
+
+class TestIndexerRescan(EncoreTest):
+    """
+    Tests for encore.backend.indexing.indexer.Indexer.rescan_directory.
+    """
+
+    def setUp(self):
+        super(TestIndexerRescan, self).setUp()
+        self.handler = RecordingHandler()
+        self.indexer = Indexer()
+        self.indexer.handlers = {'avi': self.handler}
+        os.makedirs(os.path.join(self.test_dir, 'Show', 'Season 1'))
+        self.touch('Show', 'Season 1', 'e01.avi')
+        self.touch('Show', 'Season 1', 'e02.avi')
+        self.touch('Show', 'notes.txt')
+
+    def touch(self, *path):
+        path = os.path.join(self.test_dir, *path)
+        open(path, 'w').write('x')
+        return path
+
+    def test_first_scan(self):
+        def rescanned(diff):
+            self.assertEqual(len(diff.added), 2)
+            self.assertEqual(len(self.handler.calls), 2)
+        return self.indexer.rescan_directory(self.test_dir).addCallback(
+            rescanned)
+
+    def test_unchanged(self):
+        def rescanned(diff):
+            self.assertEqual(len(diff), 0)
+            self.assertEqual(len(self.handler.calls), 2)
+
+        self.indexer.rescan_directory(self.test_dir)
+        return self.indexer.rescan_directory(self.test_dir).addCallback(
+            rescanned)
+
+    def test_changes(self):
+        def rescanned(diff):
+            self.assertEqual(diff.added, [new])
+            self.assertEqual(diff.moved, [(old, moved)])
+            self.assertEqual(diff.removed, [removed])
+            self.assertTrue(('moved', old, moved) in self.handler.calls)
+            self.assertTrue(('removed', removed) in self.handler.calls)
+
+        self.indexer.rescan_directory(self.test_dir)
+        old = os.path.join(self.test_dir, 'Show', 'Season 1', 'e01.avi')
+        moved = os.path.join(self.test_dir, 'Show', 'e01.avi')
+        os.rename(old, moved)
+        removed = os.path.join(self.test_dir, 'Show', 'Season 1', 'e02.avi')
+        os.remove(removed)
+        new = self.touch('Show', 'Season 1', 'e03.avi')
+        return self.indexer.rescan_directory(self.test_dir).addCallback(
+            rescanned)
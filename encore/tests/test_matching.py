@@ -0,0 +1,71 @@
+#
+# encore/tests/test_matching.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+from encore.lib.matching import Matcher, split_year, parse_year
+
+from encore.tests.test import EncoreTest
+
+class TestMatching(EncoreTest):
+    """
+    Tests for encore.lib.matching.
+    """
+
+    def setUp(self):
+        super(TestMatching, self).setUp()
+        self.matcher = Matcher()
+
+    def test_split_year(self):
+        self.assertEqual(split_year('The Office (2005)'), (['office'], 2005))
+        self.assertEqual(split_year('1984'), (['1984'], None))
+        self.assertEqual(parse_year('1999-09-16'), 1999)
+        self.assertEqual(parse_year(None), None)
+
+    def test_exact(self):
+        names = ['Prison Break: Proof of Innocence', 'Prison Break']
+        self.assertEqual(self.matcher.match('prison break', names), (1, 1.0))
+
+    def test_misspelt(self):
+        names = ['Lost', 'Prison Break', 'Breaking Bad']
+        index, score = self.matcher.match('prision break', names)
+        self.assertEqual(index, 1)
+        self.assertTrue(0.5 < score < 1.0)
+
+    def test_year(self):
+        names = ['Doctor Who', 'Doctor Who']
+        self.assertEqual(self.matcher.match('doctor who 2005', names,
+            [1963, 2005]), (1, 1.0))
+
+        names = ['Battlestar Galactica (1978)', 'Battlestar Galactica (2003)']
+        self.assertEqual(self.matcher.match('battlestar galactica 2004',
+            names)[0], 1)
+
+    def test_no_match(self):
+        index, score = self.matcher.match('futurama', ['Lost', 'Heroes'])
+        self.assertEqual(index, None)
+        self.assertEqual(self.matcher.match('futurama', []), (None, 0.0))
+
+    def test_decisions_cached(self):
+        names = ['Lost', 'Prison Break']
+        self.assertEqual(self.matcher.match('prison break', names)[0], 1)
+
+        self.matcher.rank = lambda *args: self.fail('scored again')
+        self.assertEqual(self.matcher.match('prison break', names)[0], 1)
@@ -0,0 +1,132 @@
+#
+# encore/tests/test_scheduler.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+from twisted.internet import defer
+
+from encore.backend.indexing.scheduler import DispatchQueue, JobGroup
+from encore.backend.indexing.scheduler import PRIORITY_NEW, PRIORITY_RECHECK
+
+from encore.tests.test import EncoreTest
+
+class SlowHandler(object):
+    """
+    A handler that doesn't complete until told to.
+    """
+
+    concurrency = 2
+
+    def __init__(self):
+        self.started = []
+        self.deferreds = []
+
+    def __call__(self, filename):
+        self.started.append(filename)
+        self.deferreds.append(defer.Deferred())
+        return self.deferreds[-1]
+
+    def finish(self):
+        self.deferreds.pop(0).callback(None)
+
+class FastHandler(object):
+    """
+    A handler that completes straight away.
+    """
+
+    concurrency = 1
+
+    def __call__(self, filename):
+        return filename
+
+class TestDispatchQueue(EncoreTest):
+    """
+    Tests for encore.backend.indexing.scheduler.DispatchQueue.
+    """
+
+    def test_concurrency(self):
+        queue = DispatchQueue()
+        handler = SlowHandler()
+        for i in xrange(5):
+            queue.submit(handler, (i,))
+        self.assertEqual(handler.started, [0, 1])
+
+        handler.finish()
+        self.assertEqual(handler.started, [0, 1, 2])
+
+    def test_limits(self):
+        queue = DispatchQueue(limits={SlowHandler: 1})
+        handler = SlowHandler()
+        for i in xrange(3):
+            queue.submit(handler, (i,))
+        self.assertEqual(handler.started, [0])
+
+    def test_priority(self):
+        queue = DispatchQueue(limits={SlowHandler: 1})
+        handler = SlowHandler()
+        queue.submit(handler, ('first',))
+        queue.submit(handler, ('recheck',), priority=PRIORITY_RECHECK)
+        queue.submit(handler, ('new',), priority=PRIORITY_NEW)
+
+        handler.finish()
+        handler.finish()
+        self.assertEqual(handler.started, ['first', 'new', 'recheck'])
+
+    def test_synchronous(self):
+        queue = DispatchQueue()
+        results = []
+        for i in xrange(5000):
+            queue.submit(FastHandler(), (i,)).addCallback(results.append)
+        self.assertEqual(len(results), 5000)
+
+    def test_back_pressure(self):
+        queue = DispatchQueue(max_pending=2)
+        handler = SlowHandler()
+        for i in xrange(4):
+            queue.submit(handler, (i,))
+        waiting = queue.wait()
+        self.assertTrue(isinstance(waiting, defer.Deferred))
+        self.assertFalse(waiting.called)
+
+        handler.finish()
+        self.assertTrue(waiting.called)
+        self.assertEqual(queue.wait(), None)
+
+    def test_progress(self):
+        progress = []
+        queue = DispatchQueue(progress=lambda *args: progress.append(args))
+        for i in xrange(3):
+            queue.submit(FastHandler(), (i,))
+        self.assertEqual(progress, [(1, 1), (2, 2), (3, 3)])
+
+class TestJobGroup(EncoreTest):
+    """
+    Tests for encore.backend.indexing.scheduler.JobGroup.
+    """
+
+    def test_group(self):
+        def completed(group):
+            self.assertEqual(group.completed, 2)
+            self.assertEqual(group.failed, 1)
+
+        group = JobGroup()
+        group.add(defer.succeed(None))
+        group.add(defer.fail(ValueError()))
+        return group.close().addCallback(completed)
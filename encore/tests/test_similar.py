@@ -0,0 +1,75 @@
+#
+# encore/tests/test_similar.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+from encore.backend.indexing import similar
+from encore.backend.indexing.similar import SimilarPhotos
+from encore.backend.model import Photo
+
+from encore.tests.test import EncoreDbTest
+
+class TestSimilarPhotos(EncoreDbTest):
+    """
+    Tests for encore.backend.indexing.similar.SimilarPhotos.
+    """
+
+    def setUp(self):
+        super(TestSimilarPhotos, self).setUp()
+        self.patch(similar, 'db', self.db)
+        for photo_id, phash in ((1, 'ff00000000000000'),
+                (2, 'ff00000000000003'), (3, '00000000000000ff'),
+                (4, None)):
+            photo = Photo()
+            photo.id = photo_id
+            photo.path = u'/photos/%d.jpg' % photo_id
+            photo.phash = phash
+            self.db.add(photo)
+        self.db.commit()
+        self.similar = SimilarPhotos(max_distance=4)
+
+    def test_find(self):
+        def on_found(results):
+            self.assertEqual(results, [(1, 1), (1, 2)])
+            self.assertTrue(self.similar.loaded)
+        return self.similar.find('ff00000000000001').addCallback(on_found)
+
+    def test_update(self):
+        # Updates made while loading take priority over the store
+        self.similar.update(2, '00000000000000fe')
+        self.similar.update(5, 'ff00000000000000')
+        self.similar.remove(1)
+
+        def on_found(results):
+            # 2 would be found by the hash in the store, 6 bits away
+            self.assertEqual(results, [(8, 3), (8, 5)])
+
+        d = self.similar.load()
+        d.addCallback(lambda _: self.similar.find('ff000000000000ff', 8))
+        d.addCallback(on_found)
+        return d
+
+    def test_duplicates(self):
+        self.similar.update(5, 'ff0000000000000f')
+
+        def on_grouped(groups):
+            # 1 and 5 differ by 4 bits, and are only grouped through 2
+            self.assertEqual(groups, [[1, 2, 5]])
+        return self.similar.duplicates(2).addCallback(on_grouped)
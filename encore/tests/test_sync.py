@@ -0,0 +1,114 @@
+#
+# encore/tests/test_sync.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+
+from twisted.internet import defer
+
+from encore.backend.indexing.scheduler import DispatchQueue
+from encore.backend.indexing.sync import MetadataSync
+from encore.backend.model import Episode, Show
+from encore.lib.tvdb import Updates
+
+from encore.tests.test import EncoreDbTest
+
+class FakeTvDb(object):
+
+    def __init__(self, updates):
+        self.updates = updates
+        self.invalidated = []
+
+    def get_updates(self, since):
+        self.since = since
+        return defer.succeed(self.updates)
+
+    def invalidate_series(self, *series_ids):
+        self.invalidated.extend(series_ids)
+
+class RecordingHandler(object):
+
+    concurrency = 1
+
+    def __init__(self):
+        self.handled = []
+
+    def __call__(self, path):
+        self.handled.append(path)
+
+class FakeIndexer(object):
+
+    def __init__(self):
+        self.queue = DispatchQueue()
+        self.handler = RecordingHandler()
+
+    def _get_handler(self, path):
+        return self.handler
+
+class TestMetadataSync(EncoreDbTest):
+    """
+    Tests for encore.backend.indexing.sync.MetadataSync.
+    """
+
+    def setUp(self):
+        super(TestMetadataSync, self).setUp()
+        # Series 3 isn't in the library
+        self.tvdb = FakeTvDb(Updates(2000, {1: 1500, 3: 1500}, {1: 1500}))
+        self.indexer = FakeIndexer()
+        self.sync = MetadataSync(self.indexer, self.tvdb,
+            os.path.join(self.test_dir, 'tvdb.sync'), database=self.db)
+
+        def add_episodes(session):
+            for series_id in (1, 2):
+                show = Show()
+                show.series_id = series_id
+                session.add(show)
+                session.flush()
+                for number, lastupdated in ((1, 1000), (2, 1800)):
+                    episode = Episode()
+                    episode.show_id = show.id
+                    episode.episode = number
+                    episode.path = os.path.join(self.test_dir,
+                        '%d-%d.avi' % (series_id, number))
+                    episode.lastupdated = lastupdated
+                    open(episode.path, 'w').write('x')
+                    session.add(episode)
+
+        return self.db.write(add_episodes).addCallback(
+            lambda result: self.db.flush())
+
+    def test_first_sync(self):
+        def on_synced(group):
+            self.assertEqual(self.tvdb.invalidated, [])
+            self.assertTrue(self.sync.last_sync > 0)
+        return self.sync.sync().addCallback(on_synced)
+
+    def test_sync(self):
+        self.sync.last_sync = 1200
+
+        def on_synced(group):
+            self.assertEqual(self.tvdb.since, 1200)
+            self.assertEqual(self.tvdb.invalidated, [1])
+            self.assertEqual(self.indexer.handler.handled,
+                [os.path.join(self.test_dir, '1-1.avi')])
+            self.assertEqual(self.sync.last_sync, 2000)
+
+        return self.sync.sync().addCallback(on_synced)
@@ -0,0 +1,178 @@
+#
+# encore/tests/test_tags.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+import struct
+import datetime
+
+from encore.backend.indexing.tags import read_tags, TagReader
+
+from encore.tests.test import EncoreTest
+
+def id3v1(title, artist, track, genre):
+    return ('TAG' + title.ljust(30, '\x00') + artist.ljust(30, '\x00') +
+        'Album'.ljust(30, '\x00') + '1999' + 'Comment'.ljust(28, '\x00') +
+        '\x00' + chr(track) + chr(genre))
+
+def id3v23(*frames):
+    data = ''.join([frame_id + struct.pack('>IH', len(body), 0) + body
+        for (frame_id, body) in frames]) + '\x00' * 32
+    size = ''.join([chr((len(data) >> shift) & 0x7f) for shift in
+        (21, 14, 7, 0)])
+    return 'ID3\x03\x00\x00' + size + data
+
+def vorbis_comments(vendor, *comments):
+    return (struct.pack('<I', len(vendor)) + vendor +
+        struct.pack('<I', len(comments)) + ''.join([struct.pack('<I',
+        len(comment)) + comment for comment in comments]))
+
+def ogg_page(serial, sequence, *packets, **kwargs):
+    lacing = ''
+    for packet in packets:
+        lacing += '\xff' * (len(packet) / 255) + chr(len(packet) % 255)
+
+    # A packet continued on the next page doesn't end with a short segment
+    if kwargs.get('continued'):
+        lacing = lacing[:-1]
+    return ('OggS\x00\x00' + '\x00' * 8 + struct.pack('<II', serial,
+        sequence) + '\x00' * 4 + chr(len(lacing)) + lacing +
+        ''.join(packets))
+
+def atom(atom_type, data):
+    return struct.pack('>I', len(data) + 8) + atom_type + data
+
+def mp4_item(item_type, data, flags=1):
+    return atom(item_type, atom('data', struct.pack('>II', flags, 0) + data))
+
+class TestTags(EncoreTest):
+    """
+    Tests for encore.backend.indexing.tags.
+    """
+
+    def write(self, name, data):
+        path = os.path.join(self.test_dir, name)
+        open(path, 'wb').write(data)
+        return path
+
+    def test_id3v1(self):
+        path = self.write('a.mp3', '\xff\xfb' + '\x00' * 1000 +
+            id3v1('Title', 'Artist', 7, 17))
+        tags = read_tags(path)
+        self.assertEqual(tags['title'], u'Title')
+        self.assertEqual(tags['artist'], u'Artist')
+        self.assertEqual(tags['track-number'], 7)
+        self.assertEqual(tags['genre'], u'Rock')
+        self.assertEqual(tags['date'], datetime.date(1999, 1, 1))
+
+    def test_id3v23(self):
+        title = u'T\xeftle'.encode('utf-16')
+        path = self.write('a.mp3', id3v23(
+            ('APIC', '\x00image/jpeg\x00\x03\x00' + 'x' * 100000),
+            ('TIT2', '\x01' + title),
+            ('TRCK', '\x003/12'),
+            ('TCON', '\x00(17)'),
+            ('TYER', '\x002001'),
+            ('TDAT', '\x002512'),
+            ('COMM', '\x00engiTunNORM\x00 000'),
+            ('COMM', '\x00eng\x00A comment'),
+            ('UFID', 'http://musicbrainz.org\x00abcd'),
+        ) + '\xff\xfb' * 100 + id3v1('Other', 'Artist', 1, 0))
+
+        tags = read_tags(path)
+        self.assertEqual(tags['title'], u'T\xeftle')
+        self.assertEqual(tags['track-number'], 3)
+        self.assertEqual(tags['track-count'], 12)
+        self.assertEqual(tags['genre'], u'Rock')
+        self.assertEqual(tags['date'], datetime.date(2001, 12, 25))
+        self.assertEqual(tags['comment'], u'A comment')
+        self.assertEqual(tags['musicbrainz-trackid'], u'abcd')
+
+        # Tags missing from the ID3v2 tag are taken from the ID3v1 one
+        self.assertEqual(tags['artist'], u'Artist')
+
+    def test_ogg_vorbis(self):
+        comments = '\x03vorbis' + vorbis_comments('libVorbis',
+            'TITLE=Title', 'ARTIST=Art\xc3\xaest', 'TRACKNUMBER=4',
+            'DATE=2004-05-06', 'COMMENT=' + 'x' * 600) + '\x01'
+        path = self.write('a.ogg', ogg_page(1, 0, '\x01vorbis' + 'x' * 23) +
+            ogg_page(2, 0, 'other stream') +
+            ogg_page(1, 1, comments[:510], continued=True) + ogg_page(1, 2, comments[510:]))
+
+        tags = read_tags(path)
+        self.assertEqual(tags['title'], u'Title')
+        self.assertEqual(tags['artist'], u'Art\xeest')
+        self.assertEqual(tags['track-number'], 4)
+        self.assertEqual(tags['date'], datetime.date(2004, 5, 6))
+        self.assertEqual(tags['comment'], u'x' * 600)
+
+    def test_flac(self):
+        picture = '\x06' + struct.pack('>I', 50000)[1:] + 'x' * 50000
+        comments = vorbis_comments('reference libFLAC', 'ALBUM=Album',
+            'DISCNUMBER=2/3')
+        path = self.write('a.flac', 'fLaC' + picture + '\x84' +
+            struct.pack('>I', len(comments))[1:] + comments)
+
+        tags = read_tags(path)
+        self.assertEqual(tags['album'], u'Album')
+        self.assertEqual(tags['album-disc-number'], 2)
+        self.assertEqual(tags['album-disc-count'], 3)
+
+    def test_mp4(self):
+        ilst = atom('ilst', mp4_item('\xa9nam', 'Title') +
+            mp4_item('covr', 'x' * 100000, 13) +
+            mp4_item('trkn', struct.pack('>HHHH', 0, 5, 10, 0), 0) +
+            mp4_item('gnre', struct.pack('>H', 18), 0) +
+            mp4_item('\xa9day', '2009-05-12T07:00:00Z') +
+            atom('----', atom('mean', '\x00' * 4 + 'com.apple.iTunes') +
+                atom('name', '\x00' * 4 + 'MusicBrainz Album Id') +
+                atom('data', struct.pack('>II', 1, 0) + 'efgh')))
+        moov = atom('moov', atom('mvhd', '\x00' * 100) + atom('udta',
+            atom('meta', '\x00' * 4 + atom('hdlr', '\x00' * 25) + ilst)))
+        path = self.write('a.m4a', atom('ftyp', 'M4A \x00\x00\x00\x00') +
+            atom('mdat', 'x' * 10000) + moov)
+
+        tags = read_tags(path)
+        self.assertEqual(tags['title'], u'Title')
+        self.assertEqual(tags['track-number'], 5)
+        self.assertEqual(tags['track-count'], 10)
+        self.assertEqual(tags['genre'], u'Rock')
+        self.assertEqual(tags['date'], datetime.date(2009, 5, 12))
+        self.assertEqual(tags['musicbrainz-albumid'], u'efgh')
+
+    def test_corrupt(self):
+        path = self.write('a.mp3', id3v23(('TIT2', '\x00Title'))[:20])
+        self.assertEqual(read_tags(path), {})
+        self.assertRaises(IOError, read_tags, '/missing.mp3')
+
+    def test_reader(self):
+        path = os.path.join(self.data_dir, 'test.mp3')
+        reader = TagReader(processes=2)
+
+        def on_read(results):
+            self.assertEqual(results['/missing.mp3'], None)
+            self.assertEqual(results[path]['artist'], u'Iron and Wine')
+            self.assertEqual(results[path]['date'], datetime.date(2000, 1, 1))
+
+        d = reader.read_files([path, '/missing.mp3'])
+        d.addCallback(on_read)
+        d.addBoth(lambda result: reader.stop().addCallback(lambda _: result))
+        return d
@@ -0,0 +1,110 @@
+#
+# encore/tests/test_thumbnails.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+
+from encore.backend.indexing.thumbnails import Image, Thumbnailer
+from encore.backend.indexing.thumbnails import THUMBNAIL_SIZES
+from encore.backend.indexing.thumbnails import dhash, make_file_thumbnails
+from encore.backend.indexing.thumbnails import make_thumbnails, thumbnail_path
+
+from encore.tests.test import EncoreTest
+
+FINGERPRINT = '00000000000bb800d41d8cd98f00b204'
+
+class TestThumbnails(EncoreTest):
+    """
+    Tests for encore.backend.indexing.thumbnails.
+    """
+
+    if Image is None:
+        skip = 'PIL is not installed'
+
+    def setUp(self):
+        super(TestThumbnails, self).setUp()
+        self.thumb_dir = os.path.join(self.test_dir, 'thumbnails')
+        self.path = os.path.join(self.test_dir, 'a.jpg')
+        Image.new('RGB', (2000, 1500), (200, 100, 50)).save(self.path)
+
+    def test_thumbnail_path(self):
+        self.assertEqual(thumbnail_path('/thumbs', FINGERPRINT, 'small'),
+            '/thumbs/small/00/%s.jpg' % FINGERPRINT)
+
+    def test_make_thumbnails(self):
+        width, height, phash = make_thumbnails(self.path, FINGERPRINT,
+            self.thumb_dir)
+        self.assertEqual((width, height), (2000, 1500))
+        self.assertEqual(len(phash), 16)
+        for size, max_size in THUMBNAIL_SIZES:
+            thumb = Image.open(thumbnail_path(self.thumb_dir, FINGERPRINT,
+                size))
+            self.assertEqual(max(thumb.size), max_size)
+            self.assertEqual(thumb.format, 'JPEG')
+
+    def test_existing(self):
+        phash = make_thumbnails(self.path, FINGERPRINT, self.thumb_dir)[2]
+        medium = thumbnail_path(self.thumb_dir, FINGERPRINT, 'medium')
+        open(medium, 'wb').write('existing')
+
+        # Only the missing thumbnails are made again, the hash is taken
+        # from the existing small one
+        large = thumbnail_path(self.thumb_dir, FINGERPRINT, 'large')
+        os.remove(large)
+        self.assertEqual(make_thumbnails(self.path, FINGERPRINT,
+            self.thumb_dir)[2], phash)
+        self.assertEqual(open(medium, 'rb').read(), 'existing')
+        self.assertTrue(os.path.isfile(large))
+
+    def test_dhash(self):
+        gradient = Image.new('L', (400, 300))
+        gradient.putdata([x % 400 * 255 / 400 for x in xrange(400 * 300)])
+        self.assertEqual(dhash(gradient), '0000000000000000')
+        self.assertEqual(dhash(gradient.transpose(Image.FLIP_LEFT_RIGHT)),
+            'ffffffffffffffff')
+
+        # Resizing and re-saving keeps the hash close
+        photo = Image.open(self.path)
+        photo.paste((20, 220, 90), (0, 0, 900, 700))
+        copy = os.path.join(self.test_dir, 'copy.jpg')
+        photo.resize((600, 450)).save(copy, 'JPEG', quality=40)
+        distance = bin(int(dhash(photo), 16) ^
+            int(dhash(Image.open(copy)), 16)).count('1')
+        self.assertTrue(distance <= 4)
+
+    def test_invalid(self):
+        open(self.path, 'wb').write('jpeg' * 1000)
+        self.assertEqual(make_file_thumbnails(self.path, FINGERPRINT,
+            self.thumb_dir), None)
+
+    def test_thumbnailer(self):
+        thumbnailer = Thumbnailer(processes=1, thumb_dir=self.thumb_dir)
+
+        def on_generated(result):
+            self.assertEqual(result[:2], (2000, 1500))
+            self.assertTrue(os.path.isfile(thumbnail_path(self.thumb_dir,
+                FINGERPRINT, 'medium')))
+
+        d = thumbnailer.generate(self.path, FINGERPRINT)
+        d.addCallback(on_generated)
+        d.addBoth(lambda result: thumbnailer.stop().addCallback(
+            lambda _: result))
+        return d
@@ -0,0 +1,165 @@
+#
+# encore/tests/test_tmdb.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+import xml.etree.cElementTree as ElementTree
+
+from twisted.internet import defer
+from twisted.web import error
+
+from encore.lib.cache import ResponseCache
+from encore.lib.tmdb import AsyncMovieDb, ImagesList, TmdHttpError
+from encore.lib.tmdb import TmdNoResults, config
+
+from encore.tests.test import EncoreTest
+
+SEARCH = """<?xml version="1.0" encoding="UTF-8"?>
+<OpenSearchDescription>
+  <movies>
+    <movie>
+      <name>Transformers</name>
+      <id>1858</id>
+      <released>2007-07-04</released>
+      <images>
+        <image type="poster" size="original" url="http://x/p.jpg" id="1"/>
+        <image type="poster" size="thumb" url="http://x/p_t.jpg" id="1"/>
+      </images>
+    </movie>
+  </movies>
+</OpenSearchDescription>
+"""
+
+INFO = """<?xml version="1.0" encoding="UTF-8"?>
+<OpenSearchDescription>
+  <movies>
+    <movie>
+      <name>Transformers</name>
+      <id>1858</id>
+      <categories>
+        <category type="genre" url="http://x/c/28" name="Action"/>
+      </categories>
+      <cast>
+        <person name="Shia LaBeouf" character="Sam" job="Actor" id="10959"
+          url="http://x/p/10959"/>
+      </cast>
+    </movie>
+  </movies>
+</OpenSearchDescription>
+"""
+
+EMPTY = """<?xml version="1.0" encoding="UTF-8"?>
+<OpenSearchDescription><movies></movies></OpenSearchDescription>
+"""
+
+class FakeHTTP(object):
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.fetched = []
+        self.pending = None
+
+    def get(self, url):
+        self.fetched.append(url)
+        if self.pending:
+            return self.pending
+        if url not in self.responses:
+            return defer.fail(error.Error(404, 'Not Found'))
+        return defer.succeed(self.responses[url])
+
+class TestAsyncMovieDb(EncoreTest):
+    """
+    Tests for encore.lib.tmdb.AsyncMovieDb.
+    """
+
+    def setUp(self):
+        super(TestAsyncMovieDb, self).setUp()
+        self.search_url = config['urls']['movie.search'] % 'Transformers'
+        self.info_url = config['urls']['movie.getInfo'] % 1858
+        self.empty_url = config['urls']['movie.getInfo'] % 1
+        self.http = FakeHTTP({self.search_url: SEARCH,
+            self.info_url: INFO, self.empty_url: EMPTY})
+        self.cache = ResponseCache(os.path.join(self.test_dir, 'tmdb.cache'))
+        self.mdb = AsyncMovieDb(self.cache, self.http)
+
+    def tearDown(self):
+        self.cache.close()
+        super(TestAsyncMovieDb, self).tearDown()
+
+    def test_search(self):
+        def got_results(results):
+            self.assertEqual(results[0]['id'], '1858')
+            self.assertEqual(results[0]['images'].posters[0]['thumb'],
+                'http://x/p_t.jpg')
+            return self.mdb.search(u'Transformers')
+
+        def got_cached(results):
+            self.assertEqual(results[0]['name'], 'Transformers')
+            self.assertEqual(self.http.fetched, [self.search_url])
+
+        return self.mdb.search(u'Transformers').addCallback(
+            got_results).addCallback(got_cached)
+
+    def test_coalesced(self):
+        self.http.pending = defer.Deferred()
+        requests = [self.mdb.search(u'Transformers') for i in xrange(2)]
+        self.http.pending.callback(SEARCH)
+        self.assertEqual(self.http.fetched, [self.search_url])
+        return defer.gatherResults(requests)
+
+    def test_images(self):
+        images = ImagesList()
+        for (_type, size, url, _id) in [('poster', 'original', 'p_o', '1'),
+                ('poster', 'thumb', 'p_t', '1'), ('backdrop', 'thumb', 'b_t',
+                '2'), ('poster', 'mid', 'p_m', '1'), ('poster', 'cover',
+                'q_c', '3')]:
+            images.set(ElementTree.Element('image', type=_type, size=size,
+                url=url, id=_id))
+
+        self.assertEqual(len(images), 3)
+        self.assertEqual([image['id'] for image in images.posters],
+            ['1', '3'])
+        self.assertEqual(images.find_by('id', '2'), [images[1]])
+        self.assertEqual(images[0].largest(), 'original')
+
+        self.assertEqual(images.best('poster'), 'p_o')
+        self.assertEqual(images.best('poster', 500), 'p_m')
+        self.assertEqual(images.best('poster', 200), 'p_t')
+        self.assertEqual(images.best('poster', 10), 'p_t')
+        self.assertEqual(images.best('backdrop', 1280), 'b_t')
+        self.assertEqual(images.best('person'), None)
+
+    def test_movie_info(self):
+        def got_info(movie):
+            self.assertEqual(movie['name'], 'Transformers')
+            self.assertEqual(movie['categories']['genre'].keys(), ['Action'])
+
+            # The cast isn't kept
+            self.assertFalse('cast' in movie)
+
+        return self.mdb.getMovieInfo(1858).addCallback(got_info)
+
+    def test_no_results(self):
+        return self.assertFailure(self.mdb.getMovieInfo(1), TmdNoResults)
+
+    def test_http_error(self):
+        return self.assertFailure(self.mdb.hashGetInfo('00277ff46533b155'),
+            TmdHttpError)
@@ -30,28 +30,34 @@ class TestVideoMetadataMovie(EncoreTest):
     """
 
     def test_get_movie_metadata(self):
-        movie = get_movie_metadata('transformers')
-        self.assertTrue(isinstance(movie, MovieMetadata))
+        def got_movie(movie):
+            self.assertTrue(isinstance(movie, MovieMetadata))
+        return get_movie_metadata('transformers').addCallback(got_movie)
 
     def test_get_movie_name(self):
-        movie = get_movie_metadata('transformers')
-        self.assertEqual(movie.name, 'Transformers')
+        def got_movie(movie):
+            self.assertEqual(movie.name, 'Transformers')
+        return get_movie_metadata('transformers').addCallback(got_movie)
 
     def test_get_movie_released(self):
-        movie = get_movie_metadata('transformers')
-        self.assertEqual(movie.released, '2007-07-04')
+        def got_movie(movie):
+            self.assertEqual(movie.released, '2007-07-04')
+        return get_movie_metadata('transformers').addCallback(got_movie)
 
     def test_get_movie_id(self):
-        movie = get_movie_metadata('transformers')
-        self.assertEqual(movie.id, '1858')
+        def got_movie(movie):
+            self.assertEqual(movie.id, '1858')
+        return get_movie_metadata('transformers').addCallback(got_movie)
 
     def test_get_movie_poster(self):
-        movie = get_movie_metadata('transformers')
-        self.assertTrue(movie.poster)
+        def got_movie(movie):
+            self.assertTrue(movie.poster)
+        return get_movie_metadata('transformers').addCallback(got_movie)
 
     def test_get_movie_backdrop(self):
-        movie = get_movie_metadata('transformers')
-        self.assertTrue(movie.backdrop)
+        def got_movie(movie):
+            self.assertTrue(movie.backdrop)
+        return get_movie_metadata('transformers').addCallback(got_movie)
 
 class TestVideoMetadataSeries(EncoreTest):
     """
@@ -179,3 +185,32 @@ class TestVideoMetadataParsePath(EncoreTest):
         filename = '/home/user/videos/Futurama - Season 2/something 05.avi'
         video_info = parse_path(filename)
         self.assertEqual(video_info.episode, 5)
+
+    def test_series_episode_subdir(self):
+        """
+        Ensure the episode is taken from the directory below the season
+        when there is one, and that the filename is used otherwise.
+        """
+        filename = '/home/user/videos/Futurama/Season 2/Disc 3/05.avi'
+        video_info = parse_path(filename)
+        self.assertEqual(video_info.episode, 3)
+
+        filename = '/home/user/videos/Futurama/Season 2/something.avi'
+        video_info = parse_path(filename)
+        self.assertEqual(video_info.season, None)
+
+    def test_parse_paths(self):
+        """
+        Ensure that parsing paths in bulk gives the same results as parsing
+        them one at a time.
+        """
+        filenames = [
+            '/home/user/videos/Futurama/Season 2/05 something.avi',
+            '/home/user/videos/Futurama/Season 2/06 something.avi',
+            '/home/user/videos/Futurama s02e07 something.avi',
+            '/home/user/videos/Some Movie (2009) [DVDRip].avi'
+        ]
+        self.assertEqual(parse_paths(filenames),
+            [parse_path(filename) for filename in filenames])
+        self.assertEqual(parse_paths(filenames)[3],
+            VideoFileInfo('some movie', None, None))
@@ -0,0 +1,90 @@
+#
+# encore/tests/test_walker.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+
+from twisted.internet import defer, reactor
+
+from encore.backend.indexing.walker import SimpleWalker, ParallelWalker
+
+from encore.tests.test import EncoreTest
+
+class TestWalker(EncoreTest):
+    """
+    Tests for the encore.backend.indexing.walker engines.
+    """
+
+    def setUp(self):
+        super(TestWalker, self).setUp()
+        self.expected = set()
+        for show in ('Futurama', 'Prison Break'):
+            for season in ('Season 1', 'Season 2'):
+                path = os.path.join(self.test_dir, show, season)
+                os.makedirs(path)
+                for episode in xrange(1, 4):
+                    filename = os.path.join(path, '%02d.avi' % episode)
+                    open(filename, 'w').write('x')
+                    self.expected.add(filename)
+                open(os.path.join(path, 'folder.nfo'), 'w').write('x')
+
+    def walk(self, walker):
+        found = set()
+
+        def on_directory(path, mtime, entries, subdirs):
+            found.update([fpath for (fpath, st) in entries])
+
+        def on_walked(result):
+            self.assertEqual(found, self.expected)
+
+        accept = lambda name: name.endswith('.avi')
+        return walker.walk(self.test_dir, accept, on_directory).addCallback(
+            on_walked)
+
+    def test_simple_walker(self):
+        return self.walk(SimpleWalker())
+
+    def test_parallel_walker(self):
+        walker = ParallelWalker(max_threads=2)
+        return self.walk(walker).addBoth(lambda result: walker.stop() or
+            result)
+
+    def test_back_pressure(self):
+        walker = ParallelWalker(max_threads=2)
+        paused = defer.Deferred()
+        calls = []
+
+        def on_directory(path, mtime, entries, subdirs):
+            calls.append(path)
+            if len(calls) == 1:
+                return paused
+
+        def resume():
+            self.assertEqual(len(calls), 1)
+            paused.callback(None)
+
+        def on_walked(result):
+            walker.stop()
+            self.assertEqual(len(calls), 7)
+
+        reactor.callLater(0.1, resume)
+        return walker.walk(self.test_dir, lambda name: True,
+            on_directory).addCallback(on_walked)
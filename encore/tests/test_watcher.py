@@ -0,0 +1,71 @@
+#
+# encore/tests/test_watcher.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+
+from twisted.internet import defer
+
+from encore.backend.indexing.watcher import Watcher
+
+from encore.tests.test import EncoreTest
+
+class TestWatcher(EncoreTest):
+    """
+    Tests for encore.backend.indexing.watcher.Watcher.
+    """
+
+    if not Watcher.is_supported():
+        skip = 'inotify is not supported'
+
+    def setUp(self):
+        super(TestWatcher, self).setUp()
+        self.changes = []
+        self.watcher = Watcher(self.on_changes, delay=0.1)
+        self.watcher.watch(self.test_dir)
+        self.deferred = defer.Deferred()
+
+    def tearDown(self):
+        self.watcher.stop()
+        super(TestWatcher, self).tearDown()
+
+    def on_changes(self, files, directories):
+        self.changes.append((files, directories))
+        self.deferred.callback(None)
+
+    def test_coalesce_files(self):
+        def changed(result):
+            self.assertEqual(len(self.changes), 1)
+            self.assertEqual(self.changes[0], (set(paths), set()))
+
+        paths = [os.path.join(self.test_dir, '%02d.avi' % i)
+            for i in xrange(1, 6)]
+        for path in paths:
+            open(path, 'w').write('x')
+        return self.deferred.addCallback(changed)
+
+    def test_directory(self):
+        def changed(result):
+            self.assertEqual(self.changes[0], (set(), set([path])))
+
+        path = os.path.join(self.test_dir, 'Season 1')
+        os.mkdir(path)
+        return self.deferred.addCallback(changed)
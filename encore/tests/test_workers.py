@@ -0,0 +1,91 @@
+#
+# encore/tests/test_workers.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import os
+
+from twisted.internet import defer
+from twisted.internet.error import ProcessTerminated
+
+from encore.backend.indexing.workers import WorkerPool
+
+from encore.tests.test import EncoreTest
+
+class TestWorkerPool(EncoreTest):
+    """
+    Tests for encore.backend.indexing.workers.WorkerPool.
+    """
+
+    def setUp(self):
+        super(TestWorkerPool, self).setUp()
+        self.filename = os.path.join(self.test_dir, 'movie.avi')
+        open(self.filename, 'wb').write(
+            ''.join([chr(i % 251) for i in xrange(200000)]))
+
+    def pool(self, module, processes):
+        pool = WorkerPool(module, processes)
+        self.addCleanup(pool.stop)
+        return pool
+
+    def test_killed(self):
+        pool = self.pool('encore.backend.indexing.hashing', 2)
+
+        def on_started(result):
+            # Kill a worker while it has a request pending
+            worker = pool._workers[0]
+            d = worker.call(self.filename)
+            worker.transport.signalProcess('KILL')
+            return self.assertFailure(d, ProcessTerminated
+                ).addCallback(lambda _: worker.ended)
+
+        def on_killed(result):
+            self.assertEqual(len(pool._workers), 1)
+            return defer.gatherResults([pool.call(self.filename)
+                for i in xrange(4)])
+
+        def on_hashed(hashes):
+            self.assertEqual(hashes, ['e19d5212c9812cd6'] * 4)
+            self.assertEqual(len(pool._workers), 2)
+
+        d = pool.call(self.filename)
+        d.addCallback(on_started)
+        d.addCallback(on_killed)
+        d.addCallback(on_hashed)
+        return d
+
+    def test_failed_request(self):
+        # A malformed request makes the thumbnail worker raise an error
+        pool = self.pool('encore.backend.indexing.thumbnails', 1)
+
+        def on_failed(result):
+            self.assertEqual(result, None)
+            return pool.call('\0'.join([self.filename, 'x', self.test_dir]))
+
+        def on_answered(result):
+            # The same worker is still answering requests
+            self.assertEqual(result, None)
+            self.assertEqual(len(pool._workers), 1)
+            self.assertFalse(pool._workers[0].ended.called)
+
+        d = pool.call('malformed')
+        d.addCallback(on_failed)
+        d.addCallback(on_answered)
+        return d
@@ -0,0 +1,61 @@
+#
+# encore/tests/test_xmlstream.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+from encore.lib.xmlstream import iterelements, record
+
+from encore.tests.test import EncoreTest
+
+BANNERS = """<?xml version="1.0" encoding="UTF-8" ?>
+<Banners>
+  <Banner><id>1</id><BannerPath>a.jpg</BannerPath><Season>1</Season></Banner>
+  <Banner><id>2</id><BannerPath>b.jpg</BannerPath><Colors/></Banner>
+</Banners>
+"""
+
+class TestXmlStream(EncoreTest):
+    """
+    Tests for encore.lib.xmlstream.
+    """
+
+    def test_iterelements(self):
+        elements = []
+        for elm in iterelements(BANNERS, ('Banner',)):
+            self.assertEqual(elm.findtext('id'), str(len(elements) + 1))
+            elements.append(elm)
+
+        # Elements are emptied once the next one has been parsed
+        self.assertEqual(len(elements), 2)
+        self.assertEqual(len(elements[0]), 0)
+
+    def test_record(self):
+        records = [record(elm) for elm in iterelements(BANNERS, ('Banner',))]
+        self.assertEqual(records[0], {'id': '1', 'bannerpath': 'a.jpg',
+            'season': '1'})
+        self.assertEqual(records[1]['colors'], None)
+
+        records = [record(elm, frozenset(['id'])) for elm in
+            iterelements(BANNERS, ('Banner',))]
+        self.assertEqual(records, [{'id': '1'}, {'id': '2'}])
+
+    def test_invalid(self):
+        self.assertRaises(SyntaxError, list,
+            iterelements('<Banners><Banner>', ('Banner',)))
@@ -0,0 +1,112 @@
+#
+# encore/utils/bktree.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+def hamming(a, b):
+    """
+    Return the number of bits that differ between two ints.
+    """
+    return bin(a ^ b).count('1')
+
+class BKTree(object):
+    """
+    A Burkhard-Keller tree, which finds the keys within a distance of a
+    key without comparing it to every key in the tree. The distance must
+    be a metric, e.g. the hamming distance between hashes.
+
+    Each key holds a list of values, so a value is removed from the tree by
+    removing it from its key's list. The key's node stays in the tree.
+
+    :param distance: The distance function
+    :type distance: callable
+    """
+
+    def __init__(self, distance=hamming):
+        self.distance = distance
+        self.root = None
+        self._size = 0
+
+    def add(self, key, value):
+        """
+        Add a value under a key.
+        """
+        self._size += 1
+        if self.root is None:
+            self.root = (key, [value], {})
+            return
+
+        node = self.root
+        while True:
+            distance = self.distance(key, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (key, [value], {})
+                return
+            node = child
+
+    def remove(self, key, value):
+        """
+        Remove a value from under a key.
+
+        :returns: Whether the value was in the tree
+        :rtype: bool
+        """
+        node = self.root
+        while node is not None:
+            distance = self.distance(key, node[0])
+            if distance == 0:
+                if value in node[1]:
+                    node[1].remove(value)
+                    self._size -= 1
+                    return True
+                return False
+            node = node[2].get(distance)
+        return False
+
+    def find(self, key, max_distance):
+        """
+        Find the values whose keys are within max_distance of a key.
+
+        :returns: A list of (distance, value), closest first
+        :rtype: list
+        """
+        results = []
+        nodes = self.root and [self.root] or []
+        while nodes:
+            node = nodes.pop()
+            distance = self.distance(key, node[0])
+            if distance <= max_distance:
+                results.extend((distance, value) for value in node[1])
+
+            # By the triangle inequality, matches can only be under the
+            # children within max_distance of the distance to this node.
+            low, high = distance - max_distance, distance + max_distance
+            for child_distance, child in node[2].iteritems():
+                if low <= child_distance <= high:
+                    nodes.append(child)
+        results.sort()
+        return results
+
+    def __len__(self):
+        return self._size
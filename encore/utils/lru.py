@@ -0,0 +1,85 @@
+#
+# encore/utils/lru.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+from collections import OrderedDict
+
+class LRUCache(object):
+    """
+    A mapping that holds at most max_size items, discarding the least
+    recently used item to make room for a new one.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        """
+        Return the item for key, marking it as the most recently used.
+        """
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            return default
+        self._items[key] = value
+        return value
+
+    def set(self, key, value):
+        """
+        Store an item, discarding the least recently used one if the
+        cache is full.
+        """
+        self._items.pop(key, None)
+        self._items[key] = value
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+def memoize(max_size=1024):
+    """
+    Decorator that caches the results of a function of hashable
+    arguments, keeping the max_size most recently used ones.
+    """
+    def decorator(func):
+        cache = LRUCache(max_size)
+        missing = object()
+
+        def wrapper(*args):
+            result = cache.get(args, missing)
+            if result is missing:
+                result = func(*args)
+                cache.set(args, result)
+            return result
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        wrapper.cache = cache
+        return wrapper
+    return decorator
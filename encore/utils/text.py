@@ -0,0 +1,61 @@
+#
+# encore/utils/text.py
+#
+# Copyright (C) 2010 Damien Churchill <damoxc@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA    02110-1301, USA.
+#
+
+import re
+
+PUNCTUATION_RE = re.compile(r'[^\w\s]|_', re.UNICODE)
+WHITESPACE_RE = re.compile(r'\s+', re.UNICODE)
+ARTICLE_RE = re.compile(r'^the\s')
+YEAR_RE = re.compile(r'\s(19|20)\d\d$')
+
+def normalize_title(title):
+    """
+    Normalize a title so that different spellings of it can be compared,
+    e.g. 'Prison.Break', "prison break" and 'Prison Break!' all become
+    'prison break'.
+
+    :param title: The title to normalize
+    :type title: unicode
+    :returns: The normalized title
+    :rtype: unicode
+    """
+    if not title:
+        return u''
+    if isinstance(title, str):
+        title = title.decode('utf-8', 'replace')
+    title = PUNCTUATION_RE.sub(' ', title.lower())
+    return WHITESPACE_RE.sub(' ', title).strip()
+
+def title_key(title):
+    """
+    Reduce a title further than normalize_title() so that it can be used
+    to look shows up, e.g. 'The Office (2005)' and 'office' both become
+    'office'. A leading 'the' and a trailing year are removed.
+
+    :param title: The title to reduce
+    :type title: unicode
+    :returns: The key for the title
+    :rtype: unicode
+    """
+    title = normalize_title(title)
+    key = YEAR_RE.sub('', ARTICLE_RE.sub('', title))
+    return key or title